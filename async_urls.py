@@ -0,0 +1,197 @@
+from typing import List, Optional, Annotated
+from uuid import UUID
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_views
+import schemas
+from fast_json import FastJSONResponse
+from settings import get_async_db, get_current_user_async, get_token_principal_async, TODAYS_CHOICE_RANKING
+
+# Routes async, montées AVANT urls.router quand DB_ASYNC=true (voir main.py).
+# Les paramètres {..:uuid} ne capturent que des UUID : une route de urls.py
+# absente d'ici (ex. /products/xyz) continue d'être servie par la pile sync.
+router = APIRouter(
+    prefix="/grosly_api_office",
+    tags=["API"]
+)
+
+# ======================================================
+# AUTH
+# ======================================================
+@router.post("/grosly_token_office", response_model=schemas.Token)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return await async_views.login_view(form_data, db)
+
+@router.post("/grosly_token_refresh_office", response_model=schemas.Token)
+async def refresh_token(refresh_token: str, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.refresh_token_view(refresh_token, db)
+
+@router.post("/grosly_logout_office", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(refresh_token: str, db: AsyncSession = Depends(get_async_db)):
+    await async_views.logout_view(refresh_token, db)
+
+@router.get("/current_user", response_model=schemas.UserRead, response_class=FastJSONResponse)
+async def current_user(current_user: schemas.UserRead = Depends(get_token_principal_async)):
+    return current_user
+
+# ======================================================
+# USERS
+# ======================================================
+@router.post("/users", response_model=schemas.UserRead, status_code=status.HTTP_201_CREATED)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.create_user_view(user, db)
+
+@router.get("/users/{user_id:uuid}", response_model=schemas.UserRead)
+async def get_user(user_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_user_view(user_id, db)
+
+@router.put("/users/{user_id:uuid}", response_model=schemas.UserRead)
+async def update_user(user_id: UUID, updates: schemas.UserUpdate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.update_user_view(user_id, updates, db)
+
+@router.delete("/users/{user_id:uuid}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user(user_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    await async_views.delete_user_view(user_id, db)
+
+# ======================================================
+# CATEGORIES
+# ======================================================
+@router.post("/categories", response_model=schemas.CategoryRead, status_code=status.HTTP_201_CREATED)
+async def create_category(category: schemas.CategoryCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.create_category_view(category, db)
+
+@router.get("/categories", response_class=FastJSONResponse)
+async def list_categories(db: AsyncSession = Depends(get_async_db)):
+    return await async_views.list_categories_view(db)
+
+@router.get("/categories/browse", response_class=FastJSONResponse)
+async def browse_categories(db: AsyncSession = Depends(get_async_db)):
+    return await async_views.browse_categories_view(db)
+
+@router.get("/categories/{category_id:uuid}", response_model=schemas.CategoryRead, response_class=FastJSONResponse)
+async def get_category(category_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_category_view(category_id, db)
+
+@router.put("/categories/{category_id:uuid}", response_model=schemas.CategoryRead)
+async def update_category(category_id: UUID, updates: schemas.CategoryUpdate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.update_category_view(category_id, updates, db)
+
+@router.delete("/categories/{category_id:uuid}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_category(category_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    await async_views.delete_category_view(category_id, db)
+
+# ======================================================
+# PRODUCTS
+# ======================================================
+@router.post("/products", response_model=schemas.ProductRead, status_code=status.HTTP_201_CREATED)
+async def create_product(product: schemas.ProductCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.create_product_view(product, db)
+
+@router.get("/products/todays-choice", response_class=FastJSONResponse)
+async def get_todays_choice(ranking: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_todays_choice_view(db, ranking or TODAYS_CHOICE_RANKING)
+
+@router.get("/products/limited-discount", response_class=FastJSONResponse)
+async def get_limited_discount(db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_limited_discount_view(db)
+
+@router.get("/products/cheapest", response_class=FastJSONResponse)
+async def get_cheapest_products(db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_cheapest_products_view(db)
+
+@router.get("/products/search", response_class=FastJSONResponse)
+async def search_products(params: Annotated[schemas.ProductSearchQuery, Query()], db: AsyncSession = Depends(get_async_db)):
+    return await async_views.search_products_view(params, db)
+
+@router.get("/products/export")
+async def export_products():
+    return await async_views.export_products_view()
+
+@router.get("/products", response_class=FastJSONResponse)
+async def list_products(params: Annotated[schemas.ProductListQuery, Query()], db: AsyncSession = Depends(get_async_db)):
+    return await async_views.list_products_view(params, db)
+
+@router.get("/products/{product_id:uuid}", response_model=schemas.ProductRead, response_class=FastJSONResponse)
+async def get_product(product_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_product_view(product_id, db)
+
+@router.put("/products/{product_id:uuid}", response_model=schemas.ProductRead)
+async def update_product(product_id: UUID, updates: schemas.ProductUpdate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.update_product_view(product_id, updates, db)
+
+@router.delete("/products/{product_id:uuid}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_product(product_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    await async_views.delete_product_view(product_id, db)
+
+# ======================================================
+# PRODUCT IMAGES
+# ======================================================
+@router.post("/products/{product_id:uuid}/images", response_model=schemas.ProductImageRead, status_code=status.HTTP_201_CREATED)
+async def add_product_image(product_id: UUID, image: schemas.ProductImageCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.add_product_image_view(product_id, image.image_url, image.is_main, db)
+
+@router.get("/products/{product_id:uuid}/images", response_model=list[schemas.ProductImageRead], response_class=FastJSONResponse)
+async def get_product_images(product_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_product_images_view(product_id, db)
+
+# ======================================================
+# CART
+# ======================================================
+@router.post("/cart/items", response_model=schemas.CartItemRead)
+async def add_to_cart(item: schemas.CartItemCreate, current_user: schemas.UserRead = Depends(get_current_user_async),
+                      db: AsyncSession = Depends(get_async_db)):
+    return await async_views.add_to_cart_view(current_user.id, item.product_id, item.quantity, db)
+
+@router.patch("/cart/items", response_model=List[schemas.CartItemRead])
+async def update_cart_items(update: schemas.CartItemsUpdate,
+                            current_user: schemas.UserRead = Depends(get_current_user_async),
+                            db: AsyncSession = Depends(get_async_db)):
+    return await async_views.update_cart_items_view(current_user.id, update, db)
+
+@router.get("/cart/{user_id:uuid}", response_model=schemas.CartRead, response_class=FastJSONResponse)
+async def get_cart(user_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.get_cart_view(user_id, db)
+
+@router.delete("/cart/{cart_id:uuid}", status_code=status.HTTP_204_NO_CONTENT)
+async def clear_cart(cart_id: UUID, db: AsyncSession = Depends(get_async_db)):
+    await async_views.clear_cart_view(cart_id, db)
+
+# ======================================================
+# ORDERS
+# ======================================================
+@router.post("/orders", response_model=schemas.OrderRead, status_code=status.HTTP_201_CREATED)
+async def create_order(order: schemas.OrderCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.create_order_view(order.user_id, order.address_id, order.items, db)
+
+# ======================================================
+# PAYMENTS
+# ======================================================
+@router.post("/payments", response_model=schemas.PaymentRead, status_code=status.HTTP_201_CREATED)
+async def create_payment(payment: schemas.PaymentCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.create_payment_view(payment.order_id, payment.amount, payment.method, db)
+
+# ======================================================
+# REVIEWS
+# ======================================================
+@router.post("/reviews", response_model=schemas.ReviewRead, status_code=status.HTTP_201_CREATED)
+async def create_review(review: schemas.ReviewCreate, db: AsyncSession = Depends(get_async_db)):
+    return await async_views.create_review_view(review.user_id, review.product_id, review.rating, review.comment, db)
+
+# ======================================================
+# CHATBOT
+# ======================================================
+@router.post("/chatbot")
+async def recipe_chatbot(request: schemas.ChatbotRequest):
+    """
+    Chatbot pour suggérer des recettes marocaines
+    """
+    return await async_views.recipe_chatbot_view(request.user_message)
+
+@router.post("/chatbot/stream")
+async def recipe_chatbot_stream(request: schemas.ChatbotRequest):
+    """
+    Chatbot en streaming (Server-Sent Events) : le texte arrive au fil de la génération
+    """
+    return await async_views.recipe_chatbot_stream_view(request.user_message)
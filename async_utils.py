@@ -0,0 +1,352 @@
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from settings import AsyncSessionLocal, create_token_pair
+from passwords import password_hasher
+import models
+import events  # noqa: F401 - publie les changements du catalogue (hooks de Session)
+import utils
+
+# Versions async des fonctions CRUD de utils.py (AsyncSession / asyncpg).
+# Les SELECT partagés (cartes produit, Today's choice...) viennent de utils.py ;
+# le hachage argon2 part dans le pool de processus de passwords.py.
+
+# ======================================================
+# AUTH / USERS
+# ======================================================
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = (await db.execute(utils.user_by_email_select(email))).scalars().first()
+    if not user:
+        return None
+    valid, new_hash = await password_hasher.verify_and_update_async(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    return user
+
+# ======================================================
+# JETONS DE RAFRAÎCHISSEMENT (rotation, révocation)
+# ======================================================
+async def start_token_family(db: AsyncSession, user) -> dict:
+    token = utils.new_refresh_token(user.id)
+    db.add(token)
+    tokens = create_token_pair(user, token)
+    await db.commit()
+    return tokens
+
+async def revoke_refresh_tokens(db: AsyncSession, *criteria):
+    now = datetime.now(timezone.utc)
+    for token in (await db.execute(utils.live_refresh_tokens_select(*criteria))).scalars():
+        token.revoked_at = now
+
+async def rotate_refresh_token(db: AsyncSession, payload: dict) -> dict:
+    jti, family_id = utils.refresh_token_ids(payload)
+    token = (await db.execute(utils.refresh_token_select(jti))).scalars().first()
+    if token is None or token.family_id != family_id:
+        raise utils.InvalidRefreshToken("unknown jti")
+    if token.used_at is not None and token.revoked_at is None:
+        await revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id)
+        await db.commit()
+        raise utils.InvalidRefreshToken("reused")
+    if token.used_at is not None or token.revoked_at is not None:
+        await db.rollback()
+        raise utils.InvalidRefreshToken("revoked")
+    token.used_at = datetime.now(timezone.utc)
+    successor = utils.new_refresh_token(token.user_id, family_id)
+    db.add(successor)
+    tokens = create_token_pair(await get_user(db, token.user_id), successor)
+    await db.commit()
+    return tokens
+
+async def revoke_token_family(db: AsyncSession, payload: dict):
+    _, family_id = utils.refresh_token_ids(payload)
+    await revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id)
+    await db.commit()
+
+# ======================================================
+# CRUD USERS
+# ======================================================
+async def create_user(db: AsyncSession, user):
+    utils.require_terms(user)
+    if (await db.execute(utils.user_by_email_select(user.email))).first():
+        raise utils.DuplicateEmailError(user.email)
+    hashed_password = await password_hasher.hash_async(user.password)
+    db_user = models.UserProfile(
+        userlastname=user.userlastname,
+        userfirstname=user.userfirstname,
+        email=utils.normalize_email(user.email),
+        phone_number=user.phone_number,
+        pays=user.pays,
+        indicatif_pays=user.indicatif_pays,
+        adresse=user.adresse,
+        termes_active=user.termes_active,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    await commit_user(db)
+    await db.refresh(db_user)
+    return db_user
+
+async def commit_user(db: AsyncSession):
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if "ux_profiles_utilisateurs_email" in str(e.orig):
+            raise utils.DuplicateEmailError() from e
+        raise
+
+async def get_user(db: AsyncSession, user_id: str):
+    return await db.get(models.UserProfile, user_id)
+
+async def update_user(db: AsyncSession, user_id: str, updates):
+    user = await get_user(db, user_id)
+    if not user:
+        return None
+    for key, value in updates.dict(exclude_unset=True).items():
+        if key == "password":
+            setattr(user, "hashed_password", await password_hasher.hash_async(value))
+        elif key == "email":
+            setattr(user, key, utils.normalize_email(value))
+        else:
+            setattr(user, key, value)
+    await commit_user(db)
+    await db.refresh(user)
+    return user
+
+async def delete_user(db: AsyncSession, user_id: str):
+    user = await get_user(db, user_id)
+    if user:
+        await db.delete(user)
+        await db.commit()
+    return user
+
+# ======================================================
+# CRUD CATEGORIES
+# ======================================================
+async def create_category(db: AsyncSession, category):
+    slug = category.name.lower().replace(" ", "-")
+    db_category = models.Category(
+        name=category.name,
+        slug=slug,
+        is_active=category.is_active
+    )
+    db.add(db_category)
+    await db.commit()
+    await db.refresh(db_category)
+    return db_category
+
+async def get_category(db: AsyncSession, category_id: str):
+    return await db.get(models.Category, category_id)
+
+async def list_categories(db: AsyncSession):
+    return (await db.execute(select(models.Category))).scalars().all()
+
+async def update_category(db: AsyncSession, category_id: str, updates):
+    category = await get_category(db, category_id)
+    if not category:
+        return None
+    for key, value in updates.dict(exclude_unset=True).items():
+        setattr(category, key, value)
+    await db.commit()
+    await db.refresh(category)
+    return category
+
+async def delete_category(db: AsyncSession, category_id: str):
+    category = await get_category(db, category_id)
+    if category:
+        await db.delete(category)
+        await db.commit()
+    return category
+
+# ======================================================
+# CRUD PRODUITS
+# ======================================================
+async def create_product(db: AsyncSession, product):
+    slug = product.name.lower().replace(" ", "-")
+    db_product = models.Product(
+        name=product.name,
+        slug=slug,
+        description=product.description,
+        price=product.price,
+        promo_price=product.promo_price,
+        stock=product.stock,
+        is_active=product.is_active,
+        category_id=product.category_id
+    )
+    db.add(db_product)
+    await db.commit()
+    return await get_product(db, db_product.id)
+
+async def get_product(db: AsyncSession, product_id: str):
+    # Pas de lazy loading en async : les images sont chargées d'avance
+    result = await db.execute(
+        select(models.Product)
+        .options(selectinload(models.Product.images))
+        .where(models.Product.id == product_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def update_product(db: AsyncSession, product_id: str, updates):
+    product = await get_product(db, product_id)
+    if not product:
+        return None
+    for key, value in updates.dict(exclude_unset=True).items():
+        setattr(product, key, value)
+    await db.commit()
+    return await get_product(db, product_id)
+
+async def delete_product(db: AsyncSession, product_id: str):
+    product = await get_product(db, product_id)
+    if product:
+        await db.delete(product)
+        await db.commit()
+    return product
+
+async def get_product_cards(db: AsyncSession, stmt) -> list[dict]:
+    return [utils.to_product_card(row) for row in (await db.execute(stmt)).all()]
+
+async def iter_catalog_ndjson(batch_size: int = utils.EXPORT_BATCH_SIZE):
+    """Version async de utils.iter_catalog_ndjson (AsyncSession.stream)"""
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(utils.catalog_export_select(batch_size))
+        async for partition in result.partitions():
+            images = (await db.execute(utils.catalog_images_select([row.id for row in partition]))).all()
+            yield utils.to_ndjson_lines(partition, images)
+
+# ======================================================
+# CRUD IMAGES PRODUITS
+# ======================================================
+async def add_product_image(db: AsyncSession, product_id: str, image_url: str, is_main: bool = False):
+    db_image = models.ProductImage(
+        product_id=product_id,
+        image_url=image_url,
+        is_main=is_main
+    )
+    db.add(db_image)
+    await db.commit()
+    await db.refresh(db_image)
+    return db_image
+
+async def get_product_images(db: AsyncSession, product_id: str):
+    result = await db.execute(
+        select(models.ProductImage).where(models.ProductImage.product_id == product_id)
+    )
+    return result.scalars().all()
+
+# ======================================================
+# CRUD PANIER
+# ======================================================
+async def _get_user_cart(db: AsyncSession, user_id: str):
+    result = await db.execute(
+        select(models.Cart)
+        .options(selectinload(models.Cart.items))
+        .where(models.Cart.user_id == user_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def add_to_cart(db: AsyncSession, user_id: str, product_id: str, quantity: int):
+    """Ajoute un produit au panier (créé au besoin) en une instruction ; None si le produit n'existe pas"""
+    row = (await db.execute(utils.cart_items_upsert(user_id, {product_id: quantity}))).first()
+    await db.commit()
+    return row
+
+async def update_cart_items(db: AsyncSession, user_id: str, changes: dict, replace: bool = False):
+    rows = (await db.execute(utils.cart_items_upsert(user_id, changes, replace))).all()
+    emptied = utils.emptied_cart_items_delete(rows)
+    if emptied is not None:
+        await db.execute(emptied)
+    await db.commit()
+    return [row for row in rows if row.quantity > 0]
+
+async def get_cart(db: AsyncSession, user_id: str):
+    """Récupère le panier d'un utilisateur, le crée s'il n'existe pas"""
+    cart = await _get_user_cart(db, user_id)
+    if not cart:
+        print(f"ℹ️ Création d'un nouveau panier pour l'utilisateur {user_id}")
+        await db.execute(
+            insert(models.Cart).values(id=uuid.uuid4(), user_id=user_id)
+            .on_conflict_do_nothing(index_elements=[models.Cart.user_id])
+        )
+        await db.commit()
+        cart = await _get_user_cart(db, user_id)
+    return cart
+
+async def clear_cart(db: AsyncSession, cart_id: str):
+    """Vide le panier en supprimant tous ses items"""
+    result = await db.execute(
+        select(models.Cart)
+        .options(selectinload(models.Cart.items))
+        .where(models.Cart.id == cart_id)
+    )
+    cart = result.scalars().first()
+    if cart:
+        for item in cart.items:
+            await db.delete(item)
+        await db.commit()
+    return cart
+
+# ======================================================
+# CRUD COMMANDES
+# ======================================================
+async def create_order(db: AsyncSession, user_id: str, address_id: str, items: list):
+    """Crée une commande avec les items du panier"""
+    total_amount = sum([item.price * item.quantity for item in items])
+    db_order = models.Order(user_id=user_id, address_id=address_id, total_amount=total_amount)
+    db.add(db_order)
+    await db.flush()
+    for item in items:
+        db.add(models.OrderItem(
+            order_id=db_order.id,
+            product_id=item.product_id,
+            quantity=item.quantity,
+            price=item.price
+        ))
+    await db.commit()
+    result = await db.execute(
+        select(models.Order)
+        .options(selectinload(models.Order.items), selectinload(models.Order.payment))
+        .where(models.Order.id == db_order.id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+# ======================================================
+# CRUD PAIEMENTS
+# ======================================================
+async def create_payment(db: AsyncSession, order_id: str, amount: float, method: str = "Livraison"):
+    """Crée un paiement pour une commande"""
+    db_payment = models.Payment(
+        order_id=order_id,
+        amount=amount,
+        method=method,
+        status="pending"
+    )
+    db.add(db_payment)
+    await db.commit()
+    await db.refresh(db_payment)
+    return db_payment
+
+# ======================================================
+# CRUD REVIEWS
+# ======================================================
+async def create_review(db: AsyncSession, user_id: str, product_id: str, rating: int, comment: str = None):
+    """Crée un avis pour un produit"""
+    db_review = models.Review(
+        user_id=user_id,
+        product_id=product_id,
+        rating=rating,
+        comment=comment
+    )
+    db.add(db_review)
+    await db.commit()
+    await db.refresh(db_review)
+    return db_review
@@ -0,0 +1,280 @@
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
+from settings import (
+    get_refresh_token_payload,
+    TODAYS_CHOICE_RANKING, TODAYS_CHOICE_SIZE,
+)
+import async_utils
+import utils
+import schemas
+from cache import catalog_cache
+from chatbot import ingredient_index, suggest_recipe, recipe_sse_events, NO_INGREDIENTS_MESSAGE, SSE_HEADERS
+from fast_json import json_bytes, raw_json
+import models
+
+# Versions async des handlers de views.py, mêmes réponses et mêmes erreurs.
+
+# ======================================================
+# AUTH
+# ======================================================
+async def login_view(form_data: OAuth2PasswordRequestForm, db: AsyncSession):
+    user = await async_utils.authenticate_user(db, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await async_utils.start_token_family(db, user)
+
+async def refresh_token_view(refresh_token: str, db: AsyncSession):
+    payload = get_refresh_token_payload(refresh_token)
+    try:
+        return await async_utils.rotate_refresh_token(db, payload)
+    except utils.InvalidRefreshToken:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+
+async def logout_view(refresh_token: str, db: AsyncSession):
+    payload = get_refresh_token_payload(refresh_token)
+    try:
+        await async_utils.revoke_token_family(db, payload)
+    except utils.InvalidRefreshToken:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+
+# ======================================================
+# USERS
+# ======================================================
+async def create_user_view(user, db: AsyncSession):
+    try:
+        return await async_utils.create_user(db, user)
+    except utils.DuplicateEmailError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+
+async def get_user_view(user_id: str, db: AsyncSession):
+    user = await async_utils.get_user(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+async def update_user_view(user_id: str, updates, db: AsyncSession):
+    try:
+        user = await async_utils.update_user(db, user_id, updates)
+    except utils.DuplicateEmailError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+async def delete_user_view(user_id: str, db: AsyncSession):
+    user = await async_utils.delete_user(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"detail": "User deleted"}
+
+# ======================================================
+# CATEGORIES
+# ======================================================
+async def create_category_view(category, db: AsyncSession):
+    return await async_utils.create_category(db, category)
+
+async def get_category_view(category_id: str, db: AsyncSession):
+    async def load():
+        category = await async_utils.get_category(db, category_id)
+        return json_bytes(schemas.CategoryRead.model_validate(category)) if category else None
+    category = await catalog_cache.aget_or_load(("category", str(category_id)), load, tags=(f"category:{category_id}",))
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return raw_json(category)
+
+async def update_category_view(category_id: str, updates, db: AsyncSession):
+    category = await async_utils.update_category(db, category_id, updates)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return category
+
+async def delete_category_view(category_id: str, db: AsyncSession):
+    category = await async_utils.delete_category(db, category_id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return {"detail": "Category deleted"}
+
+async def list_categories_view(db: AsyncSession):
+    """Liste toutes les catégories"""
+    async def load():
+        categories = await async_utils.list_categories(db)
+        return json_bytes([schemas.CategoryRead.model_validate(c) for c in categories])
+    return raw_json(await catalog_cache.aget_or_load(("categories",), load, tags=("categories",)))
+
+async def browse_categories_view(db: AsyncSession):
+    """Catégories + compteurs en stock / promo + histogramme des prix (UNE SEULE requête)"""
+    async def load():
+        return json_bytes(utils.to_category_facets((await db.execute(utils.category_facets_select())).all()))
+    return raw_json(await catalog_cache.aget_or_load(("categories_browse",), load, tags=("products", "categories")))
+
+# ======================================================
+# PRODUCTS
+# ======================================================
+async def create_product_view(product, db: AsyncSession):
+    return await async_utils.create_product(db, product)
+
+async def get_product_view(product_id: str, db: AsyncSession):
+    async def load():
+        product = await async_utils.get_product(db, product_id)
+        return json_bytes(schemas.ProductRead.model_validate(product)) if product else None
+    product = await catalog_cache.aget_or_load(("product", str(product_id)), load, tags=(f"product:{product_id}",))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return raw_json(product)
+
+async def update_product_view(product_id: str, updates, db: AsyncSession):
+    product = await async_utils.update_product(db, product_id, updates)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+async def delete_product_view(product_id: str, db: AsyncSession):
+    product = await async_utils.delete_product(db, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return {"detail": "Product deleted"}
+
+async def list_products_view(params: schemas.ProductListQuery, db: AsyncSession):
+    """Page de produits (curseur + filtres), avec l'image principale en UNE SEULE requête"""
+    try:
+        stmt = utils.product_page_select(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    async def load():
+        return json_bytes(utils.to_product_page((await db.execute(stmt)).all(), params.limit, params.sort))
+    return raw_json(await catalog_cache.aget_or_load(("products", params.model_dump_json()), load, tags=("products",)))
+
+async def search_products_view(params: schemas.ProductSearchQuery, db: AsyncSession):
+    """Recherche plein texte (sans accents, tolérante aux fautes), triée par pertinence"""
+    try:
+        stmt = utils.product_search_select(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    async def load():
+        return json_bytes(utils.to_product_page((await db.execute(stmt)).all(), params.limit, "relevance"))
+    return raw_json(await catalog_cache.aget_or_load(("search", params.model_dump_json()), load, tags=("products",)))
+
+async def export_products_view():
+    """Export complet du catalogue en NDJSON, envoyé au fil de la lecture"""
+    return StreamingResponse(async_utils.iter_catalog_ndjson(), media_type="application/x-ndjson")
+
+# ======================================================
+# PRODUCT IMAGES
+# ======================================================
+async def add_product_image_view(product_id: str, image_url: str, is_main: bool, db: AsyncSession):
+    return await async_utils.add_product_image(db, product_id, image_url, is_main)
+
+async def get_product_images_view(product_id: str, db: AsyncSession):
+    return await async_utils.get_product_images(db, product_id)
+
+# ======================================================
+# CART
+# ======================================================
+async def add_to_cart_view(user_id: str, product_id: str, quantity: int, db: AsyncSession):
+    item = await async_utils.add_to_cart(db, user_id, product_id, quantity)
+    if not item:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return item
+
+async def update_cart_items_view(user_id: str, update, db: AsyncSession):
+    changes = utils.cart_changes(update.items, update.replace)
+    return await async_utils.update_cart_items(db, user_id, changes, update.replace)
+
+async def get_cart_view(user_id: str, db: AsyncSession):
+    cart = await async_utils.get_cart(db, user_id)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return raw_json(json_bytes(schemas.CartRead.model_validate(cart)))
+
+async def clear_cart_view(cart_id: str, db: AsyncSession):
+    cart = await async_utils.clear_cart(db, cart_id)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    return {"detail": "Cart cleared"}
+
+# ======================================================
+# ORDERS
+# ======================================================
+async def create_order_view(user_id: str, address_id: str, items: list, db: AsyncSession):
+    return await async_utils.create_order(db, user_id, address_id, items)
+
+# ======================================================
+# PAYMENTS
+# ======================================================
+async def create_payment_view(order_id: str, amount: float, method: str, db: AsyncSession):
+    return await async_utils.create_payment(db, order_id, amount, method)
+
+# ======================================================
+# REVIEWS
+# ======================================================
+async def create_review_view(user_id: str, product_id: str, rating: int, comment: str, db: AsyncSession):
+    return await async_utils.create_review(db, user_id, product_id, rating, comment)
+
+# ======================================================
+# FILTERED PRODUCTS (Today's choice, Limited discount, Cheapest)
+# ======================================================
+async def get_todays_choice_view(db: AsyncSession, ranking: str = TODAYS_CHOICE_RANKING):
+    """Récupère 10 produits de différentes catégories pour Today's choice (UNE SEULE requête)"""
+    if ranking not in utils.TODAYS_CHOICE_RANKINGS:
+        raise HTTPException(status_code=400, detail=f"Unknown ranking: {ranking}")
+    async def load():
+        return json_bytes(await async_utils.get_product_cards(db, utils.todays_choice_select(ranking, TODAYS_CHOICE_SIZE)))
+    return raw_json(await catalog_cache.aget_or_load(
+        ("todays_choice", ranking), load, tags=("products", "categories")
+    ))
+
+
+async def get_limited_discount_view(db: AsyncSession):
+    """Récupère les 10 produits avec promo"""
+    stmt = utils.product_cards_select().where(
+        models.Product.promo_price.isnot(None),
+        models.Product.stock > 0
+    ).limit(10)
+    async def load():
+        return json_bytes(await async_utils.get_product_cards(db, stmt))
+    return raw_json(await catalog_cache.aget_or_load(("limited_discount",), load, tags=("products",)))
+
+
+async def get_cheapest_products_view(db: AsyncSession):
+    """Récupère les 10 produits les moins chers"""
+    # Prix promo s'il existe, sinon prix normal (servi par ix_produits_effective_price_id)
+    stmt = utils.product_cards_select().where(
+        models.Product.stock > 0
+    ).order_by(
+        utils.effective_price(), models.Product.id
+    ).limit(10)
+    async def load():
+        return json_bytes(await async_utils.get_product_cards(db, stmt))
+    return raw_json(await catalog_cache.aget_or_load(("cheapest",), load, tags=("products",)))
+
+# ======================================================
+# CHATBOT
+# ======================================================
+async def recipe_chatbot_view(user_message: str):
+    # Index en mémoire : ne relit la base qu'après un changement du catalogue
+    ingredients, digest = await run_in_threadpool(ingredient_index.snapshot)
+    if not ingredients:
+        return {
+            "ingredients": [],
+            "chatbot_response": NO_INGREDIENTS_MESSAGE
+        }
+    # Appel Groq bloquant (ou attente d'un appel identique) : hors de la boucle d'événements
+    response = await run_in_threadpool(suggest_recipe, user_message, ingredients, digest)
+    return {
+        "ingredients": ingredients,
+        "chatbot_response": response
+    }
+
+async def recipe_chatbot_stream_view(user_message: str):
+    """Même réponse que /chatbot, envoyée en Server-Sent Events au fil de la génération"""
+    ingredients, digest = await run_in_threadpool(ingredient_index.snapshot)
+    return StreamingResponse(
+        recipe_sse_events(user_message, ingredients, digest), media_type="text/event-stream", headers=SSE_HEADERS
+    )
@@ -0,0 +1,178 @@
+import bisect
+import sys
+import threading
+from sqlalchemy import select
+import models
+import events
+from settings import SessionLocal
+from utils import normalize_text
+
+# ======================================================
+# AUTOCOMPLÉTION (index de préfixes en mémoire)
+# ======================================================
+# Tableau trié de clés normalisées + bisect : une frappe = une recherche
+# dichotomique, sans aller-retour en base. Chaque mot d'un nom est une entrée
+# ("poivron rouge" répond à "poi" et à "rou"). Les changements du catalogue
+# (hooks de Session / LISTEN) marquent les lignes à relire ; elles sont
+# rechargées en une requête à la prochaine frappe. Produits et catégories
+# désactivés (is_active = false) n'y entrent pas ; une ligne désactivée puis
+# relue en sort.
+MAX_DIRTY = 1000  # au-delà, une reconstruction complète coûte moins cher
+
+_SOURCES = {
+    "product": models.Product,
+    "category": models.Category,
+}
+
+
+def _active_names(model):
+    # is_active NULL : valeur par défaut (actif) des lignes antérieures à la colonne
+    return select(model.id, model.name).where(model.is_active.isnot(False))
+
+
+def _word_keys(name: str) -> list[str]:
+    words = normalize_text(name).split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    """Clés triées (parallèles à leurs références) + libellé par référence"""
+
+    def __init__(self):
+        self._keys = []      # clés normalisées, triées
+        self._refs = []      # (type, id) de chaque clé
+        self._labels = {}    # (type, id) -> (nom affiché, clés)
+        self._dirty = set()  # (type, id) à relire ; None = tout reconstruire
+        self._built = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.lookups = 0
+        self.refreshes = 0
+
+    # ---------- lecture ----------
+    def lookup(self, prefix: str, limit: int = 8) -> list[dict]:
+        key = normalize_text(prefix)
+        if not key:
+            return []
+        self._refresh()
+        self.lookups += 1
+        results, seen = [], set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i].startswith(key) and len(results) < limit:
+                ref = self._refs[i]
+                if ref not in seen:
+                    seen.add(ref)
+                    results.append({"type": ref[0], "id": ref[1], "name": self._labels[ref][0]})
+                i += 1
+        return results
+
+    # ---------- mise à jour ----------
+    def mark_dirty(self, entity: str, entity_id=None):
+        with self._lock:
+            if entity == "all" or (self._dirty is not None and len(self._dirty) >= MAX_DIRTY):
+                self._dirty = None
+            elif entity in _SOURCES and self._dirty is not None:
+                self._dirty.add((entity, str(entity_id)))
+
+    def _refresh(self):
+        if self._built and not self._dirty:
+            return
+        with self._refresh_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                rebuild = not self._built or dirty is None
+            if rebuild or dirty:
+                try:
+                    rows = self._load(None if rebuild else dirty)
+                except Exception:
+                    self.mark_dirty("all")
+                    raise
+                self._apply(rows, rebuild)
+
+    def _load(self, dirty) -> dict:
+        """(type, id) -> nom ; None pour une ligne supprimée ou désactivée"""
+        db = SessionLocal()
+        try:
+            if dirty is None:
+                return {
+                    (entity, str(row.id)): row.name
+                    for entity, model in _SOURCES.items()
+                    for row in db.execute(_active_names(model))
+                }
+            rows = {ref: None for ref in dirty}
+            for entity, model in _SOURCES.items():
+                ids = [entity_id for kind, entity_id in dirty if kind == entity]
+                if ids:
+                    for row in db.execute(_active_names(model).where(model.id.in_(ids))):
+                        rows[(entity, str(row.id))] = row.name
+            return rows
+        finally:
+            db.close()
+
+    def _apply(self, rows: dict, rebuild: bool):
+        with self._lock:
+            if rebuild:
+                entries = sorted(
+                    (key, ref) for ref, name in rows.items() if name for key in _word_keys(name)
+                )
+                self._keys = [key for key, _ in entries]
+                self._refs = [ref for _, ref in entries]
+                self._labels = {ref: (name, _word_keys(name)) for ref, name in rows.items() if name}
+                self._built = True
+            else:
+                for ref, name in rows.items():
+                    self._remove(ref)
+                    if name:
+                        self._insert(ref, name)
+            self.refreshes += 1
+
+    def _insert(self, ref, name: str):
+        keys = _word_keys(name)
+        self._labels[ref] = (name, keys)
+        for key in keys:
+            i = bisect.bisect_left(self._keys, key)
+            self._keys.insert(i, key)
+            self._refs.insert(i, ref)
+
+    def _remove(self, ref):
+        if ref not in self._labels:
+            return
+        _, keys = self._labels.pop(ref)
+        for key in keys:
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._refs[i] == ref:
+                    del self._keys[i]
+                    del self._refs[i]
+                    break
+                i += 1
+
+    # ---------- métriques ----------
+    def memory_bytes(self) -> int:
+        """Taille approximative (listes, chaînes, tuples, dictionnaire des libellés)"""
+        with self._lock:
+            size = sys.getsizeof(self._keys) + sys.getsizeof(self._refs) + sys.getsizeof(self._labels)
+            size += sum(sys.getsizeof(key) for key in self._keys)
+            size += sum(sys.getsizeof(ref) + sys.getsizeof(ref[1]) for ref in self._labels)
+            size += sum(sys.getsizeof(label) + sys.getsizeof(label[0]) + sys.getsizeof(label[1])
+                        for label in self._labels.values())
+        return size
+
+    def stats(self) -> dict:
+        return {
+            "built": self._built,
+            "items": len(self._labels),
+            "keys": len(self._keys),
+            "memory_bytes": self.memory_bytes(),
+            "lookups": self.lookups,
+            "refreshes": self.refreshes,
+        }
+
+
+autocomplete_index = PrefixIndex()
+
+
+@events.on_catalog_change
+def _mark_autocomplete_dirty(entity, entity_id):
+    autocomplete_index.mark_dirty(entity, entity_id)
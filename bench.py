@@ -0,0 +1,478 @@
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import timeit
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import create_engine, func, insert, or_, select, text
+from sqlalchemy.orm import Session
+import models
+import schemas
+from cache import LRUCache
+from fast_json import json_bytes
+
+# ======================================================
+# BENCHMARKS (python bench.py <commande>)
+# ======================================================
+
+def _report(label, seconds, number):
+    print(f"  {label:<42} {seconds / number * 1e6:>9.1f} µs/requête")
+
+
+def _fake_product(n_images=3):
+    now = datetime.now(timezone.utc)
+    product = models.Product(
+        id=uuid.uuid4(), name="Tomates cerises", slug="tomates-cerises",
+        description="Tomates cerises de saison, barquette de 500 g", price=3.2,
+        promo_price=2.5, stock=42, is_active=True, category_id=uuid.uuid4(),
+        weight="500g", created_at=now,
+    )
+    product.images = [
+        models.ProductImage(id=uuid.uuid4(), image_url=f"https://cdn.grosly.ma/{i}.jpg", is_main=(i == 0), created_at=now)
+        for i in range(n_images)
+    ]
+    return product
+
+
+def _fake_cart(n_items=20):
+    cart = models.Cart(id=uuid.uuid4(), user_id=uuid.uuid4(), created_at=datetime.now(timezone.utc))
+    cart.items = [
+        models.CartItem(id=uuid.uuid4(), product_id=uuid.uuid4(), quantity=i + 1, price=9.9)
+        for i in range(n_items)
+    ]
+    return cart
+
+
+def bench_json(number=20000):
+    """Sérialisation d'une réponse : chemin FastAPI standard vs to_json vs bytes en cache"""
+    cache = LRUCache(max_entries=16)
+    for label, obj, model in (
+        ("GET /products/{id}", _fake_product(), schemas.ProductRead),
+        ("GET /cart/{user_id}", _fake_cart(), schemas.CartRead),
+    ):
+        print(f"{label}")
+        # response_model : validation depuis l'ORM, dump "json", puis json.dumps (JSONResponse)
+        standard = lambda: json.dumps(
+            model.model_validate(obj).model_dump(mode="json"),
+            ensure_ascii=False, separators=(",", ":"),
+        ).encode("utf-8")
+        fast = lambda: json_bytes(model.model_validate(obj))
+        assert json.loads(standard()) == json.loads(fast())
+        cache.set(label, fast())
+        cached = lambda: cache.get(label)[1]
+        _report("response_model + json.dumps", timeit.timeit(standard, number=number), number)
+        _report("model_validate + to_json", timeit.timeit(fast, number=number), number)
+        _report("bytes du cache catalogue", timeit.timeit(cached, number=number), number)
+
+
+def _bench_engine():
+    # Jamais la base de l'application : le benchmark remplit ses tables
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        print("BENCH_DATABASE_URL requis (base jetable, extensions unaccent et pg_trgm disponibles)")
+        sys.exit(1)
+    engine = create_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+
+SEARCH_PRODUCTS = [
+    "Tomate", "Pomme de terre", "Oignon", "Carotte", "Courgette", "Aubergine", "Poivron", "Concombre",
+    "Citron", "Orange", "Pêche", "Abricot", "Pastèque", "Fraise", "Figue", "Datte", "Olive", "Menthe",
+    "Coriandre", "Persil", "Poulet", "Agneau", "Bœuf", "Merguez", "Sardine", "Crevette", "Lait",
+    "Crème fraîche", "Fromage", "Beurre", "Œuf", "Farine", "Semoule", "Riz", "Lentilles", "Pois chiches",
+    "Huile d'olive", "Miel", "Thé vert", "Café",
+]
+SEARCH_QUALIFIERS = ["bio", "extra", "fermier", "de saison", "premium", "entier", "en vrac", "séché", "frais", "local"]
+SEARCH_ORIGINS = ["du Souss", "de Meknès", "d'Agadir", "du Gharb", "de Béni Mellal", "importé", "d'Azrou", "de Fès"]
+
+
+def _seed_search_catalog(engine, total):
+    with Session(engine) as db:
+        existing = db.execute(select(func.count(models.Product.id))).scalar()
+        if existing >= total:
+            return
+        category_ids = [
+            db.execute(insert(models.Category).values(name=f"Bench {i}", slug=f"bench-{uuid.uuid4().hex[:8]}")
+                       .returning(models.Category.id)).scalar()
+            for i in range(10)
+        ]
+        rng = random.Random(42)
+        for start in range(existing, total, 5000):
+            rows = []
+            for n in range(start, min(start + 5000, total)):
+                name = f"{rng.choice(SEARCH_PRODUCTS)} {rng.choice(SEARCH_QUALIFIERS)} {rng.choice(SEARCH_ORIGINS)}"
+                rows.append({
+                    "id": uuid.uuid4(), "name": name, "slug": f"bench-{n}-{uuid.uuid4().hex[:6]}",
+                    "description": f"{name}, {rng.choice(SEARCH_QUALIFIERS)}, livré en 24h",
+                    "price": round(rng.uniform(2, 200), 2), "stock": rng.randint(0, 50),
+                    "is_active": True, "category_id": rng.choice(category_ids), "weight": "1kg",
+                })
+            db.execute(insert(models.Product), rows)
+        db.commit()
+    with engine.connect() as connection:
+        connection.exec_driver_sql(f"ANALYZE {models.Product.__tablename__}")
+
+
+def bench_search(total=100_000, repeat=20):
+    """GET /products/search sur un catalogue synthétique vs un ILIKE '%q%' (sans index)"""
+    import utils
+
+    engine = _bench_engine()
+    _seed_search_catalog(engine, total)
+    queries = {
+        "mot exact": "tomate",
+        "pluriel": "tomates",
+        "sans accents": "creme fraiche",
+        "faute de frappe": "courgete",
+        "description": "livré bio",
+    }
+    with Session(engine) as db:
+        for label, q in queries.items():
+            params = schemas.ProductSearchQuery(q=q)
+            stmt = utils.product_search_select(params)
+            baseline = select(models.Product.id).where(or_(
+                models.Product.name.ilike(f"%{q}%"), models.Product.description.ilike(f"%{q}%")
+            )).limit(params.limit)
+            timings = {}
+            for name, query in (("search", stmt), ("ilike", baseline)):
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    rows = db.execute(query).all()
+                timings[name] = ((time.perf_counter() - start) / repeat * 1000, len(rows))
+            print(f"{label:<16} q={q!r:<16} search {timings['search'][0]:7.2f} ms ({timings['search'][1]} lignes)"
+                  f"   ilike {timings['ilike'][0]:7.2f} ms ({timings['ilike'][1]} lignes)")
+
+
+# ======================================================
+# CHATBOT (faux serveur Groq local)
+# ======================================================
+FAKE_LLM_FIRST_TOKEN = float(os.getenv("FAKE_LLM_FIRST_TOKEN", "0.3"))   # s avant le 1er token
+FAKE_LLM_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.02"))  # s entre deux tokens
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))       # part de réponses 500
+FAKE_RECIPE = (
+    "Bismillah,\nSuggested dish: Tajine de poulet au citron confit et olives\n"
+    "Used ingredients: Poulet fermier, Citron confit, Olives vertes, Oignon, Ail, Gingembre, Safran, Coriandre, Persil\n"
+    "Missing ingredients: Huile d'olive, Sel, Poivre"
+)
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    """POST /openai/v1/chat/completions, réponse complète ou en flux SSE (format OpenAI)"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        tokens = FAKE_RECIPE.split(" ")
+        tokens = [token + " " for token in tokens[:-1]] + tokens[-1:]
+        base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body["model"]}
+        time.sleep(FAKE_LLM_FIRST_TOKEN)
+        if random.random() < FAKE_LLM_ERROR_RATE:
+            self.send_error(500)
+            return
+        if not body.get("stream"):
+            time.sleep(FAKE_LLM_TOKEN_DELAY * len(tokens))
+            payload = json.dumps({**base, "object": "chat.completion", "choices": [{
+                "index": 0, "message": {"role": "assistant", "content": FAKE_RECIPE}, "finish_reason": "stop",
+            }]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for token in tokens:
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "delta": {"content": token}, "finish_reason": None,
+            }]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(FAKE_LLM_TOKEN_DELAY)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_fake_llm() -> str:
+    """Démarre le faux Groq dans un thread ; renvoie l'URL à mettre dans GROQ_BASE_URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGroqHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def start_app() -> str:
+    """Lance grosly_app (uvicorn) dans un thread, contre le faux Groq (matcher et cache
+    de recettes coupés) ; renvoie son URL"""
+    os.environ["GROQ_BASE_URL"] = start_fake_llm()
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    # Chaque requête doit atteindre le faux Groq : ni recette locale ni cache
+    os.environ["RECIPE_MATCHER_ENABLED"] = "false"
+    os.environ["RECIPE_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("METRICS_TOKEN", "bench")
+    import uvicorn
+    from main import grosly_app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(grosly_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/grosly_api_office"
+
+
+def bench_chatbot_ttfb(number=5):
+    """Premier octet, premier texte de la recette et durée totale : /chatbot vs /chatbot/stream"""
+    import httpx
+
+    base_url = start_app()
+    with httpx.Client(timeout=60) as http:
+        for path in ("/chatbot", "/chatbot/stream"):
+            first_bytes, first_texts, totals = [], [], []
+            for i in range(number):
+                start = time.perf_counter()
+                first_byte = first_text = None
+                message = f"idée originale {path} {i} {time.time()}"
+                with http.stream("POST", base_url + path, json={"user_message": message}) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_raw():
+                        now = time.perf_counter() - start
+                        first_byte = first_byte or now
+                        # /chatbot : tout arrive d'un bloc ; /chatbot/stream : premier événement "delta"
+                        if first_text is None and (path == "/chatbot" or b"event: delta" in chunk):
+                            first_text = now
+                first_bytes.append(first_byte)
+                first_texts.append(first_text)
+                totals.append(time.perf_counter() - start)
+            print(f"{path:<16} premier octet {sum(first_bytes) / number * 1000:7.1f} ms"
+                  f"   premier texte {sum(first_texts) / number * 1000:7.1f} ms"
+                  f"   total {sum(totals) / number * 1000:7.1f} ms")
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+BENCH_CONCURRENCY = tuple(int(n) for n in os.getenv("BENCH_CONCURRENCY", "1,4,16,32,64").split(","))
+
+
+def bench_chatbot_load(levels=BENCH_CONCURRENCY, per_worker=5):
+    """
+    /chatbot sous charge croissante (messages uniques : ni recette locale ni cache).
+    Débit, latences p50/p95/p99, réponses dégradées, et saturation du threadpool
+    échantillonnée sur /metrics (dont la latence montre l'attente des autres routes sync).
+    """
+    import asyncio
+    import httpx
+
+    base_url = start_app()
+    metrics_headers = {"X-Metrics-Token": os.environ["METRICS_TOKEN"]}
+    from llm import RECIPE_DEGRADED_MESSAGE  # après start_app : utils.client doit viser le faux Groq
+    print(f"faux Groq : premier token {FAKE_LLM_FIRST_TOKEN}s, {FAKE_LLM_TOKEN_DELAY}s/token, "
+          f"{FAKE_LLM_ERROR_RATE:.0%} d'erreurs")
+    print(f"{'conc.':>5} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'dégradées':>9}"
+          f" {'threads max':>11} {'attente max':>11} {'/metrics p95':>12}")
+
+    async def run_level(http, concurrency):
+        latencies, degraded, errors, samples, metric_latencies = [], 0, 0, [], []
+        done = asyncio.Event()
+
+        async def worker(n):
+            nonlocal degraded, errors
+            for i in range(per_worker):
+                start = time.perf_counter()
+                response = await http.post(f"{base_url}/chatbot", json={"user_message": f"idée originale {n} {i} {time.time()}"})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+                elif response.json()["chatbot_response"] == RECIPE_DEGRADED_MESSAGE:
+                    degraded += 1
+
+        async def sampler():
+            while not done.is_set():
+                start = time.perf_counter()
+                samples.append((await http.get(f"{base_url}/metrics", headers=metrics_headers)).json()["threadpool"])
+                metric_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.1)
+
+        sampling = asyncio.create_task(sampler())
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await sampling
+        print(f"{concurrency:>5} {len(latencies) / elapsed:>7.1f}"
+              f" {_percentile(latencies, 50) * 1000:>6.0f}ms {_percentile(latencies, 95) * 1000:>6.0f}ms"
+              f" {_percentile(latencies, 99) * 1000:>6.0f}ms {degraded + errors:>9}"
+              f" {max(s['busy'] for s in samples):>8}/{samples[0]['size']} {max(s['waiting'] for s in samples):>11}"
+              f" {_percentile(metric_latencies, 95) * 1000:>10.0f}ms")
+
+    async def main():
+        limits = httpx.Limits(max_connections=max(levels) + 8)
+        async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+            for concurrency in levels:
+                await run_level(http, concurrency)
+            llm = (await http.get(f"{base_url}/metrics", headers=metrics_headers)).json()["llm"]
+        print(f"passerelle LLM : {llm['calls']} appels, {llm['shed']} refusés (file), "
+              f"{llm['rejected']} refusés (disjoncteur), {llm['timeouts']} délais dépassés")
+
+    asyncio.run(main())
+
+
+def bench_chatbot_prompt(total=5000, number=50):
+    """Taille du prompt et coût du classement des ingrédients sur un gros catalogue synthétique"""
+    import chatbot
+    import utils
+
+    rng = random.Random(42)
+    names = sorted({
+        f"{rng.choice(SEARCH_PRODUCTS)} {rng.choice(SEARCH_QUALIFIERS)} {rng.choice(SEARCH_ORIGINS)} {n}"
+        for n in range(total)
+    })
+    message = "Je voudrais un tajine de poulet au citron et aux olives"
+    ranker = chatbot.IngredientRanker()
+    start = time.perf_counter()
+    kept = ranker.select(message, names, "bench")
+    print(f"  première requête (vecteurs)  {(time.perf_counter() - start) * 1000:9.1f} ms")
+    _report("requêtes suivantes (même empreinte)",
+            timeit.timeit(lambda: ranker.select(message, names, "bench"), number=number), number)
+    full = utils.build_recipe_messages(names, message)[-1]["content"]
+    pruned = utils.build_recipe_messages(kept, message)[-1]["content"]
+    print(f"  prompt complet  ~{chatbot.estimate_tokens(full):>6} tokens ({len(names)} ingrédients)")
+    print(f"  prompt élagué   ~{chatbot.estimate_tokens(pruned):>6} tokens ({len(kept)} ingrédients)")
+    print(f"  extrait : {', '.join(kept[:6])}")
+
+
+def bench_recipe_match(number=20000):
+    """Recettes locales : coût d'une correspondance et part des messages servis sans Groq"""
+    from recipes import RecipeMatcher
+
+    matcher = RecipeMatcher()
+    stock = sorted({f"{name} {qualifier}" for name in SEARCH_PRODUCTS for qualifier in SEARCH_QUALIFIERS[:3]}
+                   | {"Ail", "Cumin", "Paprika", "Gingembre", "Safran", "Citron confit", "Aubergine", "Viande hachée"})
+    messages = [
+        "Je voudrais un tajine de poulet", "zaalouk", "une idée avec des aubergines", "kefta aux oeufs",
+        "tajine d'agneau aux pruneaux", "une recette rapide et légère", "des pâtes aux crevettes", "salade",
+    ]
+    for message in messages:
+        matcher.match(message, stock, "bench")
+    for message in messages:
+        source = "local" if matcher.match(message, stock, "bench") else "Groq"
+        _report(f"{message[:32]:<32} {source:>6}",
+                timeit.timeit(lambda: matcher.match(message, stock, "bench"), number=number), number)
+
+
+def bench_passwords(number=None):
+    """Connexions/s (vérification argon2) : dans les threads appelants vs pool de processus, par cœur"""
+    from concurrent.futures import ThreadPoolExecutor
+    import passwords
+
+    cores = os.cpu_count() or 1
+    hashed = passwords.pwd_context.hash("secret123")
+    print(f"argon2 t={passwords.ARGON2_TIME_COST} m={passwords.ARGON2_MEMORY_COST} KiB "
+          f"p={passwords.ARGON2_PARALLELISM}, {cores} cœur(s)")
+    for workers in sorted({0, 1, cores}):
+        hasher = passwords.PasswordHasher(workers=workers, max_pending=10_000)
+        hasher.start()
+        total = number or 20 * max(workers, 1)
+        # 16 requêtes simultanées, comme autant de threads du threadpool
+        with ThreadPoolExecutor(16) as threads:
+            start = time.perf_counter()
+            assert all(threads.map(lambda _: hasher.verify_and_update("secret123", hashed)[0], range(total)))
+            elapsed = time.perf_counter() - start
+        hasher.shutdown()
+        label = "dans les threads" if workers == 0 else f"pool de {workers} processus"
+        print(f"  {label:<24} {total / elapsed:7.1f} connexions/s   {total / elapsed / (workers or cores):7.1f} /s par cœur")
+
+
+def _seed_users(engine, total, hashed):
+    with engine.begin() as connection:
+        existing = connection.execute(select(func.count(models.UserProfile.id))).scalar()
+        if existing >= total:
+            return
+        # Généré côté serveur : un million de lignes en quelques secondes
+        connection.exec_driver_sql(
+            f"INSERT INTO {models.UserProfile.__tablename__} "
+            "(id, hashed_password, userlastname, userfirstname, email, pays) "
+            "SELECT gen_random_uuid(), %(hashed)s, 'Bench', 'User', "
+            "CASE WHEN n %% 2 = 0 THEN 'User' || n || '@Bench.ma' ELSE 'user' || n || '@bench.ma' END, 'Maroc' "
+            "FROM generate_series(%(start)s, %(stop)s) AS n",
+            {"hashed": hashed, "start": existing, "stop": total - 1},
+        )
+    with engine.connect() as connection:
+        connection.exec_driver_sql(f"ANALYZE {models.UserProfile.__tablename__}")
+
+
+def bench_login(total=1_000_000, repeat=200):
+    """Recherche du compte à la connexion : index lower(email) vs comparaisons sans index"""
+    import passwords
+    import utils
+
+    engine = _bench_engine()
+    # Base de benchmark créée avant l'index : on l'ajoute
+    for index in models.UserProfile.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    hashed = passwords.pwd_context.hash("secret123")
+    _seed_users(engine, total, hashed)
+    rng = random.Random(7)
+    # Saisies de l'utilisateur : casse quelconque, espaces autour
+    emails = [f"  USER{n}@bench.MA " for n in (rng.randrange(total) for _ in range(repeat))]
+    queries = {
+        "index lower(email)": lambda e: utils.user_by_email_select(e),
+        "email = (avant)": lambda e: select(models.UserProfile).where(models.UserProfile.email == e.strip()),
+        "email ILIKE": lambda e: select(models.UserProfile).where(models.UserProfile.email.ilike(e.strip())),
+    }
+    print(f"{total} comptes")
+    with Session(engine) as db:
+        plan = db.execute(text("EXPLAIN " + str(utils.user_by_email_select(emails[0]).compile(
+            engine, compile_kwargs={"literal_binds": True})))).scalars().first()
+        print(f"  plan : {plan}")
+        for label, query in queries.items():
+            # Les comparaisons sans index parcourent toute la table : moins de répétitions
+            sample = emails if label.startswith("index") else emails[:5]
+            found = 0
+            start = time.perf_counter()
+            for email in sample:
+                found += db.execute(query(email)).first() is not None
+            elapsed = (time.perf_counter() - start) / len(sample) * 1000
+            print(f"  {label:<20} {elapsed:9.3f} ms / connexion   trouvés {found}/{len(sample)}")
+        # Connexion complète : la recherche devient négligeable devant argon2
+        hasher = passwords.PasswordHasher(workers=0)
+        user = db.execute(utils.user_by_email_select(emails[0])).scalars().first()
+        start = time.perf_counter()
+        hasher.verify_and_update("secret123", user.hashed_password)
+        print(f"  vérification argon2  {(time.perf_counter() - start) * 1000:9.3f} ms")
+
+
+def help_cmd():
+    print("Utilisation : python bench.py [json|search|chatbot_ttfb|chatbot_load|chatbot_prompt|recipe_match|passwords|login]")
+
+COMMANDS = {
+    "json": bench_json,
+    "search": bench_search,
+    "chatbot_ttfb": bench_chatbot_ttfb,
+    "chatbot_load": bench_chatbot_load,
+    "chatbot_prompt": bench_chatbot_prompt,
+    "recipe_match": bench_recipe_match,
+    "passwords": bench_passwords,
+    "login": bench_login,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(1)
+    command = sys.argv[1]
+    if command in COMMANDS:
+        COMMANDS[command]()
+    else:
+        help_cmd()
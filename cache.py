@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ======================================================
+# CACHE LRU + TTL (par worker)
+# ======================================================
+class LRUCache:
+    """
+    Cache en mémoire borné en taille (éviction LRU) avec expiration (TTL).
+    Chaque entrée peut porter des tags pour être invalidée par groupe.
+    Thread-safe : les routes sync tournent dans le threadpool.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires_at, value, tags)
+        self._tags = {}                 # tag -> set(keys)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Retourne (trouvé, valeur)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key, value, tags=(), ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, tags=()):
+        found, value = self.get(key)
+        if found:
+            return value
+        value = loader()
+        if value is not None:
+            self.set(key, value, tags)
+        return value
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+# ======================================================
+# CACHE VERSIONNÉ (base des caches invalidés par événements)
+# ======================================================
+class VersionedCache(LRUCache):
+    """
+    LRU désactivable dont chaque invalidation incrémente `version` : une valeur
+    chargée pendant une invalidation n'est pas gardée (elle peut précéder l'écriture).
+    """
+
+    def __init__(self, enabled: bool = True, **kwargs):
+        super().__init__(**kwargs)
+        self.enabled = enabled
+        self.version = 0
+
+    def get(self, key):
+        if not self.enabled:
+            return False, None
+        return super().get(key)
+
+    def set(self, key, value, tags=(), ttl: float = None):
+        if self.enabled:
+            super().set(key, value, tags, ttl)
+
+    def get_or_load(self, key, loader, tags=()):
+        found, value = self.get(key)
+        if found:
+            return value
+        # Une invalidation pendant le chargement rend la valeur suspecte : on ne la garde pas
+        version = self.version
+        value = loader()
+        if value is not None and version == self.version:
+            self.set(key, value, tags)
+        return value
+
+    async def aget_or_load(self, key, loader, tags=()):
+        """Comme get_or_load, avec un loader async (pile DB_ASYNC)"""
+        found, value = self.get(key)
+        if found:
+            return value
+        version = self.version
+        value = await loader()
+        if value is not None and version == self.version:
+            self.set(key, value, tags)
+        return value
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self.version += 1
+        super().invalidate(*tags)
+
+    def invalidate_all(self):
+        with self._lock:
+            self.version += 1
+        self.clear()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "version": self.version, **super().stats()}
+
+# ======================================================
+# CACHE CATALOGUE
+# ======================================================
+# Tags utilisés :
+#   "products"       listes et vitrines de produits
+#   "product:<id>"   fiche d'un produit (avec ses images)
+#   "categories"     liste des catégories (+ Today's choice, qui en dépend)
+#   "category:<id>"  fiche d'une catégorie
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "1024"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+
+class CatalogCache(VersionedCache):
+    """Cache des lectures du catalogue, invalidé par produit / catégorie"""
+
+    def invalidate_product(self, product_id):
+        self.invalidate("products", f"product:{product_id}")
+
+    def invalidate_category(self, category_id):
+        # Les listes de produits peuvent être filtrées par catégorie
+        self.invalidate("categories", f"category:{category_id}", "products")
+
+
+catalog_cache = CatalogCache(
+    enabled=CATALOG_CACHE_ENABLED,
+    max_entries=CATALOG_CACHE_MAX_ENTRIES,
+    ttl=CATALOG_CACHE_TTL,
+)
+
+# ======================================================
+# CACHE DES UTILISATEURS AUTHENTIFIÉS (get_current_user)
+# ======================================================
+# Clé : (sub, iat) du jeton d'accès ; tag "user:<id>". Les modifications et
+# suppressions d'un utilisateur l'invalident (hooks de Session, puis
+# LISTEN/NOTIFY pour les autres workers) ; le TTL borne le reste.
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+
+
+class PrincipalCache(VersionedCache):
+    """Utilisateurs authentifiés, invalidés par utilisateur"""
+
+    def invalidate_user(self, user_id):
+        self.invalidate(f"user:{user_id}")
+
+
+principal_cache = PrincipalCache(
+    enabled=PRINCIPAL_CACHE_ENABLED,
+    max_entries=PRINCIPAL_CACHE_MAX_ENTRIES,
+    ttl=PRINCIPAL_CACHE_TTL,
+)
@@ -0,0 +1,390 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+import numpy as np
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+import models
+import events
+import utils
+from cache import LRUCache
+from llm import llm_gateway, LLMUnavailable, RECIPE_DEGRADED_MESSAGE
+from recipes import recipe_matcher
+from settings import SessionLocal
+
+# ======================================================
+# INGRÉDIENTS DISPONIBLES (index en mémoire du chatbot)
+# ======================================================
+# Noms des produits en stock, chargés par une projection (id, nom) puis
+# dédoublonnés sur leur forme normalisée. Un produit modifié (stock, nom,
+# suppression) est relu seul à la requête suivante ; en régime établi, le
+# chatbot ne touche plus la base.
+NO_INGREDIENTS_MESSAGE = "Désolé, aucun ingrédient n'est disponible pour le moment."
+
+
+class IngredientIndex:
+    def __init__(self):
+        self._names = {}            # product_id -> nom (produits en stock)
+        self._snapshot = ([], "")   # (noms dédoublonnés et triés, empreinte)
+        self._dirty = set()         # product_id à relire ; None = tout recharger
+        self._built = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+
+    def snapshot(self) -> tuple[list[str], str]:
+        """(ingrédients, empreinte de la liste) : l'empreinte change dès que la liste change"""
+        self._refresh()
+        return self._snapshot
+
+    def mark_dirty(self, entity: str, entity_id=None):
+        with self._lock:
+            if entity == "all":
+                self._dirty = None
+            elif entity == "product" and self._dirty is not None:
+                self._dirty.add(str(entity_id))
+
+    def _refresh(self):
+        if self._built and not self._dirty:
+            return
+        with self._refresh_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                reload = not self._built or dirty is None
+            if not reload and not dirty:
+                return
+            try:
+                rows = self._load(None if reload else dirty)
+            except Exception:
+                self.mark_dirty("all")
+                raise
+            with self._lock:
+                if reload:
+                    self._names = {}
+                for product_id in dirty or ():
+                    self._names.pop(product_id, None)
+                self._names.update(rows)
+                ingredients = _dedupe(self._names.values())
+                digest = hashlib.sha1("\n".join(ingredients).encode()).hexdigest()[:16]
+                self._snapshot = (ingredients, digest)
+                self._built = True
+                self.refreshes += 1
+
+    def _load(self, product_ids) -> dict:
+        stmt = select(models.Product.id, models.Product.name).where(
+            models.Product.stock > 0, models.Product.name.isnot(None)
+        )
+        if product_ids is not None:
+            stmt = stmt.where(models.Product.id.in_(product_ids))
+        db = SessionLocal()
+        try:
+            return {str(row.id): row.name for row in db.execute(stmt)}
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            "built": self._built,
+            "products": len(self._names),
+            "ingredients": len(self._snapshot[0]),
+            "digest": self._snapshot[1],
+            "refreshes": self.refreshes,
+        }
+
+
+def _dedupe(names) -> list[str]:
+    """Un nom par forme normalisée ("Tomate" / "tomate " -> "Tomate"), ordre stable"""
+    unique = {}
+    for name in sorted(names):
+        key = utils.normalize_text(name)
+        if key and key not in unique:
+            unique[key] = name.strip()
+    return sorted(unique.values(), key=utils.normalize_text)
+
+
+ingredient_index = IngredientIndex()
+
+
+@events.on_catalog_change
+def _mark_ingredients_dirty(entity, entity_id):
+    ingredient_index.mark_dirty(entity, entity_id)
+
+
+# ======================================================
+# PERTINENCE DES INGRÉDIENTS (prompt borné)
+# ======================================================
+# Chaque nom devient un vecteur de trigrammes de caractères hachés (NumPy),
+# comparé à chaque mot du message (similarité cosinus). Chaque mot "recrute"
+# ses meilleurs ingrédients à tour de rôle (le 1er de chaque mot, puis le 2e...)
+# pour qu'un mot fréquent ne remplisse pas tout le prompt. On garde ce
+# classement tant qu'il tient dans le budget de tokens ; le reste du prompt
+# ne change pas.
+INGREDIENT_TOKEN_BUDGET = int(os.getenv("CHATBOT_INGREDIENT_TOKEN_BUDGET", "400"))
+MAX_PROMPT_INGREDIENTS = int(os.getenv("CHATBOT_MAX_INGREDIENTS", "60"))
+NGRAM_DIM = 2048
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caractères par token, + le séparateur ", "
+    return len(text) // 4 + 2
+
+
+def _ngram_vectors(texts: list[str]) -> np.ndarray:
+    """Une ligne L2-normalisée par texte (trigrammes " mot " hachés par crc32, stable entre workers)"""
+    matrix = np.zeros((len(texts), NGRAM_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.split():
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                matrix[row, zlib.crc32(padded[i:i + 3].encode()) % NGRAM_DIM] += 1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class IngredientRanker:
+    def __init__(self, token_budget: int = INGREDIENT_TOKEN_BUDGET, max_ingredients: int = MAX_PROMPT_INGREDIENTS):
+        self.token_budget = token_budget
+        self.max_ingredients = max_ingredients
+        self._matrix = ("", None, None)   # (empreinte, vecteurs, coûts en tokens)
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.ingredients_seen = 0
+        self.ingredients_kept = 0
+
+    def select(self, user_message: str, ingredients: list[str], digest: str) -> list[str]:
+        """Ingrédients à mettre dans le prompt, dans leur ordre d'origine"""
+        costs = None
+        with self._lock:
+            if self._matrix[0] == digest:
+                _, vectors, costs = self._matrix
+        if costs is None:
+            vectors = _ngram_vectors([utils.normalize_text(name) for name in ingredients])
+            costs = np.array([estimate_tokens(name) for name in ingredients])
+            with self._lock:
+                self._matrix = (digest, vectors, costs)
+
+        if len(ingredients) <= self.max_ingredients and costs.sum() <= self.token_budget:
+            kept = ingredients
+        else:
+            words = utils.content_words(user_message)
+            order = self._rank(vectors, words)
+            within_budget = np.cumsum(costs[order]) <= self.token_budget
+            kept = [ingredients[i] for i in np.sort(order[within_budget][:self.max_ingredients])]
+
+        with self._lock:
+            self.prompts += 1
+            self.ingredients_seen += len(ingredients)
+            self.ingredients_kept += len(kept)
+        return kept
+
+    @staticmethod
+    def _rank(vectors: np.ndarray, words: list[str]) -> np.ndarray:
+        """Indices des ingrédients, du plus au moins pertinent (tri stable : sinon ordre alphabétique)"""
+        if not words:
+            return np.arange(len(vectors))
+        similarity = vectors @ _ngram_vectors(words).T
+        best, word = similarity.max(axis=1), similarity.argmax(axis=1)
+        by_score = np.argsort(-best, kind="stable")
+        # Rang de chaque ingrédient parmi ceux que "son" mot a recrutés
+        grouped = by_score[np.argsort(word[by_score], kind="stable")]
+        starts = np.searchsorted(word[grouped], word[grouped])
+        turn = np.empty(len(vectors), dtype=np.int64)
+        turn[grouped] = np.arange(len(grouped)) - starts
+        # Sans aucun trigramme commun, on départage par l'ordre de l'index
+        turn[best == 0] = len(vectors)
+        return np.lexsort((-best, turn))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "max_ingredients": self.max_ingredients,
+                "prompts": self.prompts,
+                "kept_ratio": round(self.ingredients_kept / self.ingredients_seen, 4) if self.ingredients_seen else None,
+            }
+
+
+ingredient_ranker = IngredientRanker()
+
+# ======================================================
+# CACHE DES RECETTES (+ requêtes identiques regroupées)
+# ======================================================
+# Clé : message normalisé (casse, accents, ponctuation) + empreinte des
+# ingrédients, donc une recette n'est jamais resservie après un changement
+# de stock. Les demandes identiques simultanées attendent l'appel en cours
+# au lieu d'en lancer un autre vers Groq.
+RECIPE_CACHE_ENABLED = os.getenv("RECIPE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RECIPE_CACHE_MAX_ENTRIES = int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "1000"))
+RECIPE_CACHE_TTL = float(os.getenv("RECIPE_CACHE_TTL", "3600"))
+
+
+def recipe_cache_key(user_message: str, digest: str) -> tuple:
+    return (" ".join(re.findall(r"\w+", utils.normalize_text(user_message))), digest)
+
+
+class RecipeCache(LRUCache):
+    def __init__(self, enabled: bool = True, **kwargs):
+        super().__init__(**kwargs)
+        self.enabled = enabled
+        self._inflight = {}          # clé -> Future de l'appel Groq en cours
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def get_or_generate(self, user_message: str, ingredients: list[str], digest: str) -> str:
+        if not self.enabled:
+            return self._generate(ingredients, user_message, digest)
+        key = recipe_cache_key(user_message, digest)
+        found, recipe = self.get(key)
+        if found:
+            self._count_saved()
+            return recipe
+        with self._lock:
+            # Un appel identique a pu se terminer depuis le get() ci-dessus
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return entry[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            recipe = future.result()
+            self._count_saved()
+            return recipe
+        try:
+            recipe = self._generate(ingredients, user_message, digest)
+            self.store(key, recipe)
+            future.set_result(recipe)
+            return recipe
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def lookup(self, user_message: str, digest: str):
+        """Recette en cache ou None (flux SSE)"""
+        if not self.enabled:
+            return None
+        found, recipe = self.get(recipe_cache_key(user_message, digest))
+        if found:
+            self._count_saved()
+        return recipe
+
+    def store(self, key: tuple, recipe: str):
+        # Les messages d'excuse (Groq en échec ou saturé) ne doivent pas être resservis
+        if self.enabled and recipe and recipe not in (utils.RECIPE_ERROR_MESSAGE, RECIPE_DEGRADED_MESSAGE):
+            self.set(key, recipe)
+
+    def record_upstream(self, seconds: float):
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_seconds += seconds
+
+    def _generate(self, ingredients, user_message, digest) -> str:
+        start = time.perf_counter()
+        recipe = llm_gateway.generate_recipe(ingredient_ranker.select(user_message, ingredients, digest), user_message)
+        # Une réponse dégradée n'a pas contacté Groq : elle fausserait la latence moyenne
+        if recipe != RECIPE_DEGRADED_MESSAGE:
+            self.record_upstream(time.perf_counter() - start)
+        return recipe
+
+    def _count_saved(self):
+        # Latence évitée estimée à la latence moyenne observée vers Groq
+        with self._lock:
+            if self.upstream_calls:
+                self.saved_seconds += self.upstream_seconds / self.upstream_calls
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                **stats,
+                "coalesced": self.coalesced,
+                "upstream_calls": self.upstream_calls,
+                "avg_upstream_ms": round(self.upstream_seconds / self.upstream_calls * 1000, 1) if self.upstream_calls else None,
+                "saved_upstream_seconds": round(self.saved_seconds, 3),
+            }
+
+
+recipe_cache = RecipeCache(
+    enabled=RECIPE_CACHE_ENABLED,
+    max_entries=RECIPE_CACHE_MAX_ENTRIES,
+    ttl=RECIPE_CACHE_TTL,
+)
+
+# ======================================================
+# RÉPONSE (recettes locales, puis cache / Groq)
+# ======================================================
+def suggest_recipe(user_message: str, ingredients: list[str], digest: str) -> str:
+    """Plat classique reconnu sans ambiguïté : réponse locale ; sinon cache / Groq"""
+    recipe = recipe_matcher.match(user_message, ingredients, digest)
+    if recipe is not None:
+        return recipe
+    recipe = recipe_cache.get_or_generate(user_message, ingredients, digest)
+    if recipe in (RECIPE_DEGRADED_MESSAGE, utils.RECIPE_ERROR_MESSAGE):
+        # Groq indisponible : une recette locale approchante vaut mieux qu'une excuse
+        return recipe_matcher.match(user_message, ingredients, digest, min_coverage=0) or recipe
+    return recipe
+
+# ======================================================
+# FLUX SSE (/chatbot/stream)
+# ======================================================
+# Événements : "ingredients" (liste), puis un "delta" par morceau de texte
+# reçu de Groq, éventuellement "error", et toujours "done" pour finir.
+# Le générateur tourne dans la boucle asyncio : le matcher et le classement
+# des ingrédients (vectorisation du catalogue au premier appel) passent par
+# le threadpool.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def recipe_sse_events(user_message: str, ingredients: list[str], digest: str):
+    yield sse_event("ingredients", ingredients)
+    if not ingredients:
+        yield sse_event("delta", NO_INGREDIENTS_MESSAGE)
+        yield sse_event("done", {})
+        return
+    ready = await run_in_threadpool(recipe_matcher.match, user_message, ingredients, digest)
+    if ready is None:
+        ready = recipe_cache.lookup(user_message, digest)
+    if ready is not None:
+        yield sse_event("delta", ready)
+        yield sse_event("done", {})
+        return
+    parts = []
+    start = time.perf_counter()
+    try:
+        prompt_ingredients = await run_in_threadpool(ingredient_ranker.select, user_message, ingredients, digest)
+        async for delta in llm_gateway.stream_recipe(prompt_ingredients, user_message):
+            parts.append(delta)
+            yield sse_event("delta", delta)
+    except Exception as e:
+        if not isinstance(e, LLMUnavailable):
+            print(f" Erreur lors de la génération de recette (flux): {e}")
+        # Rien d'envoyé encore : une recette locale approchante plutôt qu'une excuse
+        fallback = None if parts else await run_in_threadpool(
+            recipe_matcher.match, user_message, ingredients, digest, min_coverage=0
+        )
+        if fallback is not None:
+            yield sse_event("delta", fallback)
+        else:
+            yield sse_event("error", RECIPE_DEGRADED_MESSAGE if isinstance(e, LLMUnavailable) else utils.RECIPE_ERROR_MESSAGE)
+    else:
+        recipe_cache.record_upstream(time.perf_counter() - start)
+        recipe_cache.store(recipe_cache_key(user_message, digest), "".join(parts))
+    yield sse_event("done", {})
@@ -0,0 +1,109 @@
+import logging
+import random
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# ======================================================
+# POOL : temps d'attente au checkout
+# ======================================================
+class PoolWaitStats:
+    """Compteurs du temps passé à attendre une connexion libre dans le pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self.total_wait / waits * 1000, 3) if waits else 0.0,
+                "wait_ms_max": round(self.max_wait * 1000, 3),
+            }
+
+
+class _TimedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_status(engine, max_overflow: int) -> dict:
+    """État du pool : connexions prêtées, libres, en débordement et attente
+    (max_overflow : la valeur configurée, DB_MAX_OVERFLOW dans settings)"""
+    pool = getattr(engine, "sync_engine", engine).pool
+    status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "max_overflow": max_overflow,
+    }
+    if hasattr(pool, "wait_stats"):
+        status.update(pool.wait_stats.snapshot())
+    return status
+
+# ======================================================
+# LOG SQL ÉCHANTILLONNÉ (remplace echo=True)
+# ======================================================
+sql_logger = logging.getLogger("grosly.sql")
+if not sql_logger.handlers:
+    sql_logger.addHandler(logging.StreamHandler())
+    sql_logger.setLevel(logging.INFO)
+
+
+def install_query_log(engine, sample_rate: float = 0.0, slow_ms: float = 0.0):
+    """
+    Journalise une fraction `sample_rate` des requêtes, et toujours celles
+    qui dépassent `slow_ms` millisecondes (0 = désactivé).
+    """
+    if sample_rate <= 0 and slow_ms <= 0:
+        return
+    target = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(target, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._grosly_sampled = random.random() < sample_rate
+        context._grosly_start = time.perf_counter()
+
+    @event.listens_for(target, "after_cursor_execute")
+    def _log_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._grosly_start) * 1000
+        if slow_ms and elapsed_ms >= slow_ms:
+            sql_logger.warning("slow query %.1f ms: %s", elapsed_ms, statement)
+        elif context._grosly_sampled:
+            sql_logger.info("query %.1f ms: %s", elapsed_ms, statement)
@@ -0,0 +1,255 @@
+import json
+import os
+import select as io_select
+import threading
+import time
+import uuid
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+import models
+from settings import DATABASE_URL, SessionLocal, REFRESH_TOKEN_EXPIRE_DAYS
+from cache import catalog_cache, principal_cache
+from tokens import token_denylist
+
+# ======================================================
+# ÉVÉNEMENTS CATALOGUE (Postgres LISTEN/NOTIFY)
+# ======================================================
+# Toute modification ORM d'un produit, d'une catégorie ou d'une image (et
+# d'un utilisateur, pour le cache des utilisateurs authentifiés, ou la
+# révocation d'une famille de jetons, pour tokens.py) est publiée
+# par pg_notify dans la transaction qui la contient : Postgres ne la délivre
+# qu'au COMMIT, et jamais en cas de ROLLBACK. Le worker d'origine l'applique
+# localement après son commit ; les autres la reçoivent via le thread
+# d'écoute démarré dans main.py.
+CATALOG_CHANNEL = "grosly_catalog"
+# Seules ces entités changent la version du catalogue (ETag)
+CATALOG_ENTITIES = ("product", "category")
+CATALOG_EVENTS_ENABLED = os.getenv("CATALOG_EVENTS_ENABLED", "true").lower() in ("1", "true", "yes")
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_handlers = []
+
+# Dernière version du catalogue connue par ce worker (None = inconnue)
+catalog_version = None
+
+
+def set_catalog_version(version):
+    global catalog_version
+    if version is not None and (catalog_version is None or version > catalog_version):
+        catalog_version = version
+
+
+def load_catalog_version():
+    """Lit la version courante en base (démarrage, reconnexion de l'écoute)"""
+    db = SessionLocal()
+    try:
+        version = db.execute(select(models.CatalogVersion.version)).scalar()
+        set_catalog_version(version or 0)
+    finally:
+        db.close()
+
+
+def load_token_denylist():
+    """Familles révoquées dont des jetons sont encore valides (démarrage, reconnexion de l'écoute)"""
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(models.RefreshToken.family_id, func.max(models.RefreshToken.expires_at))
+            .where(models.RefreshToken.revoked_at.isnot(None), models.RefreshToken.expires_at > func.now())
+            .group_by(models.RefreshToken.family_id)
+        ).all()
+        token_denylist.replace({family_id: expires_at.timestamp() for family_id, expires_at in rows})
+    finally:
+        db.close()
+
+
+def on_catalog_change(handler):
+    """Enregistre handler(entity, entity_id) ; entity vaut "all" après une reconnexion"""
+    _handlers.append(handler)
+    return handler
+
+
+def dispatch(entity: str, entity_id=None):
+    for handler in _handlers:
+        try:
+            handler(entity, entity_id)
+        except Exception as e:
+            print(f"⚠️ Handler {handler.__name__} en échec pour {entity}:{entity_id}: {e}")
+
+
+@on_catalog_change
+def _invalidate_catalog_cache(entity, entity_id):
+    if entity == "product":
+        catalog_cache.invalidate_product(entity_id)
+    elif entity == "category":
+        catalog_cache.invalidate_category(entity_id)
+    elif entity == "all":
+        catalog_cache.invalidate_all()
+
+@on_catalog_change
+def _invalidate_principal_cache(entity, entity_id):
+    if entity == "user":
+        principal_cache.invalidate_user(entity_id)
+    elif entity == "all":
+        principal_cache.invalidate_all()
+
+@on_catalog_change
+def _revoke_token_family(entity, entity_id):
+    if entity == "token_family":
+        # Échéance inconnue ici : la plus lointaine possible pour un jeton de la famille
+        token_denylist.revoke(entity_id, time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+    elif entity == "all":
+        load_token_denylist()
+
+# ======================================================
+# PUBLICATION (hooks de Session)
+# ======================================================
+def _changed_entities(session):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, models.Product):
+            yield ("product", str(obj.id))
+        elif isinstance(obj, models.ProductImage):
+            yield ("product", str(obj.product_id))
+        elif isinstance(obj, models.Category):
+            yield ("category", str(obj.id))
+        elif isinstance(obj, models.UserProfile):
+            # Hors catalogue : invalide seulement le cache des utilisateurs authentifiés
+            yield ("user", str(obj.id))
+        elif isinstance(obj, models.RefreshToken) and obj.revoked_at is not None:
+            yield ("token_family", str(obj.family_id))
+
+
+def _bump_catalog_version(connection) -> int:
+    # Le verrou de ligne pris par l'UPDATE ordonne les versions comme les COMMIT
+    stmt = (
+        insert(models.CatalogVersion)
+        .values(id=1, version=1)
+        .on_conflict_do_update(
+            index_elements=[models.CatalogVersion.id],
+            set_={"version": models.CatalogVersion.version + 1},
+        )
+        .returning(models.CatalogVersion.version)
+    )
+    return connection.execute(stmt).scalar()
+
+
+@event.listens_for(Session, "after_flush")
+def _publish_catalog_changes(session, flush_context):
+    pending = session.info.setdefault("catalog_changes", set())
+    for change in _changed_entities(session):
+        if change in pending:
+            continue
+        pending.add(change)
+        connection = session.connection()
+        if "catalog_version" not in session.info and change[0] in CATALOG_ENTITIES:
+            session.info["catalog_version"] = _bump_catalog_version(connection)
+        if CATALOG_EVENTS_ENABLED:
+            payload = json.dumps({
+                "entity": change[0],
+                "id": change[1],
+                "version": session.info.get("catalog_version"),
+                "origin": WORKER_ID,
+            })
+            connection.execute(select(func.pg_notify(CATALOG_CHANNEL, payload)))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_changes(session):
+    for entity, entity_id in session.info.pop("catalog_changes", ()):
+        dispatch(entity, entity_id)
+    # Après l'invalidation : une nouvelle version ne doit jamais servir d'anciennes données
+    set_catalog_version(session.info.pop("catalog_version", None))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_changes(session, previous_transaction):
+    session.info.pop("catalog_changes", None)
+    session.info.pop("catalog_version", None)
+
+# ======================================================
+# ÉCOUTE (un thread par worker)
+# ======================================================
+class CatalogListener(threading.Thread):
+    """LISTEN sur une connexion dédiée (hors pool), avec reconnexion"""
+
+    def __init__(self, url: str = DATABASE_URL, poll_timeout: float = 5.0):
+        super().__init__(name="catalog-listener", daemon=True)
+        self._engine = create_engine(url, poolclass=NullPool)
+        self._poll_timeout = poll_timeout
+        self._stop_event = threading.Event()
+        self.received = 0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as e:
+                print(f"⚠️ Écoute {CATALOG_CHANNEL} interrompue: {e}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _listen(self):
+        raw = self._engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {CATALOG_CHANNEL}")
+            # Des notifications ont pu être perdues avant (re)connexion
+            dispatch("all")
+            load_catalog_version()
+            while not self._stop_event.is_set():
+                if io_select.select([conn], [], [], self._poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._handle(conn.notifies.pop(0).payload)
+        finally:
+            raw.close()
+
+    def _handle(self, payload: str):
+        self.received += 1
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            return
+        if change.get("origin") == WORKER_ID:
+            return
+        dispatch(change["entity"], change.get("id"))
+        set_catalog_version(change.get("version"))
+
+
+_listener = None
+
+
+def start_listener():
+    global _listener
+    if CATALOG_EVENTS_ENABLED and _listener is None:
+        _listener = CatalogListener()
+        _listener.start()
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.join(timeout=10)
+        _listener = None
+
+
+def listener_status() -> dict:
+    return {
+        "enabled": CATALOG_EVENTS_ENABLED,
+        "running": bool(_listener and _listener.is_alive()),
+        "received": _listener.received if _listener else 0,
+        "catalog_version": catalog_version,
+        "worker_id": WORKER_ID,
+    }
@@ -0,0 +1,26 @@
+from fastapi.responses import JSONResponse, Response
+from pydantic_core import to_json
+
+# ======================================================
+# JSON RAPIDE (routes de lecture chaudes)
+# ======================================================
+# to_json (sérialiseur Rust de pydantic-core) encode directement dict, list,
+# UUID, datetime et modèles Pydantic en bytes. Une route qui renvoie
+# raw_json(...) échappe à la revalidation response_model et à jsonable_encoder.
+
+def json_bytes(obj) -> bytes:
+    return to_json(obj)
+
+
+def raw_json(body: bytes) -> Response:
+    """Réponse JSON déjà sérialisée (ex. bytes du cache catalogue)"""
+    return Response(content=body, media_type="application/json")
+
+
+class FastJSONResponse(JSONResponse):
+    """response_class des routes chaudes : rend via to_json au lieu de json.dumps"""
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return to_json(content)
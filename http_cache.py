@@ -0,0 +1,72 @@
+import os
+import re
+import events
+
+# ======================================================
+# ETAG / IF-NONE-MATCH (endpoints du catalogue)
+# ======================================================
+# L'ETag vient de la version du catalogue (table catalog_version), identique
+# sur tous les workers : une requête conditionnelle à jour reçoit un 304 sans
+# toucher la base ni sérialiser la réponse. Pas de todays-choice : son
+# classement change sans nouvelle version (tirage "daily" du jour, ventes
+# pour "best_selling"). Sans événements (CATALOG_EVENTS_ENABLED=false), un
+# worker ignore les écritures des autres : pas d'ETag du tout.
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, max-age=0, must-revalidate")
+
+_UUID = r"[0-9a-fA-F-]{36}"
+CATALOG_PATHS = re.compile(
+    r"^/grosly_api_office/(?:"
+    r"products|products/search|products/limited-discount|products/cheapest"
+    rf"|products/{_UUID}|products/{_UUID}/images"
+    rf"|categories|categories/browse|categories/{_UUID}"
+    r"|autocomplete"
+    r")/?$"
+)
+
+
+def catalog_etag():
+    if not events.CATALOG_EVENTS_ENABLED or events.catalog_version is None:
+        return None
+    return f'"catalog-{events.catalog_version}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [value.strip() for value in header.split(",")]
+    # Comparaison faible autorisée pour If-None-Match (RFC 9110)
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class CatalogETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not CATALOG_PATHS.match(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        etag = catalog_etag()
+        if etag is None:
+            await self.app(scope, receive, send)
+            return
+
+        cache_headers = [
+            (b"etag", etag.encode()),
+            (b"cache-control", CATALOG_CACHE_CONTROL.encode()),
+        ]
+        for name, value in scope["headers"]:
+            if name == b"if-none-match" and _etag_matches(value.decode("latin-1"), etag):
+                await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {**message, "headers": list(message.get("headers", [])) + cache_headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
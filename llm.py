@@ -0,0 +1,236 @@
+import asyncio
+import os
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+from groq import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError  # type: ignore
+import utils
+
+# ======================================================
+# PASSERELLE LLM (délais, concurrence bornée, disjoncteur)
+# ======================================================
+# Tous les appels à Groq passent par ici. Quand Groq ralentit ou tombe :
+#   - chaque appel a une échéance (LLM_TIMEOUT) au lieu d'attendre sans fin,
+#     nouvelles tentatives comprises (LLM_MAX_RETRIES, dans le temps restant) ;
+#   - au plus LLM_MAX_CONCURRENCY appels en cours par worker, les autres
+#     attendent au plus LLM_QUEUE_TIMEOUT puis reçoivent la réponse dégradée,
+#     ce qui laisse le threadpool aux autres routes ;
+#   - après LLM_BREAKER_THRESHOLD échecs consécutifs le disjoncteur s'ouvre :
+#     réponse dégradée immédiate pendant LLM_BREAKER_COOLDOWN secondes, puis
+#     un seul appel d'essai décide de la refermer.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "1"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Erreurs passagères qui valent une nouvelle tentative (mêmes cas que le SDK)
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+RECIPE_DEGRADED_MESSAGE = (
+    "Le service de recettes est très sollicité pour le moment. "
+    "Veuillez réessayer dans quelques instants."
+)
+
+
+class LLMUnavailable(Exception):
+    """Appel refusé sans contacter Groq (disjoncteur ouvert ou aucune place libre)"""
+
+
+class CircuitBreaker:
+    """closed -> open après N échecs consécutifs -> half_open après le délai -> closed / open"""
+
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Appel d'essai abandonné (client parti) : ni succès ni échec"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opens": self.opens,
+                "retry_in_s": round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+                if self.state == "open" else None,
+            }
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 breaker: CircuitBreaker = None):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        # Partagé entre le threadpool (/chatbot) et la boucle asyncio (/chatbot/stream)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0   # disjoncteur ouvert
+        self.shed = 0       # aucune place libre à temps
+
+    # ---------- appels ----------
+    def generate_recipe(self, ingredients: list[str], user_message: str) -> str:
+        """Recette complète, ou RECIPE_DEGRADED_MESSAGE / RECIPE_ERROR_MESSAGE sans bloquer"""
+        try:
+            self._admit(self._slots.acquire(timeout=self.queue_timeout))
+        except LLMUnavailable:
+            return RECIPE_DEGRADED_MESSAGE
+        try:
+            recipe = self._request_recipe(ingredients, user_message)
+        except Exception as e:
+            self._failed(e)
+            print(f" Erreur lors de la génération de recette: {e}")
+            return utils.RECIPE_ERROR_MESSAGE
+        else:
+            self.breaker.record_success()
+            return recipe
+        finally:
+            self._done()
+
+    def _request_recipe(self, ingredients: list[str], user_message: str) -> str:
+        # Une seule échéance pour toutes les tentatives : jamais plus de LLM_TIMEOUT au total
+        deadline = time.monotonic() + utils.LLM_TIMEOUT
+        for attempt in range(utils.LLM_MAX_RETRIES + 1):
+            try:
+                return utils.request_recipe(ingredients, user_message, timeout=deadline - time.monotonic())
+            except RETRYABLE_ERRORS:
+                if attempt == utils.LLM_MAX_RETRIES or deadline - time.monotonic() <= 0:
+                    raise
+
+    async def stream_recipe(self, ingredients: list[str], user_message: str):
+        """Morceaux de texte ; LLMUnavailable si refusé, exception de Groq / TimeoutError sinon"""
+        self._admit(await self._acquire_async())
+        chunks = utils.stream_recipe(ingredients, user_message)
+        # Même échéance que l'appel complet, pour toute la durée du flux
+        deadline = asyncio.get_running_loop().time() + utils.LLM_TIMEOUT
+        try:
+            while True:
+                async with asyncio.timeout_at(deadline):
+                    try:
+                        delta = await anext(chunks)
+                    except StopAsyncIteration:
+                        break
+                yield delta
+        except Exception as e:
+            self._failed(e)
+            raise
+        except BaseException:
+            # Client parti en cours de route : ni succès ni échec pour le disjoncteur
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            await chunks.aclose()
+            self._done()
+
+    # ---------- admission ----------
+    async def _acquire_async(self) -> bool:
+        # Attente dans le threadpool (au plus queue_timeout, seulement quand tout est
+        # pris) : réveillé dès qu'une place se libère, sans sonder depuis la boucle
+        state = {"acquired": False, "abandoned": False}
+        lock = threading.Lock()
+
+        def acquire():
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+            with lock:
+                if acquired and state["abandoned"]:
+                    self._slots.release()
+                    return False
+                state["acquired"] = acquired
+            return acquired
+
+        try:
+            return await run_in_threadpool(acquire)
+        except BaseException:
+            # Annulé pendant l'attente (client parti) : la place obtenue, maintenant
+            # ou plus tard par le thread, est rendue
+            with lock:
+                state["abandoned"] = True
+                if state["acquired"]:
+                    self._slots.release()
+            raise
+
+    def _admit(self, acquired: bool):
+        if not acquired:
+            with self._lock:
+                self.shed += 1
+            raise LLMUnavailable("no free LLM slot")
+        if not self.breaker.allow():
+            self._slots.release()
+            with self._lock:
+                self.rejected += 1
+            raise LLMUnavailable("circuit open")
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+
+    def _failed(self, error: Exception):
+        self.breaker.record_failure()
+        with self._lock:
+            self.failures += 1
+            if isinstance(error, (TimeoutError, APITimeoutError)):
+                self.timeouts += 1
+
+    def _done(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    # ---------- métriques ----------
+    def stats(self) -> dict:
+        breaker = self.breaker.stats()
+        with self._lock:
+            return {
+                "breaker": breaker,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "timeout_s": utils.LLM_TIMEOUT,
+                "calls": self.calls,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "shed": self.shed,
+            }
+
+
+llm_gateway = LLMGateway()
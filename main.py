@@ -1,23 +1,65 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from urls import router as grosly_router
+from async_urls import router as async_grosly_router
+from settings import DB_ASYNC
+import events
+from passwords import password_hasher
+from http_cache import CatalogETagMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi import Request
 #uvicorn main:grosly_app --host localhost --port 8000 --reload
-grosly_app = FastAPI(title="Grosly API Office")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Version du catalogue (ETag) puis invalidations envoyées par les autres workers
+    try:
+        events.load_catalog_version()
+    except Exception as e:
+        print(f"⚠️ Version du catalogue indisponible, ETag désactivés: {e}")
+    # Familles de jetons révoquées (sans LISTEN, ce worker ne verrait que les siennes)
+    try:
+        events.load_token_denylist()
+    except Exception as e:
+        print(f"⚠️ Liste des jetons révoqués indisponible: {e}")
+    events.start_listener()
+    # Processus de hachage prêts avant la première connexion
+    password_hasher.start()
+    yield
+    events.stop_listener()
+    password_hasher.shutdown()
+
+
+grosly_app = FastAPI(title="Grosly API Office", lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
 
+# Ajouté en premier : CORS reste la couche externe, y compris pour les 304
+grosly_app.add_middleware(CatalogETagMiddleware)
 grosly_app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  #mon domaine
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
+# DB_ASYNC : les routes async passent en premier, urls.py sert le reste.
+# Les routes sync masquées par une route async (même chemin, même méthode)
+# sortent du schéma : /docs n'affiche chaque opération qu'une fois.
+if DB_ASYNC:
+    async_operations = {
+        (route.path_format, method) for route in async_grosly_router.routes for method in route.methods
+    }
+    for route in grosly_router.routes:
+        if any((route.path_format, method) in async_operations for method in route.methods):
+            route.include_in_schema = False
+    grosly_app.include_router(async_grosly_router)
 grosly_app.include_router(grosly_router)
 
 @grosly_app.get("/", response_class=HTMLResponse)
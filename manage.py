@@ -1,5 +1,7 @@
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.schema import CreateColumn
 from settings import engine
-from models import Base
+from models import Base, Cart, CartItem, Product, RefreshToken, UserProfile, SEARCH_DDL, email_key
 import sys
 
 def create_db():
@@ -14,13 +16,123 @@ def makemigrations():
     drop_db()
     create_db()
 
+def create_indexes():
+    """Crée les index déclarés dans models.py qui manquent sur une base existante"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    print("Index créés avec succès")
+
+def create_search():
+    """Ajoute la recherche produits à une base existante (extensions, colonne générée, index)"""
+    column = CreateColumn(Product.__table__.c.search_vector).compile(dialect=engine.dialect)
+    with engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+        # Réécrit la table une fois pour calculer la colonne sur les produits existants
+        connection.exec_driver_sql(f"ALTER TABLE {Product.__tablename__} ADD COLUMN IF NOT EXISTS {column}")
+    create_indexes()
+
+def migrate_emails():
+    """
+    Prépare l'index unique sur lower(email) d'une base existante : pour chaque
+    adresse en double (casse ignorée), le compte le plus ancien la garde ; les
+    autres gardent leurs commandes, paniers et adresses mais reçoivent une
+    adresse "<nom>+doublon-<id>@<domaine>" et sont listés pour une fusion manuelle.
+    """
+    window = dict(
+        partition_by=email_key(UserProfile.email),
+        order_by=(UserProfile.date_creation, UserProfile.id),
+    )
+    ranked = select(
+        UserProfile.id,
+        UserProfile.email,
+        func.row_number().over(**window).label("rank"),
+        func.first_value(UserProfile.id).over(**window).label("keeper_id"),
+    ).subquery()
+    with engine.begin() as connection:
+        duplicates = connection.execute(select(ranked).where(ranked.c.rank > 1)).all()
+        for row in duplicates:
+            local, _, domain = row.email.partition("@")
+            renamed = f"{local}+doublon-{row.id.hex[:8]}@{domain}"
+            connection.execute(update(UserProfile).where(UserProfile.id == row.id).values(email=renamed))
+            print(f"  {row.id} : {row.email} -> {renamed} (compte conservé : {row.keeper_id})")
+    print(f"{len(duplicates)} doublon(s) renommé(s)")
+    create_unique_indexes(UserProfile, "ux_profiles_utilisateurs_email")
+
+def create_unique_indexes(model, *names):
+    """Crée les index nommés de models.py (les autres index ne sont pas touchés)"""
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(bind=engine, checkfirst=True)
+            print(f"Index {index.name} en place")
+
+def merge_duplicate_carts(connection):
+    """
+    Fusionne les paniers d'un même utilisateur dans le plus ancien, puis les
+    lignes d'un même produit en une seule (quantités additionnées).
+    Retourne (paniers supprimés, lignes déplacées, lignes fusionnées).
+    """
+    carts = select(
+        Cart.id,
+        func.first_value(Cart.id).over(partition_by=Cart.user_id, order_by=(Cart.created_at, Cart.id)).label("keeper_id"),
+    ).where(Cart.user_id.isnot(None)).subquery()
+    line_group = dict(partition_by=(CartItem.cart_id, CartItem.product_id))
+    lines = select(
+        CartItem.id,
+        func.first_value(CartItem.id).over(order_by=CartItem.id, **line_group).label("keeper_id"),
+        func.sum(CartItem.quantity).over(**line_group).label("total"),
+        func.count().over(**line_group).label("count"),
+    ).where(CartItem.cart_id.isnot(None), CartItem.product_id.isnot(None)).subquery()
+    # Lignes des paniers en trop vers le panier conservé, puis paniers vides supprimés
+    moved = connection.execute(
+        update(CartItem).where(CartItem.cart_id == carts.c.id, carts.c.id != carts.c.keeper_id)
+        .values(cart_id=carts.c.keeper_id)
+    ).rowcount
+    removed_carts = connection.execute(
+        delete(Cart).where(Cart.id == carts.c.id, carts.c.id != carts.c.keeper_id)
+    ).rowcount
+    connection.execute(
+        update(CartItem).where(CartItem.id == lines.c.keeper_id, lines.c.id == lines.c.keeper_id, lines.c.count > 1)
+        .values(quantity=lines.c.total)
+    )
+    removed_lines = connection.execute(
+        delete(CartItem).where(CartItem.id == lines.c.id, lines.c.id != lines.c.keeper_id)
+    ).rowcount
+    return removed_carts, moved, removed_lines
+
+def merge_carts():
+    """
+    Prépare les index uniques des paniers d'une base existante : les paniers
+    d'un même utilisateur sont fusionnés dans le plus ancien, puis les lignes
+    d'un même produit n'en font plus qu'une (quantités additionnées).
+    """
+    with engine.begin() as connection:
+        removed_carts, moved, removed_lines = merge_duplicate_carts(connection)
+        # Remplacé par ux_paniers_user_id
+        connection.exec_driver_sql("DROP INDEX IF EXISTS ix_paniers_user_id")
+    print(f"{removed_carts} panier(s) fusionné(s) ({moved} ligne(s) déplacée(s)), {removed_lines} ligne(s) fusionnée(s)")
+    create_unique_indexes(Cart, "ux_paniers_user_id")
+    create_unique_indexes(CartItem, "ux_panier_items_cart_product")
+
+def purge_tokens():
+    """Supprime les jetons de rafraîchissement expirés (à lancer périodiquement, ex. cron)"""
+    with engine.begin() as connection:
+        deleted = connection.execute(delete(RefreshToken).where(RefreshToken.expires_at < func.now())).rowcount
+    print(f"{deleted} jeton(s) expiré(s) supprimé(s)")
+
 def help_cmd():
-    print("Utilisation : python manage.py [create_db|drop_db|makemigrations]")
+    print("Utilisation : python manage.py [create_db|drop_db|makemigrations|create_indexes|create_search|migrate_emails|merge_carts|purge_tokens]")
 
 COMMANDS = {
     "create_db": create_db,
     "drop_db": drop_db,
     "makemigrations": makemigrations,
+    "create_indexes": create_indexes,
+    "create_search": create_search,
+    "migrate_emails": migrate_emails,
+    "merge_carts": merge_carts,
+    "purge_tokens": purge_tokens,
 }
 
 if __name__ == "__main__":
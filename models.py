@@ -1,10 +1,10 @@
 import uuid
 from sqlalchemy import (
     Column, String, Float, Boolean, DateTime,
-    ForeignKey, Integer, Text, func, event
+    ForeignKey, Integer, BigInteger, Text, Index, Computed, DDL, func, event
 )
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
+from sqlalchemy.orm import relationship, declarative_base, deferred
 from slugify import slugify
 
 Base = declarative_base()
@@ -35,6 +35,55 @@ class UserProfile(Base):
     termes_active = Column(Boolean, default=True)
     date_creation = Column(DateTime(timezone=True), server_default=func.now())
 
+
+def email_key(column):
+    """Email comparé sans tenir compte de la casse (même expression que ux_profiles_utilisateurs_email)"""
+    return func.lower(column)
+
+
+# Un compte par adresse, quelle que soit la casse ; sert aussi la recherche à la connexion.
+# Base existante : python manage.py migrate_emails (renomme d'abord les doublons)
+Index("ux_profiles_utilisateurs_email", email_key(UserProfile.email), unique=True)
+
+
+# ------------------------------
+# Jetons de rafraîchissement
+# ------------------------------
+class RefreshToken(Base):
+    """Un jeton émis (jti) ; une connexion = une famille, prolongée à chaque rotation"""
+    __tablename__ = "jetons_rafraichissement"
+
+    jti = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    family_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles_utilisateurs.id", ondelete="CASCADE"),
+                     nullable=False, index=True)
+    issued_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    used_at = Column(DateTime(timezone=True), nullable=True)      # échangé contre le suivant
+    revoked_at = Column(DateTime(timezone=True), nullable=True)   # déconnexion ou réutilisation
+
+# ------------------------------
+# Recherche (français, sans accents)
+# ------------------------------
+# unaccent() n'est pas IMMUTABLE : on l'enveloppe pour pouvoir l'utiliser dans
+# une colonne générée et dans un index. Créé avant les tables (create_db) ;
+# sur une base existante : python manage.py create_search.
+SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE OR REPLACE FUNCTION grosly_unaccent(text) RETURNS text "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+    "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$",
+]
+for statement in SEARCH_DDL:
+    event.listen(Base.metadata, "before_create", DDL(statement))
+
+
+def search_key(column):
+    """Texte comparé par trigrammes (même expression que ix_produits_name_trgm)"""
+    return func.grosly_unaccent(func.lower(column))
+
+
 # ------------------------------
 # Categories
 # ------------------------------
@@ -69,6 +118,16 @@ class Product(Base):
     weight = Column(String(50), default="1kg")  # ✅ Ajout du champ weight
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Nom (poids A) + description (poids B), calculé par Postgres ; jamais chargé par l'ORM
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('french', grosly_unaccent(coalesce(name, ''))), 'A') || "
+            "setweight(to_tsvector('french', grosly_unaccent(coalesce(description, ''))), 'B')",
+            persisted=True,
+        ),
+    ))
+
     category = relationship("Category", back_populates="produits")
     images = relationship(
         "ProductImage",
@@ -77,6 +136,31 @@ class Product(Base):
     )
     reviews = relationship("Review", back_populates="product")
 
+    __table_args__ = (
+        # Index des tris de GET /products (pagination par curseur)
+        Index("ix_produits_created_at_id", "created_at", "id"),
+        Index("ix_produits_category_created_at_id", "category_id", "created_at", "id"),
+        Index("ix_produits_name_id", "name", "id"),
+        # GET /products/search
+        Index("ix_produits_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+
+# Prix payé par le client : promo si elle existe
+Index(
+    "ix_produits_effective_price_id",
+    func.coalesce(Product.promo_price, Product.price),
+    Product.id,
+)
+
+# Tolérance aux fautes de frappe sur le nom (pg_trgm)
+Index(
+    "ix_produits_name_trgm",
+    search_key(Product.name).label("name_key"),
+    postgresql_using="gin",
+    postgresql_ops={"name_key": "gin_trgm_ops"},
+)
+
 
 # Slug automatique
 @event.listens_for(Product, "before_insert")
@@ -85,6 +169,17 @@ def set_product_slug(mapper, connection, target):
         target.slug = generate_slug(target.name)
 
 
+# ------------------------------
+# Version du catalogue (ETag)
+# ------------------------------
+class CatalogVersion(Base):
+    """Ligne unique, incrémentée dans chaque transaction qui modifie le catalogue"""
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
 # ------------------------------
 # Images Produits
 # ------------------------------
@@ -92,7 +187,7 @@ class ProductImage(Base):
     __tablename__ = "product_images"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    product_id = Column(UUID(as_uuid=True), ForeignKey("produits.id", ondelete="CASCADE"))
+    product_id = Column(UUID(as_uuid=True), ForeignKey("produits.id", ondelete="CASCADE"), index=True)
 
     image_url = Column(String(500), nullable=False)
     is_main = Column(Boolean, default=False)
@@ -109,7 +204,7 @@ class Cart(Base):
     __tablename__ = "paniers"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles_utilisateurs.id"), index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("profiles_utilisateurs.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("UserProfile")
@@ -120,6 +215,11 @@ class Cart(Base):
     )
 
 
+# Un panier par utilisateur : cible de INSERT ... ON CONFLICT (user_id)
+# Base existante : python manage.py merge_carts (fusionne d'abord les doublons)
+Index("ux_paniers_user_id", Cart.user_id, unique=True)
+
+
 # ------------------------------
 # Items Panier
 # ------------------------------
@@ -137,6 +237,11 @@ class CartItem(Base):
     product = relationship("Product")
 
 
+# Une ligne par produit et par panier : un nouvel ajout augmente la quantité
+# (INSERT ... ON CONFLICT (cart_id, product_id)) ; sert aussi la lecture du panier
+Index("ux_panier_items_cart_product", CartItem.cart_id, CartItem.product_id, unique=True)
+
+
 # ------------------------------
 # Adresses
 # ------------------------------
@@ -0,0 +1,197 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from passlib.context import CryptContext
+
+# ======================================================
+# MOTS DE PASSE (argon2 dans un pool de processus)
+# ======================================================
+# argon2 est volontairement coûteux : calculé dans le thread de la requête,
+# une vague d'inscriptions / connexions occupe tout le threadpool et les
+# routes du catalogue attendent derrière. Les calculs partent donc dans un
+# pool de processus dédié (un cœur par processus), borné : au-delà de
+# PASSWORD_HASH_MAX_PENDING calculs en cours ou en attente, la requête
+# reçoit un 503 au lieu de s'empiler. Les routes qui hachent (connexion,
+# inscription) sont async, y compris dans urls.py : le résultat est attendu
+# dans la boucle, sans tenir de thread du threadpool. Les paramètres argon2 viennent de
+# l'environnement ; un hash calculé avec d'anciens paramètres est recalculé
+# à la connexion suivante (verify_and_update).
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 4)))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "2"))
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__rounds=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+
+# Exécutées dans les processus du pool (fonctions de module : sérialisables)
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str):
+    return pwd_context.verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    """Pool de processus paresseux ; workers=0 calcule dans le thread appelant (scripts, debug)"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING,
+                 queue_timeout: float = PASSWORD_HASH_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.hashes = 0
+        self.verifies = 0
+        self.rehashes = 0
+        self.rejected = 0
+
+    def start(self):
+        """Crée le pool et démarre ses processus (au lancement plutôt qu'à la 1re connexion)"""
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._executor is None:
+                # spawn : pas de fork d'un processus qui a déjà des threads (uvicorn, LISTEN)
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                executor = self._executor
+            else:
+                return
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    # ---------- appels ----------
+    def hash(self, password: str) -> str:
+        self._count("hashes")
+        return self._run(_hash, password)
+
+    def verify_and_update(self, password: str, hashed: str):
+        """(valide, nouveau hash ou None) : nouveau hash si les paramètres argon2 ont changé"""
+        self._count("verifies")
+        valid, new_hash = self._run(_verify_and_update, password, hashed)
+        if new_hash:
+            self._count("rehashes")
+        return valid, new_hash
+
+    async def hash_async(self, password: str) -> str:
+        self._count("hashes")
+        return await self._run_async(_hash, password)
+
+    async def verify_and_update_async(self, password: str, hashed: str):
+        self._count("verifies")
+        valid, new_hash = await self._run_async(_verify_and_update, password, hashed)
+        if new_hash:
+            self._count("rehashes")
+        return valid, new_hash
+
+    # ---------- pool ----------
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        self._admit(self._pending.acquire(timeout=self.queue_timeout))
+        try:
+            return self._submit(fn, *args).result()
+        finally:
+            self._pending.release()
+
+    async def _run_async(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        # Le calcul n'occupe ni la boucle ni le threadpool : le résultat revient par un Future asyncio
+        self._admit(await self._acquire_async())
+        try:
+            return await asyncio.wrap_future(self._submit(fn, *args))
+        finally:
+            self._pending.release()
+
+    async def _acquire_async(self) -> bool:
+        # Attente dans le threadpool (au plus queue_timeout, seulement quand tout est
+        # pris) : réveillé dès qu'une place se libère, sans sonder depuis la boucle
+        state = {"acquired": False, "abandoned": False}
+        lock = threading.Lock()
+
+        def acquire():
+            acquired = self._pending.acquire(timeout=self.queue_timeout)
+            with lock:
+                if acquired and state["abandoned"]:
+                    self._pending.release()
+                    return False
+                state["acquired"] = acquired
+            return acquired
+
+        try:
+            return await run_in_threadpool(acquire)
+        except BaseException:
+            # Requête annulée pendant l'attente : la place obtenue, maintenant ou plus
+            # tard par le thread, est rendue
+            with lock:
+                state["abandoned"] = True
+                if state["acquired"]:
+                    self._pending.release()
+            raise
+
+    def _submit(self, fn, *args):
+        if self._executor is None:
+            self.start()
+        try:
+            return self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # Un processus a été tué (OOM...) : on repart d'un pool neuf
+            self.shutdown()
+            self.start()
+            return self._executor.submit(fn, *args)
+
+    def _admit(self, acquired: bool):
+        if not acquired:
+            self._count("rejected")
+            raise HTTPException(status_code=503, detail="Service saturé, réessayez", headers={"Retry-After": "1"})
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._executor is not None,
+                "max_pending": self.max_pending,
+                "argon2": {"time_cost": ARGON2_TIME_COST, "memory_cost": ARGON2_MEMORY_COST,
+                           "parallelism": ARGON2_PARALLELISM},
+                "hashes": self.hashes,
+                "verifies": self.verifies,
+                "rehashes": self.rehashes,
+                "rejected": self.rejected,
+            }
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+def verify_password(password: str, hashed: str) -> bool:
+    return password_hasher.verify_and_update(password, hashed)[0]
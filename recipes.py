@@ -0,0 +1,199 @@
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+import utils
+
+# ======================================================
+# RECETTES LOCALES (sans LLM)
+# ======================================================
+# recipes.json : plats marocains classiques (nom, mots-clés, ingrédients).
+# Chaque recette est une ligne booléenne sur le vocabulaire des ingrédients,
+# le stock en est une autre (recalculée seulement quand l'empreinte des
+# ingrédients change). Le message de l'utilisateur donne les ingrédients et
+# les mots-clés demandés ; une recette n'est proposée que si chaque mot du
+# message est compris, si elle contient tout ce qui est demandé et si le
+# stock en couvre assez. Sinon : Groq. Un message qui exclut quelque chose
+# ("sans olives", "pas de poulet") va toujours à Groq : content_words retire
+# "sans" et "pas", le matcher y lirait la demande inverse.
+RECIPE_MATCHER_ENABLED = os.getenv("RECIPE_MATCHER_ENABLED", "true").lower() in ("1", "true", "yes")
+RECIPE_MATCHER_MIN_COVERAGE = float(os.getenv("RECIPE_MATCHER_MIN_COVERAGE", "0.6"))
+RECIPES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recipes.json")
+# Mots sans effet sur le choix du plat ; tout autre mot inconnu (un ingrédient
+# ou une contrainte hors de la base, ex. "pâtes", "sans gluten") laisse la main à Groq
+GENERIC_WORDS = {
+    "bonjour", "salam", "merci", "svp", "stp", "recette", "recettes", "plat", "plats", "idee", "idees",
+    "propose", "proposez", "proposer", "suggere", "suggerer", "donne", "donner", "moi", "nous", "faire",
+    "cuisiner", "preparer", "manger", "quelque", "chose", "bon", "bonne", "simple", "ce", "soir", "midi",
+    "diner", "aujourd", "hui", "marocain", "marocaine", "traditionnel", "traditionnelle", "maison", "est",
+    "il", "y", "que", "on", "peut", "peux", "avoir", "aime", "aimerais", "envie", "cherche", "besoin",
+}
+# Négations et exclusions : le matcher ne sait pas retirer un ingrédient
+NEGATION_WORDS = {
+    "sans", "pas", "sauf", "ni", "aucun", "aucune", "jamais", "hors", "excepte", "exceptes", "excepter",
+    "eviter", "evite", "evitez", "allergie", "allergique", "intolerant", "intolerante", "ne", "n", "non",
+}
+
+
+def _stem(word: str) -> str:
+    # Singulier grossier : "tomates" / "tomate", "pruneaux" / "pruneau"
+    return word[:-1] if len(word) > 3 and word[-1] in "sx" else word
+
+
+def _stems(text: str) -> frozenset:
+    return frozenset(_stem(word) for word in utils.content_words(text))
+
+
+def has_negation(text: str) -> bool:
+    return not NEGATION_WORDS.isdisjoint(re.findall(r"\w+", utils.normalize_text(text)))
+
+
+def format_recipe(dish: str, used: list[str], missing: list[str]) -> str:
+    """Même format que la réponse de Groq (voir build_recipe_messages)"""
+    return (
+        f"Bismillah,\nSuggested dish: {dish}\n"
+        f"Used ingredients: {', '.join(used)}\n"
+        f"Missing ingredients: {', '.join(missing) or 'None'}"
+    )
+
+
+class RecipeMatcher:
+    def __init__(self, path: str = RECIPES_PATH, enabled: bool = True, min_coverage: float = RECIPE_MATCHER_MIN_COVERAGE):
+        self.enabled = enabled
+        self.min_coverage = min_coverage
+        with open(path, encoding="utf-8") as f:
+            recipes = json.load(f)
+        self.dishes = [recipe["name"] for recipe in recipes]
+
+        # Vocabulaire des ingrédients (libellé du premier qui l'emploie)
+        self.labels, self._term_stems, index = [], [], {}
+        for recipe in recipes:
+            for label in recipe["ingredients"]:
+                stems = _stems(label)
+                if stems not in index:
+                    index[stems] = len(self.labels)
+                    self.labels.append(label)
+                    self._term_stems.append(stems)
+        self._terms_by_stem = {}
+        for term, stems in enumerate(self._term_stems):
+            for stem in stems:
+                self._terms_by_stem.setdefault(stem, []).append(term)
+
+        keywords = sorted({stem for recipe in recipes for word in recipe["keywords"] for stem in _stems(word)})
+        self._keyword_index = {stem: i for i, stem in enumerate(keywords)}
+
+        # Recettes x ingrédients et recettes x mots-clés
+        self._recipe_terms = np.zeros((len(recipes), len(self.labels)), dtype=bool)
+        self._recipe_keywords = np.zeros((len(recipes), len(keywords)), dtype=bool)
+        for row, recipe in enumerate(recipes):
+            self._recipe_terms[row, [index[_stems(label)] for label in recipe["ingredients"]]] = True
+            self._recipe_keywords[row, [self._keyword_index[s] for w in recipe["keywords"] for s in _stems(w)]] = True
+        self._sizes = self._recipe_terms.sum(axis=1)
+        # Une recette "contient" un ingrédient demandé si l'un des siens l'englobe :
+        # "citron" est satisfait par "Citron confit"
+        self._contains = np.array([[a <= b for b in self._term_stems] for a in self._term_stems], dtype=bool)
+        self._recipe_covers = (self._recipe_terms.astype(np.int32) @ self._contains.T.astype(np.int32)) > 0
+        self._known = set(self._terms_by_stem) | set(self._keyword_index) | {_stem(w) for w in GENERIC_WORDS}
+
+        self._stock = ("", None, None, None)   # (empreinte, en stock, englobés par le stock, produit affiché)
+        self._lock = threading.Lock()
+        self.answered = 0
+        self.fallbacks = 0
+        self.misses = 0
+        self.match_seconds = 0.0
+
+    # ---------- vecteurs ----------
+    def _terms_in(self, stems: frozenset) -> list[int]:
+        """Ingrédients du vocabulaire contenus dans un texte, sans ceux couverts par un plus long
+        ("huile d'olive" ne compte pas aussi comme "olives")"""
+        found = {
+            term for stem in stems for term in self._terms_by_stem.get(stem, ())
+            if self._term_stems[term] <= stems
+        }
+        return [term for term in found if not any(self._term_stems[term] < self._term_stems[other] for other in found)]
+
+    def _stock_vector(self, ingredients: list[str], digest: str):
+        with self._lock:
+            if self._stock[0] == digest:
+                return self._stock[1:]
+        in_stock = np.zeros(len(self.labels), dtype=bool)
+        products = [None] * len(self.labels)
+        for name in ingredients:
+            for term in self._terms_in(_stems(name)):
+                if products[term] is None:
+                    products[term] = name
+                    in_stock[term] = True
+        stock_covers = self._contains[:, in_stock].any(axis=1)
+        with self._lock:
+            self._stock = (digest, in_stock, stock_covers, products)
+        return in_stock, stock_covers, products
+
+    # ---------- correspondance ----------
+    def match(self, user_message: str, ingredients: list[str], digest: str, min_coverage: float = None):
+        """Recette au format de Groq, ou None si la confiance est trop faible"""
+        if not self.enabled or not ingredients:
+            return None
+        start = time.perf_counter()
+        if has_negation(user_message):
+            with self._lock:
+                self.misses += 1
+                self.match_seconds += time.perf_counter() - start
+            return None
+        in_stock, stock_covers, products = self._stock_vector(ingredients, digest)
+        stems = _stems(user_message)
+        if not stems <= self._known:
+            with self._lock:
+                self.misses += 1
+                self.match_seconds += time.perf_counter() - start
+            return None
+        requested = np.zeros(len(self.labels), dtype=bool)
+        requested[self._terms_in(stems)] = True
+        keywords = [self._keyword_index[stem] for stem in stems if stem in self._keyword_index]
+
+        asked = self._recipe_covers[:, requested].sum(axis=1)
+        intent = asked + 2 * self._recipe_keywords[:, keywords].sum(axis=1)
+        coverage = (self._recipe_terms & in_stock).sum(axis=1) / self._sizes
+        threshold = self.min_coverage if min_coverage is None else min_coverage
+        # Tout ce qui est demandé est dans la recette, et la demande vise bien quelque chose
+        candidates = (asked == requested.sum()) & (intent > 0) & (coverage >= threshold)
+        if min_coverage is None and not stock_covers[requested].all():
+            # Ingrédient demandé mais absent du stock : Groq proposera mieux
+            candidates[:] = False
+
+        recipe = None
+        if candidates.any():
+            best = int(np.argmax(np.where(candidates, intent + coverage, -1.0)))
+            terms = np.flatnonzero(self._recipe_terms[best])
+            recipe = format_recipe(
+                self.dishes[best],
+                [products[t] for t in terms if in_stock[t]],
+                [self.labels[t] for t in terms if not in_stock[t]],
+            )
+        with self._lock:
+            self.match_seconds += time.perf_counter() - start
+            if recipe is None:
+                self.misses += 1
+            elif min_coverage is None:
+                self.answered += 1
+            else:
+                self.fallbacks += 1
+        return recipe
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.answered + self.fallbacks + self.misses
+            return {
+                "enabled": self.enabled,
+                "recipes": len(self.dishes),
+                "ingredients": len(self.labels),
+                "min_coverage": self.min_coverage,
+                "answered": self.answered,
+                "fallbacks": self.fallbacks,
+                "misses": self.misses,
+                "avg_match_us": round(self.match_seconds / calls * 1e6, 1) if calls else None,
+            }
+
+
+recipe_matcher = RecipeMatcher(enabled=RECIPE_MATCHER_ENABLED)
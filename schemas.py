@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Literal
 import uuid
 from datetime import datetime
 
@@ -109,6 +109,27 @@ class ProductUpdate(BaseModel):
     is_active: Optional[bool] = None
     category_id: Optional[uuid.UUID] = None
 
+
+class ProductListQuery(BaseModel):
+    """Paramètres de GET /products (pagination par curseur + filtres)"""
+    cursor: Optional[str] = None
+    limit: int = Field(20, ge=1, le=100)
+    sort: Literal["newest", "price_asc", "price_desc", "name"] = "newest"
+    category_id: Optional[uuid.UUID] = None
+    min_price: Optional[float] = Field(None, ge=0)
+    max_price: Optional[float] = Field(None, ge=0)
+    in_stock: bool = False
+    promo_only: bool = False
+
+
+class ProductSearchQuery(BaseModel):
+    """Paramètres de GET /products/search (triés par pertinence)"""
+    q: str = Field(min_length=1, max_length=100)
+    cursor: Optional[str] = None
+    limit: int = Field(20, ge=1, le=100)
+    category_id: Optional[uuid.UUID] = None
+    in_stock: bool = False
+
 # ======================================================
 # PRODUCT IMAGES
 # ======================================================
@@ -149,6 +170,18 @@ class CartItemRead(CartItemBase):
         from_attributes = True
 
 
+class CartItemChange(BaseModel):
+    product_id: uuid.UUID
+    # Variation (négative pour retirer), ou quantité finale si replace ; 0 ou moins retire la ligne
+    quantity: int
+
+
+class CartItemsUpdate(BaseModel):
+    """Corps de PATCH /cart/items : plusieurs lignes en une requête (et une instruction SQL)"""
+    items: List[CartItemChange] = Field(min_length=1, max_length=100)
+    replace: bool = False
+
+
 class CartRead(BaseModel):
     id: uuid.UUID
     user_id: uuid.UUID
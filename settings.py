@@ -1,14 +1,20 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException,status
+from fastapi import Depends, Header, HTTPException,status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker,Session
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
 from jose import jwt, JWTError
 from models import UserProfile
+import schemas
+from cache import principal_cache
+from tokens import token_denylist
+from db_pool import TimedQueuePool, TimedAsyncQueuePool, install_query_log
+from passwords import hash_password, verify_password  # noqa: F401 - réexportés (pool de processus)
 import os
+import secrets
 
 
 
@@ -25,8 +31,36 @@ DATABASE_URL = (
     f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}"
     f"@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
+ASYNC_DATABASE_URL = (
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}"
+    f"@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
 
-engine = create_engine(DATABASE_URL, echo=True)
+# DB_ASYNC=true : les routes de async_urls.py (AsyncSession/asyncpg) remplacent
+# celles de urls.py, ce qui permet de comparer les deux piles côte à côte.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# Pool de connexions (par worker) et log SQL échantillonné
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+SQL_LOG_SAMPLE_RATE = float(os.getenv("SQL_LOG_SAMPLE_RATE", "0"))
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "0"))
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    echo=DB_ECHO,
+)
+
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+install_query_log(engine, SQL_LOG_SAMPLE_RATE, SQL_SLOW_QUERY_MS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -38,33 +72,55 @@ def get_db():
         db.close()
 
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=TimedAsyncQueuePool, **POOL_OPTIONS)
+install_query_log(async_engine, SQL_LOG_SAMPLE_RATE, SQL_SLOW_QUERY_MS)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS"))
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM  = os.getenv("ALGORITHM")
 
+# true : le jeton d'accès embarque le profil (claim "profile"), ce qui évite
+# toute lecture en base aux routes en lecture seule (au prix d'un profil figé
+# jusqu'à l'expiration du jeton). Attention : un JWT est signé, pas chiffré.
+# Le profil complet (email, téléphone, adresse) y est lisible par quiconque
+# voit le jeton (stockage du navigateur, logs, proxy). L'autorisation n'en
+# a pas besoin (elle ne lit que "sub") ; à n'activer que si ce n'est pas
+# un problème pour l'application.
+ACCESS_TOKEN_EMBED_PROFILE = os.getenv("ACCESS_TOKEN_EMBED_PROFILE", "false").lower() in ("1", "true", "yes")
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/grosly_api_office/grosly_token_office")
+# /metrics expose l'état interne du worker (pools, LLM, caches) : réservé à qui
+# présente ce jeton (en-tête X-Metrics-Token). Non défini : route désactivée (404).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Today's choice : "newest", "best_selling" ou "daily" (aléatoire stable par jour)
+TODAYS_CHOICE_RANKING = os.getenv("TODAYS_CHOICE_RANKING", "newest")
+TODAYS_CHOICE_SIZE = int(os.getenv("TODAYS_CHOICE_SIZE", "10"))
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/grosly_api_office/grosly_token_office")
 
-def verify_password(password: str, hashed: str) -> bool:
-    return pwd_context.verify(password, hashed)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def create_refresh_token(data: dict):
+def create_refresh_token(data: dict, expire: Optional[datetime] = None):
+    """expire : même échéance que la ligne de jetons_rafraichissement du jti"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    expire = expire or datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({
         "exp": expire,
         "type": "refresh"
@@ -81,20 +137,108 @@ def decode_access_token(token: str):
         detail="Token invalide ou expiré",
     )
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)):
+def principal_claims(user) -> dict:
+    """Claims à ajouter au jeton d'accès (vide si ACCESS_TOKEN_EMBED_PROFILE est désactivé)"""
+    if not ACCESS_TOKEN_EMBED_PROFILE:
+        return {}
+    return {"profile": schemas.UserRead.model_validate(user).model_dump(mode="json")}
+
+def create_token_pair(user, refresh) -> dict:
+    """Réponse schemas.Token ; refresh : ligne de jetons_rafraichissement (jti, famille, échéance)"""
+    family = str(refresh.family_id)
+    return {
+        "access_token": create_access_token(data={"sub": str(user.id), "fam": family, **principal_claims(user)}),
+        "refresh_token": create_refresh_token(
+            data={"sub": str(user.id), "jti": str(refresh.jti), "fam": family}, expire=refresh.expires_at),
+        "token_type": "bearer",
+    }
+
+def get_token_payload(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Token invalide")
     except JWTError:
         raise HTTPException(
             status_code=401,
             detail="Token expiré ou invalide",
             headers={"WWW-Authenticate": "Bearer"},)
-    user = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Token invalide")
+    # Déconnexion / rejeu : famille révoquée, vérifiée en mémoire (tokens.py)
+    if token_denylist.is_revoked(payload.get("fam")):
+        raise HTTPException(
+            status_code=401,
+            detail="Session révoquée",
+            headers={"WWW-Authenticate": "Bearer"},)
+    return payload
+
+def require_metrics_token(x_metrics_token: Optional[str] = Header(None)):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_metrics_token is None or not secrets.compare_digest(x_metrics_token, METRICS_TOKEN):
+        raise HTTPException(status_code=401, detail="Jeton de métriques invalide")
+
+def get_refresh_token_payload(refresh_token: str) -> dict:
+    """Jeton de rafraîchissement signé et non expiré ; jti et famille sont vérifiés en base"""
+    try:
+        payload = decode_access_token(refresh_token)
+        user_id: str = payload.get("sub")
+        token_type: str = payload.get("type")
+        if user_id is None or token_type != "refresh":
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    return payload
+
+def get_user_id_from_token(token: str) -> str:
+    return get_token_payload(token)["sub"]
+
+def _principal_key(payload: dict):
+    return (payload["sub"], payload.get("iat")), (f"user:{payload['sub']}",)
+
+def _load_principal(payload: dict, db: Session):
+    key, tags = _principal_key(payload)
+    def load():
+        user = db.query(UserProfile).filter(UserProfile.id == payload["sub"]).first()
+        return schemas.UserRead.model_validate(user) if user else None
+    user = principal_cache.get_or_load(key, load, tags)
+    if not user:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    return user
+
+async def _load_principal_async(payload: dict, db: AsyncSession):
+    key, tags = _principal_key(payload)
+    async def load():
+        user = (await db.execute(select(UserProfile).where(UserProfile.id == payload["sub"]))).scalars().first()
+        return schemas.UserRead.model_validate(user) if user else None
+    user = await principal_cache.aget_or_load(key, load, tags)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     return user
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)) -> schemas.UserRead:
+    """Utilisateur du jeton (cache principal_cache : pas de requête tant qu'il est valide)"""
+    return _load_principal(get_token_payload(token), db)
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)) -> schemas.UserRead:
+    return await _load_principal_async(get_token_payload(token), db)
+
+def get_token_principal(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)) -> schemas.UserRead:
+    """Routes en lecture seule : profil embarqué dans le jeton s'il y est, sinon get_current_user"""
+    payload = get_token_payload(token)
+    if "profile" in payload:
+        return schemas.UserRead.model_validate(payload["profile"])
+    return _load_principal(payload, db)
+
+async def get_token_principal_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)) -> schemas.UserRead:
+    payload = get_token_payload(token)
+    if "profile" in payload:
+        return schemas.UserRead.model_validate(payload["profile"])
+    return await _load_principal_async(payload, db)
@@ -0,0 +1,45 @@
+import os
+import sys
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Modules à plat à la racine du dépôt (comme main.py les importe)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db():
+    """Session sur la base de .env dans une transaction annulée à la fin (rien n'est écrit)"""
+    settings = pytest.importorskip("settings")
+    try:
+        connection = settings.engine.connect()
+    except Exception as e:
+        pytest.skip(f"Base de données indisponible: {e}")
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture
+def count_queries(db):
+    """count_queries() -> liste des requêtes SQL envoyées depuis l'appel"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.get_bind().engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+    def start():
+        statements.clear()
+        return statements
+
+    yield start
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
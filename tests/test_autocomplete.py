@@ -0,0 +1,54 @@
+import uuid
+import pytest
+import autocomplete
+import models
+
+
+class _TestSession:
+    """Session du test (transaction annulée) que le chargement de l'index ne ferme pas"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, *args, **kwargs):
+        return self.db.execute(*args, **kwargs)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def index(db, monkeypatch):
+    monkeypatch.setattr(autocomplete, "SessionLocal", lambda: _TestSession(db))
+    return autocomplete.PrefixIndex()
+
+
+def _product(db, name, is_active=True, category=None):
+    product = models.Product(
+        name=name, slug=f"autocomplete-{uuid.uuid4().hex[:12]}", price=1.0, stock=1,
+        is_active=is_active, category=category,
+    )
+    db.add(product)
+    db.flush()
+    return product
+
+
+def test_inactive_rows_are_not_suggested(db, index):
+    prefix = f"zq{uuid.uuid4().hex[:6]}"
+    hidden = models.Category(name=f"{prefix} rayon masqué", slug=f"{prefix}-rayon", is_active=False)
+    active = _product(db, f"{prefix} actif")
+    _product(db, f"{prefix} inactif", is_active=False, category=hidden)
+
+    assert [(s["type"], s["id"]) for s in index.lookup(prefix)] == [("product", str(active.id))]
+
+
+def test_deactivated_product_leaves_the_index(db, index):
+    prefix = f"zq{uuid.uuid4().hex[:6]}"
+    product = _product(db, f"{prefix} bientôt retiré")
+    assert [s["id"] for s in index.lookup(prefix)] == [str(product.id)]
+
+    product.is_active = False
+    db.flush()
+    index.mark_dirty("product", product.id)
+
+    assert index.lookup(prefix) == []
@@ -0,0 +1,165 @@
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+import manage
+import models
+import views
+from settings import SessionLocal
+import utils
+
+
+def _create_user(db):
+    user = models.UserProfile(
+        userlastname="Test", userfirstname="Panier", email=f"panier-{uuid.uuid4().hex[:8]}@test.ma",
+        pays="Maroc", hashed_password="x",
+    )
+    db.add(user)
+    db.flush()
+    return user
+
+
+def _create_products(db, count):
+    category = models.Category(name="Test panier", slug=f"test-panier-{uuid.uuid4().hex[:8]}")
+    products = [
+        models.Product(name=f"Produit panier {n}", slug=f"produit-panier-{uuid.uuid4().hex[:12]}",
+                       price=10.0 + n, stock=50, category=category)
+        for n in range(count)
+    ]
+    db.add_all(products)
+    db.flush()
+    return products
+
+
+def _cart_lines(db, user_id) -> dict:
+    rows = db.execute(
+        select(models.CartItem.product_id, models.CartItem.quantity)
+        .join(models.Cart, models.Cart.id == models.CartItem.cart_id)
+        .where(models.Cart.user_id == user_id)
+    ).all()
+    return {row.product_id: row.quantity for row in rows}
+
+
+def test_add_creates_cart_then_adds_to_the_same_line(db):
+    user = _create_user(db)
+    product, = _create_products(db, 1)
+
+    first = utils.add_to_cart(db, user.id, product.id, 2)
+    second = utils.add_to_cart(db, user.id, product.id, 3)
+
+    assert first.id == second.id
+    assert second.quantity == 5
+    assert second.price == product.price
+    assert _cart_lines(db, user.id) == {product.id: 5}
+    assert db.query(models.Cart).filter(models.Cart.user_id == user.id).count() == 1
+
+
+def test_replace_sets_the_quantity(db):
+    user = _create_user(db)
+    a, b = _create_products(db, 2)
+    utils.add_to_cart(db, user.id, a.id, 4)
+
+    rows = utils.update_cart_items(db, user.id, {a.id: 1, b.id: 2}, replace=True)
+
+    assert {row.product_id: row.quantity for row in rows} == {a.id: 1, b.id: 2}
+    assert _cart_lines(db, user.id) == {a.id: 1, b.id: 2}
+
+
+@pytest.mark.parametrize("changes, replace", [({"a": -3}, False), ({"a": 0}, True), ({"a": -10}, False)])
+def test_quantity_at_or_below_zero_removes_the_line(db, changes, replace):
+    user = _create_user(db)
+    a, b = _create_products(db, 2)
+    utils.update_cart_items(db, user.id, {a.id: 3, b.id: 1})
+
+    rows = utils.update_cart_items(db, user.id, {a.id: changes["a"]}, replace=replace)
+
+    assert rows == []
+    assert _cart_lines(db, user.id) == {b.id: 1}
+
+
+def test_unknown_product_is_404(db):
+    user = _create_user(db)
+    with pytest.raises(HTTPException) as excinfo:
+        views.add_to_cart_view(user.id, uuid.uuid4(), 1, db)
+    assert excinfo.value.status_code == 404
+    assert _cart_lines(db, user.id) == {}
+
+
+def test_merge_duplicate_carts(db):
+    connection = db.connection()
+    # Doublons d'une base antérieure aux index uniques (DDL annulé avec la transaction)
+    connection.exec_driver_sql("DROP INDEX ux_panier_items_cart_product")
+    connection.exec_driver_sql("DROP INDEX ux_paniers_user_id")
+    user = _create_user(db)
+    a, b = _create_products(db, 2)
+    now = datetime.now(timezone.utc)
+    oldest = models.Cart(user_id=user.id, created_at=now - timedelta(days=2))
+    newer = models.Cart(user_id=user.id, created_at=now - timedelta(days=1))
+    oldest.items = [models.CartItem(product_id=a.id, quantity=1, price=a.price),
+                    models.CartItem(product_id=a.id, quantity=2, price=a.price)]
+    newer.items = [models.CartItem(product_id=a.id, quantity=4, price=a.price),
+                   models.CartItem(product_id=b.id, quantity=1, price=b.price)]
+    db.add_all([oldest, newer])
+    db.flush()
+
+    removed_carts, moved, removed_lines = manage.merge_duplicate_carts(connection)
+    db.expire_all()
+
+    assert (removed_carts, moved, removed_lines) == (1, 2, 2)
+    assert [cart.id for cart in db.query(models.Cart).filter(models.Cart.user_id == user.id)] == [oldest.id]
+    assert _cart_lines(db, user.id) == {a.id: 7, b.id: 1}
+
+
+@pytest.fixture
+def committed_user_and_product():
+    """Données commitées : les ajouts concurrents passent par des connexions distinctes"""
+    pytest.importorskip("settings")
+    db = SessionLocal()
+    try:
+        user = _create_user(db)
+        product, = _create_products(db, 1)
+        db.commit()
+    except Exception as e:
+        db.close()
+        pytest.skip(f"database unavailable: {e}")
+    yield user.id, product.id, product.category_id
+    db.rollback()
+    db.execute(delete(models.CartItem).where(models.CartItem.product_id == product.id))
+    db.execute(delete(models.Cart).where(models.Cart.user_id == user.id))
+    db.execute(delete(models.Product).where(models.Product.id == product.id))
+    db.execute(delete(models.Category).where(models.Category.id == product.category_id))
+    db.execute(delete(models.UserProfile).where(models.UserProfile.id == user.id))
+    db.commit()
+    db.close()
+
+
+def test_concurrent_adds_to_the_same_product(committed_user_and_product):
+    user_id, product_id, _ = committed_user_and_product
+    workers, adds = 8, 5
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def add():
+        db = SessionLocal()
+        try:
+            barrier.wait()
+            for _ in range(adds):
+                utils.add_to_cart(db, user_id, product_id, 1)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=add) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with SessionLocal() as db:
+        # Un seul panier, une seule ligne, aucun ajout perdu
+        assert db.query(models.Cart).filter(models.Cart.user_id == user_id).count() == 1
+        assert _cart_lines(db, user_id) == {product_id: workers * adds}
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+import chatbot
+import main
+import utils
+from llm import LLMGateway, CircuitBreaker, RECIPE_DEGRADED_MESSAGE
+
+STOCK = ["Riz arborio", "Champignons de Paris", "Parmesan", "Oignon", "Ail", "Citron confit", "Olives vertes"]
+CHUNKS = ["Bismillah,\n", "Suggested dish: Risotto\n", "Used ingredients: Riz arborio\n", "Missing ingredients: None"]
+
+
+def _parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = LLMGateway(max_concurrency=2, queue_timeout=0.1, breaker=CircuitBreaker(threshold=1, cooldown=60))
+    monkeypatch.setattr(chatbot, "llm_gateway", gateway)
+    monkeypatch.setattr(chatbot.recipe_cache, "enabled", False)
+    monkeypatch.setattr(chatbot.ingredient_index, "snapshot", lambda: (STOCK, "stock-test"))
+    return gateway
+
+
+@pytest.fixture
+def stream_calls(monkeypatch):
+    calls = {"started": 0, "closed": 0}
+
+    async def fake_stream_recipe(ingredients, user_message):
+        calls["started"] += 1
+        try:
+            for chunk in CHUNKS:
+                await asyncio.sleep(0)
+                yield chunk
+        finally:
+            calls["closed"] += 1
+
+    monkeypatch.setattr(utils, "stream_recipe", fake_stream_recipe)
+    return calls
+
+
+def _post_stream(message: str) -> list:
+    client = TestClient(main.grosly_app)
+    path = next(route.path for route in main.grosly_app.routes if route.path.endswith("/chatbot/stream"))
+    response = client.post(path, json={"user_message": message})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    return _parse_sse(response.text)
+
+
+def test_stream_event_order(gateway, stream_calls):
+    events = _post_stream("risotto aux champignons")
+    assert [name for name, _ in events] == ["ingredients"] + ["delta"] * len(CHUNKS) + ["done"]
+    assert events[0][1] == STOCK
+    assert "".join(data for name, data in events if name == "delta") == "".join(CHUNKS)
+    assert gateway.stats()["in_flight"] == 0
+    assert gateway.breaker.state == "closed"
+
+
+def test_stream_degraded_when_breaker_open(gateway, stream_calls):
+    gateway.breaker.record_failure()
+    events = _post_stream("risotto aux champignons")
+    assert events == [("ingredients", STOCK), ("error", RECIPE_DEGRADED_MESSAGE), ("done", {})]
+    assert stream_calls["started"] == 0
+
+
+def test_stream_degraded_falls_back_to_local_recipe(gateway, stream_calls):
+    # "poulet" absent du stock : pas de réponse locale d'emblée, mais un secours approchant
+    gateway.breaker.record_failure()
+    events = _post_stream("tajine poulet")
+    assert [name for name, _ in events] == ["ingredients", "delta", "done"]
+    assert "Tajine de poulet" in events[1][1]
+
+
+def test_stream_error_before_first_chunk(gateway, monkeypatch):
+    async def failing_stream_recipe(ingredients, user_message):
+        raise ConnectionError("upstream reset")
+        yield
+
+    monkeypatch.setattr(utils, "stream_recipe", failing_stream_recipe)
+    events = _post_stream("risotto aux champignons")
+    assert events == [("ingredients", STOCK), ("error", utils.RECIPE_ERROR_MESSAGE), ("done", {})]
+    assert gateway.stats()["failures"] == 1
+
+
+def test_client_disconnect_releases_the_slot(gateway, stream_calls):
+    async def read_one_delta_then_leave():
+        events = chatbot.recipe_sse_events("risotto aux champignons", STOCK, "stock-test")
+        assert (await anext(events)).startswith("event: ingredients")
+        assert (await anext(events)).startswith("event: delta")
+        assert gateway.stats()["in_flight"] == 1
+        await events.aclose()
+
+    asyncio.run(read_one_delta_then_leave())
+    assert stream_calls == {"started": 1, "closed": 1}
+    stats = gateway.stats()
+    # Ni succès ni échec : le disjoncteur ne compte pas un client parti
+    assert stats["in_flight"] == 0 and stats["failures"] == 0
+    assert gateway.breaker.state == "closed"
@@ -0,0 +1,49 @@
+import base64
+import json
+import uuid
+from datetime import datetime, timezone
+import pytest
+import schemas
+import utils
+
+
+def _raw_cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("sort, value", [
+    ("newest", datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)),
+    ("price_asc", 12.5),
+    ("price_desc", 3),
+    ("name", "Tomate"),
+    ("relevance", 0.42),
+])
+def test_cursor_round_trip(sort, value):
+    product_id = uuid.uuid4()
+    assert utils.decode_cursor(utils.encode_cursor(sort, value, product_id), sort) == (value, product_id)
+
+
+def test_cursor_from_another_sort_is_rejected():
+    cursor = utils.encode_cursor("newest", datetime.now(timezone.utc), uuid.uuid4())
+    with pytest.raises(ValueError):
+        utils.decode_cursor(cursor, "price_asc")
+    with pytest.raises(ValueError):
+        utils.product_page_select(schemas.ProductListQuery(sort="price_asc", cursor=cursor))
+
+
+@pytest.mark.parametrize("sort, value", [
+    ("newest", 12.5),
+    ("price_asc", "2025-01-02T03:04:05"),
+    ("price_asc", True),
+    ("name", 3),
+    ("relevance", None),
+])
+def test_cursor_value_of_wrong_type_is_rejected(sort, value):
+    with pytest.raises(ValueError):
+        utils.decode_cursor(_raw_cursor([sort, value, str(uuid.uuid4())]), sort)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", _raw_cursor([1, 2]), _raw_cursor(["name", "a", "not-a-uuid"])])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        utils.decode_cursor(cursor, "name")
@@ -0,0 +1,32 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from fast_json import json_bytes
+import utils
+
+
+class _Row(SimpleNamespace):
+    @property
+    def _mapping(self):
+        return vars(self)
+
+
+def test_ndjson_lines_match_the_json_api_encoding():
+    product = _Row(id=uuid.uuid4(), name="Crème fraîche", price=12.5,
+                   created_at=datetime(2025, 1, 1, 10, 0, tzinfo=timezone.utc))
+    image = SimpleNamespace(product_id=product.id, image_url="https://img.test/1.jpg", is_main=True)
+
+    lines = utils.to_ndjson_lines([product], [image]).splitlines()
+
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["created_at"] == json.loads(json_bytes(product.created_at))
+    assert record["created_at"].startswith("2025-01-01T10:00:00")
+    assert record["id"] == str(product.id)
+    assert record["name"] == "Crème fraîche"
+    assert record["images"] == [{"image_url": "https://img.test/1.jpg", "is_main": True}]
+
+
+def test_ndjson_lines_empty_batch():
+    assert utils.to_ndjson_lines([], []) == b""
@@ -0,0 +1,39 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+import events
+import http_cache
+
+
+async def _ok(request):
+    return JSONResponse({"ok": True})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(events, "catalog_version", 7)
+    monkeypatch.setattr(events, "CATALOG_EVENTS_ENABLED", True)
+    app = Starlette(routes=[Route("/grosly_api_office/{path:path}", _ok)])
+    return TestClient(http_cache.CatalogETagMiddleware(app))
+
+
+def test_catalog_read_is_revalidated(client):
+    response = client.get("/grosly_api_office/products")
+    assert response.headers["etag"] == '"catalog-7"'
+    assert client.get("/grosly_api_office/products", headers={"If-None-Match": '"catalog-7"'}).status_code == 304
+
+
+def test_todays_choice_has_no_etag(client):
+    # Le classement change chaque jour (daily) ou avec les ventes (best_selling), sans nouvelle version
+    response = client.get("/grosly_api_office/products/todays-choice", headers={"If-None-Match": '"catalog-7"'})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+
+
+def test_no_etag_without_catalog_events(client, monkeypatch):
+    monkeypatch.setattr(events, "CATALOG_EVENTS_ENABLED", False)
+    response = client.get("/grosly_api_office/products", headers={"If-None-Match": '"catalog-7"'})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+import time
+from llm import LLMGateway
+
+
+def test_async_waiter_gets_slot_released_by_a_thread():
+    gateway = LLMGateway(max_concurrency=1, queue_timeout=2)
+    assert gateway._slots.acquire(blocking=False)
+    threading.Timer(0.1, gateway._slots.release).start()
+
+    start = time.perf_counter()
+    assert asyncio.run(gateway._acquire_async()) is True
+    # Réveillé à la libération, pas au prochain tour d'une boucle de sondage
+    assert time.perf_counter() - start < 0.5
+    gateway._slots.release()
+
+
+def test_async_waiter_gives_up_after_queue_timeout():
+    gateway = LLMGateway(max_concurrency=1, queue_timeout=0.1)
+    assert gateway._slots.acquire(blocking=False)
+    assert asyncio.run(gateway._acquire_async()) is False
+    gateway._slots.release()
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    gateway = LLMGateway(max_concurrency=1, queue_timeout=2)
+    assert gateway._slots.acquire(blocking=False)
+
+    async def leave_while_waiting():
+        waiter = asyncio.ensure_future(gateway._acquire_async())
+        await asyncio.sleep(0.05)
+        threading.Timer(0.05, gateway._slots.release).start()
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(leave_while_waiting())
+    # La place rendue par le Timer n'est pas restée prise par l'attente annulée
+    assert gateway._slots.acquire(timeout=1)
@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+import settings
+
+METRICS_PATH = "/grosly_api_office/metrics"
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.grosly_app)
+
+
+def test_metrics_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", None)
+    assert client.get(METRICS_PATH, headers={"X-Metrics-Token": ""}).status_code == 404
+
+
+def test_metrics_require_the_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "s3cret")
+    assert client.get(METRICS_PATH).status_code == 401
+    assert client.get(METRICS_PATH, headers={"X-Metrics-Token": "wrong"}).status_code == 401
+    response = client.get(METRICS_PATH, headers={"X-Metrics-Token": "s3cret"})
+    assert response.status_code == 200
+    # Le thread de /metrics lui-même n'est pas compté
+    assert response.json()["threadpool"]["busy"] == 0
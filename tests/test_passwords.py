@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import uuid
+import pytest
+from fastapi import HTTPException
+import schemas
+import views
+from passwords import PasswordHasher, password_hasher
+
+
+def _signup(**overrides):
+    fields = dict(
+        userlastname="Test", userfirstname="Inscription", email=f"inscription-{uuid.uuid4().hex[:8]}@test.ma",
+        pays="Maroc", password="motdepasse-solide", termes_active=True,
+    )
+    return schemas.UserCreate(**{**fields, **overrides})
+
+
+def test_signup_without_terms_is_rejected_before_hashing(db):
+    hashes = password_hasher.stats()["hashes"]
+    with pytest.raises(ValueError, match="terms"):
+        asyncio.run(views.create_user_view(_signup(termes_active=False), db))
+    assert password_hasher.stats()["hashes"] == hashes
+
+
+def test_async_waiter_gets_slot_released_by_a_thread():
+    hasher = PasswordHasher(workers=1, max_pending=1, queue_timeout=2)
+    assert hasher._pending.acquire(blocking=False)
+    threading.Timer(0.1, hasher._pending.release).start()
+    assert asyncio.run(hasher._acquire_async()) is True
+    hasher._pending.release()
+
+
+def test_async_waiter_gets_503_after_queue_timeout():
+    hasher = PasswordHasher(workers=1, max_pending=1, queue_timeout=0.1)
+    assert hasher._pending.acquire(blocking=False)
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(hasher._run_async(len, "x"))
+    assert excinfo.value.status_code == 503
+    hasher._pending.release()
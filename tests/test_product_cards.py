@@ -0,0 +1,86 @@
+import json
+import uuid
+import pytest
+import models
+import schemas
+import utils
+import views
+from cache import catalog_cache
+
+
+def _create_products(db, count, images_per_product=3):
+    category = models.Category(name="Test cartes", slug=f"test-cartes-{uuid.uuid4().hex[:8]}")
+    db.add(category)
+    products = []
+    for n in range(count):
+        product = models.Product(
+            name=f"Produit test {n}",
+            slug=f"produit-test-{uuid.uuid4().hex[:12]}",
+            price=10.0 + n,
+            promo_price=5.0 + n,
+            stock=5,
+            category=category,
+        )
+        product.images = [
+            models.ProductImage(image_url=f"https://img.test/{n}/{i}.jpg", is_main=(i == 1))
+            for i in range(images_per_product)
+        ]
+        products.append(product)
+    db.add_all(products)
+    db.flush()
+    return products
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_product_cards_single_query(db, count_queries, count):
+    products = _create_products(db, count)
+    stmt = utils.product_cards_select().where(models.Product.id.in_([p.id for p in products]))
+
+    statements = count_queries()
+    cards = utils.get_product_cards(db, stmt)
+
+    assert len(statements) == 1
+    assert len(cards) == count
+    # Image principale de chaque produit, sans requête supplémentaire
+    assert {card["image"] for card in cards} == {f"https://img.test/{n}/1.jpg" for n in range(count)}
+
+
+@pytest.fixture
+def no_catalog_cache(monkeypatch):
+    monkeypatch.setattr(catalog_cache, "enabled", False)
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_shelf_views_issue_one_query(db, count_queries, no_catalog_cache, count):
+    products = _create_products(db, count)
+    category_id = products[0].category_id
+    shelves = {
+        "todays_choice": lambda: views.get_todays_choice_view(db, ranking="newest"),
+        "limited_discount": lambda: views.get_limited_discount_view(db),
+        "cheapest": lambda: views.get_cheapest_products_view(db),
+        "list_products": lambda: views.list_products_view(
+            schemas.ProductListQuery(category_id=category_id, limit=100), db
+        ),
+    }
+    for name, view in shelves.items():
+        statements = count_queries()
+        body = json.loads(view().body)
+        # Une requête quel que soit le nombre de cartes (pas de chargement d'image par produit)
+        assert len(statements) == 1, name
+        cards = body["items"] if name == "list_products" else body
+        assert cards, name
+    assert len(cards) == count
+    assert {card["image"] for card in cards} == {f"https://img.test/{n}/1.jpg" for n in range(count)}
+
+
+def test_todays_choice_skips_products_without_category(db):
+    products = _create_products(db, 1)
+    orphan = models.Product(
+        name="Produit sans catégorie", slug=f"produit-orphelin-{uuid.uuid4().hex[:12]}", price=1.0, stock=5,
+    )
+    db.add(orphan)
+    db.flush()
+
+    ids = {card["id"] for card in utils.get_product_cards(db, utils.todays_choice_select(size=1000))}
+    assert str(orphan.id) not in ids
+    assert str(products[0].id) in ids
@@ -0,0 +1,34 @@
+import pytest
+from recipes import RecipeMatcher
+
+STOCK = [
+    "Poulet fermier", "Olives vertes", "Citron confit", "Oignon", "Ail", "Gingembre", "Curcuma", "Safran",
+    "Coriandre", "Persil", "Huile d'olive", "Pommes de terre", "Tomates", "Sel", "Poivre", "Cumin",
+]
+
+
+@pytest.fixture
+def matcher():
+    return RecipeMatcher()
+
+
+def test_positive_request_is_answered_locally(matcher):
+    recipe = matcher.match("tajine poulet", STOCK, "stock")
+    assert recipe is not None
+    assert "Tajine de poulet" in recipe
+
+
+@pytest.mark.parametrize("message", [
+    "tajine poulet sans olives",
+    "tajine sans poulet",
+    "pas de poulet",
+    "un tajine sauf olives",
+    "ni poulet ni olives",
+    "aucun poulet",
+    "Tajine SANS Olives",
+])
+def test_negated_request_goes_to_llm(matcher, message):
+    assert matcher.match(message, STOCK, "stock") is None
+    # Pas de secours local non plus : il proposerait l'ingrédient refusé
+    assert matcher.match(message, STOCK, "stock", min_coverage=0) is None
+    assert matcher.stats()["answered"] == 0
@@ -0,0 +1,55 @@
+import threading
+import time
+
+# ======================================================
+# RÉVOCATION DES JETONS (liste de refus en mémoire)
+# ======================================================
+# Chaque connexion ouvre une famille de jetons (claim "fam" du jeton d'accès
+# et du jeton de rafraîchissement, qui porte aussi son propre "jti"). Chaque
+# rafraîchissement consomme le jeton présenté et en émet un nouveau dans la
+# même famille ; présenter un jeton déjà consommé (vol, rejeu) ou se
+# déconnecter révoque toute la famille en base (jetons_rafraichissement).
+# Les workers l'apprennent par events.py et gardent ici les familles
+# révoquées : vérifier un jeton d'accès reste une recherche dans un dict,
+# sans requête. Une famille y reste jusqu'à l'expiration de ses jetons.
+
+
+class TokenDenylist:
+    def __init__(self):
+        self._families = {}   # family_id -> fin de validité (timestamp)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def revoke(self, family_id: str, expires_at: float):
+        with self._lock:
+            self._families[str(family_id)] = max(expires_at, self._families.get(str(family_id), 0))
+            self._prune()
+
+    def replace(self, families: dict):
+        """Remplace tout le contenu (chargement depuis la base au démarrage / à la reconnexion)"""
+        families = {str(family_id): expires_at for family_id, expires_at in families.items()}
+        with self._lock:
+            self._families = families
+            self._prune()
+
+    def is_revoked(self, family_id) -> bool:
+        # Jetons émis avant les familles : rien à vérifier
+        if family_id is None:
+            return False
+        expires_at = self._families.get(family_id)
+        if expires_at is None or expires_at < time.time():
+            return False
+        with self._lock:
+            self.rejected += 1
+        return True
+
+    def _prune(self):
+        now = time.time()
+        self._families = {family_id: t for family_id, t in self._families.items() if t >= now}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"revoked_families": len(self._families), "rejected": self.rejected}
+
+
+token_denylist = TokenDenylist()
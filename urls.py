@@ -1,13 +1,13 @@
+from typing import List, Optional, Annotated
 from uuid import UUID
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
-from utils import generate_recipe
 import views
 import schemas
-from models import Product, UserProfile
-from settings import get_db, get_current_user
+from fast_json import FastJSONResponse
+from settings import get_db, get_current_user, get_token_principal, require_metrics_token, TODAYS_CHOICE_RANKING
 
 router = APIRouter(
     prefix="/grosly_api_office",
@@ -18,23 +18,27 @@ router = APIRouter(
 # AUTH
 # ======================================================
 @router.post("/grosly_token_office", response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    return views.login_view(form_data, db)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    return await views.login_view(form_data, db)
 
 @router.post("/grosly_token_refresh_office", response_model=schemas.Token)
 def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
     return views.refresh_token_view(refresh_token, db)
 
-@router.get("/current_user", response_model=schemas.UserRead)
-def current_user(current_user: UserProfile = Depends(get_current_user)):
+@router.post("/grosly_logout_office", status_code=status.HTTP_204_NO_CONTENT)
+def logout(refresh_token: str, db: Session = Depends(get_db)):
+    views.logout_view(refresh_token, db)
+
+@router.get("/current_user", response_model=schemas.UserRead, response_class=FastJSONResponse)
+def current_user(current_user: schemas.UserRead = Depends(get_token_principal)):
     return current_user
 
 # ======================================================
 # USERS
 # ======================================================
 @router.post("/users", response_model=schemas.UserRead, status_code=status.HTTP_201_CREATED)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    return views.create_user_view(user, db)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    return await views.create_user_view(user, db)
 
 @router.get("/users/{user_id}", response_model=schemas.UserRead)
 def get_user(user_id: UUID, db: Session = Depends(get_db)):
@@ -55,11 +59,15 @@ def delete_user(user_id: UUID, db: Session = Depends(get_db)):
 def create_category(category: schemas.CategoryCreate, db: Session = Depends(get_db)):
     return views.create_category_view(category, db)
 
-@router.get("/categories")
+@router.get("/categories", response_class=FastJSONResponse)
 def list_categories(db: Session = Depends(get_db)):
     return views.list_categories_view(db)
 
-@router.get("/categories/{category_id}", response_model=schemas.CategoryRead)
+@router.get("/categories/browse", response_class=FastJSONResponse)
+def browse_categories(db: Session = Depends(get_db)):
+    return views.browse_categories_view(db)
+
+@router.get("/categories/{category_id}", response_model=schemas.CategoryRead, response_class=FastJSONResponse)
 def get_category(category_id: UUID, db: Session = Depends(get_db)):
     return views.get_category_view(category_id, db)
 
@@ -79,24 +87,32 @@ def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)
     return views.create_product_view(product, db)
 
 # ✅ ROUTES SPÉCIFIQUES AVANT LES ROUTES AVEC {product_id}
-@router.get("/products/todays-choice")
-def get_todays_choice(db: Session = Depends(get_db)):
-    return views.get_todays_choice_view(db)
+@router.get("/products/todays-choice", response_class=FastJSONResponse)
+def get_todays_choice(ranking: Optional[str] = None, db: Session = Depends(get_db)):
+    return views.get_todays_choice_view(db, ranking or TODAYS_CHOICE_RANKING)
 
-@router.get("/products/limited-discount")
+@router.get("/products/limited-discount", response_class=FastJSONResponse)
 def get_limited_discount(db: Session = Depends(get_db)):
     return views.get_limited_discount_view(db)
 
-@router.get("/products/cheapest")
+@router.get("/products/cheapest", response_class=FastJSONResponse)
 def get_cheapest_products(db: Session = Depends(get_db)):
     return views.get_cheapest_products_view(db)
 
-@router.get("/products")
-def list_products(db: Session = Depends(get_db)):
-    return views.list_products_view(db)
+@router.get("/products/search", response_class=FastJSONResponse)
+def search_products(params: Annotated[schemas.ProductSearchQuery, Query()], db: Session = Depends(get_db)):
+    return views.search_products_view(params, db)
+
+@router.get("/products/export")
+def export_products():
+    return views.export_products_view()
+
+@router.get("/products", response_class=FastJSONResponse)
+def list_products(params: Annotated[schemas.ProductListQuery, Query()], db: Session = Depends(get_db)):
+    return views.list_products_view(params, db)
 
 # ⚠️ CETTE ROUTE DOIT ÊTRE APRÈS LES ROUTES SPÉCIFIQUES
-@router.get("/products/{product_id}", response_model=schemas.ProductRead)
+@router.get("/products/{product_id}", response_model=schemas.ProductRead, response_class=FastJSONResponse)
 def get_product(product_id: UUID, db: Session = Depends(get_db)):
     return views.get_product_view(product_id, db)
 
@@ -115,7 +131,7 @@ def delete_product(product_id: UUID, db: Session = Depends(get_db)):
 def add_product_image(product_id: UUID, image: schemas.ProductImageCreate, db: Session = Depends(get_db)):
     return views.add_product_image_view(product_id, image.image_url, image.is_main, db)
 
-@router.get("/products/{product_id}/images", response_model=list[schemas.ProductImageRead])
+@router.get("/products/{product_id}/images", response_model=list[schemas.ProductImageRead], response_class=FastJSONResponse)
 def get_product_images(product_id: UUID, db: Session = Depends(get_db)):
     return views.get_product_images_view(product_id, db)
 
@@ -123,10 +139,16 @@ def get_product_images(product_id: UUID, db: Session = Depends(get_db)):
 # CART
 # ======================================================
 @router.post("/cart/items", response_model=schemas.CartItemRead)
-def add_to_cart(item: schemas.CartItemCreate, db: Session = Depends(get_db)):
-    return views.add_to_cart_view(item.user_id, item.product_id, item.quantity, item.price, db)
+def add_to_cart(item: schemas.CartItemCreate, current_user: schemas.UserRead = Depends(get_current_user),
+                db: Session = Depends(get_db)):
+    return views.add_to_cart_view(current_user.id, item.product_id, item.quantity, db)
 
-@router.get("/cart/{user_id}", response_model=schemas.CartRead)
+@router.patch("/cart/items", response_model=List[schemas.CartItemRead])
+def update_cart_items(update: schemas.CartItemsUpdate, current_user: schemas.UserRead = Depends(get_current_user),
+                      db: Session = Depends(get_db)):
+    return views.update_cart_items_view(current_user.id, update, db)
+
+@router.get("/cart/{user_id}", response_model=schemas.CartRead, response_class=FastJSONResponse)
 def get_cart(user_id: UUID, db: Session = Depends(get_db)):
     return views.get_cart_view(user_id, db)
 
@@ -159,30 +181,29 @@ def create_review(review: schemas.ReviewCreate, db: Session = Depends(get_db)):
 # CHATBOT
 # ======================================================
 @router.post("/chatbot")
-def recipe_chatbot(request: schemas.ChatbotRequest, db: Session = Depends(get_db)):
+def recipe_chatbot(request: schemas.ChatbotRequest):
     """
     Chatbot pour suggérer des recettes marocaines
     """
-    print(f"📥 Requête chatbot reçue: {request.user_message}")
-    
-    # Récupérer tous les produits disponibles
-    produits = db.query(Product).filter(Product.stock > 0).all()
-    ingredients = [p.name for p in produits if p.name]
-
-    if not ingredients:
-        return {
-            "ingredients": [],
-            "chatbot_response": "Désolé, aucun ingrédient n'est disponible pour le moment."
-        }
-    
-    print(f"📦 {len(ingredients)} ingrédients disponibles")
-    
-    # Générer la réponse du chatbot
-    response = generate_recipe(ingredients, request.user_message)
-    
-    print(f"✅ Réponse générée: {response[:100]}...")
-    
-    return {
-        "ingredients": ingredients,
-        "chatbot_response": response
-    }
\ No newline at end of file
+    return views.recipe_chatbot_view(request.user_message)
+
+@router.post("/chatbot/stream")
+def recipe_chatbot_stream(request: schemas.ChatbotRequest):
+    """
+    Chatbot en streaming (Server-Sent Events) : le texte arrive au fil de la génération
+    """
+    return views.recipe_chatbot_stream_view(request.user_message)
+
+# ======================================================
+# AUTOCOMPLETE (sans base de données en régime établi)
+# ======================================================
+@router.get("/autocomplete", response_class=FastJSONResponse)
+def autocomplete(q: str = Query(min_length=1, max_length=100), limit: int = Query(8, ge=1, le=20)):
+    return views.autocomplete_view(q, limit)
+
+# ======================================================
+# METRICS
+# ======================================================
+@router.get("/metrics", dependencies=[Depends(require_metrics_token)])
+def metrics():
+    return views.metrics_view()
@@ -1,7 +1,18 @@
+import base64
+import json
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete, func, cast, column, values, true, String, Float, Integer, tuple_, and_, or_, literal_column
+from sqlalchemy.dialects.postgresql import insert, UUID
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from settings import verify_password, hash_password
+from settings import hash_password, create_token_pair, SessionLocal, REFRESH_TOKEN_EXPIRE_DAYS
 import models
-from groq import Groq # type: ignore
+from fast_json import json_bytes
+import events  # noqa: F401 - publie les changements du catalogue (hooks de Session)
+from groq import Groq, AsyncGroq # type: ignore
 import os
 
 import uuid
@@ -9,32 +20,126 @@ import uuid
 # ======================================================
 # AUTH / USERS
 # ======================================================
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(models.UserProfile).filter(models.UserProfile.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
-        return None
-    return user
+class DuplicateEmailError(ValueError):
+    """Adresse déjà utilisée par un autre compte (casse ignorée)"""
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+def user_by_email_select(email: str):
+    # Servi par l'index unique ux_profiles_utilisateurs_email
+    return select(models.UserProfile).where(
+        models.email_key(models.UserProfile.email) == normalize_email(email)
+    )
+
+def get_user_by_email(db: Session, email: str):
+    return db.execute(user_by_email_select(email)).scalars().first()
 
 def reset_password(db: Session, user_id: str, new_password: str):
-    user = db.query(models.UserProfile).filter(models.UserProfile.user_id == user_id).first()
+    user = db.query(models.UserProfile).filter(models.UserProfile.id == user_id).first()
     if not user:
         return None
     user.hashed_password = hash_password(new_password)
+    # Nouveau mot de passe : toutes les sessions ouvertes sont fermées
+    revoke_refresh_tokens(db, models.RefreshToken.user_id == user.id)
     db.commit()
     db.refresh(user)
     return user
 
+# ======================================================
+# JETONS DE RAFRAÎCHISSEMENT (rotation, révocation)
+# ======================================================
+class InvalidRefreshToken(ValueError):
+    """Jeton inconnu, antérieur aux familles, révoqué ou déjà échangé"""
+
+
+def refresh_token_ids(payload: dict):
+    """(jti, famille) du jeton ; les jetons émis avant la rotation n'en ont pas"""
+    try:
+        return uuid.UUID(payload["jti"]), uuid.UUID(payload["fam"])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidRefreshToken("missing jti/fam")
+
+def new_refresh_token(user_id, family_id=None) -> models.RefreshToken:
+    """Ligne du prochain jeton (nouvelle famille à la connexion) ; jti connu avant le flush"""
+    return models.RefreshToken(
+        jti=uuid.uuid4(),
+        family_id=family_id or uuid.uuid4(),
+        user_id=user_id,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+
+def live_refresh_tokens_select(*criteria):
+    return select(models.RefreshToken).where(models.RefreshToken.revoked_at.is_(None), *criteria)
+
+def refresh_token_select(jti):
+    # FOR UPDATE : deux échanges simultanés du même jeton passent l'un après l'autre,
+    # le second voit used_at et révoque la famille
+    return select(models.RefreshToken).where(models.RefreshToken.jti == jti).with_for_update()
+
+def start_token_family(db: Session, user) -> dict:
+    """Connexion : nouvelle famille ; réponse schemas.Token construite avant le COMMIT
+    (qui expire user et le jeton)"""
+    token = new_refresh_token(user.id)
+    db.add(token)
+    tokens = create_token_pair(user, token)
+    db.commit()
+    return tokens
+
+def revoke_refresh_tokens(db: Session, *criteria):
+    """Révoque (sans COMMIT) les jetons encore valides ; events.py publie leurs familles"""
+    now = datetime.now(timezone.utc)
+    for token in db.execute(live_refresh_tokens_select(*criteria)).scalars():
+        token.revoked_at = now
+
+def rotate_refresh_token(db: Session, payload: dict) -> dict:
+    """Consomme le jeton présenté et émet le suivant de la même famille.
+    Un jeton déjà échangé (vol, rejeu) révoque toute sa famille."""
+    jti, family_id = refresh_token_ids(payload)
+    token = db.execute(refresh_token_select(jti)).scalars().first()
+    if token is None or token.family_id != family_id:
+        raise InvalidRefreshToken("unknown jti")
+    if token.used_at is not None and token.revoked_at is None:
+        revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id)
+        db.commit()
+        raise InvalidRefreshToken("reused")
+    if token.used_at is not None or token.revoked_at is not None:
+        db.rollback()
+        raise InvalidRefreshToken("revoked")
+    token.used_at = datetime.now(timezone.utc)
+    successor = new_refresh_token(token.user_id, family_id)
+    db.add(successor)
+    # Supprimer le compte supprime ses jetons (ON DELETE CASCADE) : l'utilisateur existe
+    tokens = create_token_pair(get_user(db, token.user_id), successor)
+    db.commit()
+    return tokens
+
+def revoke_token_family(db: Session, payload: dict):
+    """Déconnexion : la famille du jeton présenté (tous ses jetons, y compris d'accès)"""
+    _, family_id = refresh_token_ids(payload)
+    revoke_refresh_tokens(db, models.RefreshToken.family_id == family_id)
+    db.commit()
+
 # ======================================================
 # CRUD USERS
 # ======================================================
-def create_user(db: Session, user):
+def require_terms(user):
     if not user.termes_active:
         raise ValueError("User must accept terms and conditions")
-    hashed_password = hash_password(user.password)
+
+def create_user(db: Session, user, hashed_password: str = None):
+    """hashed_password : hash déjà calculé par l'appelant (route async, doublon déjà vérifié)"""
+    require_terms(user)
+    if hashed_password is None:
+        # Avant le hachage : inutile de payer argon2 pour un doublon
+        if get_user_by_email(db, user.email):
+            raise DuplicateEmailError(user.email)
+        hashed_password = hash_password(user.password)
     db_user = models.UserProfile(
         userlastname=user.userlastname,
         userfirstname=user.userfirstname,
-        email=user.email,
+        email=normalize_email(user.email),
         phone_number=user.phone_number,
         pays=user.pays,
         indicatif_pays=user.indicatif_pays,
@@ -43,12 +148,22 @@ def create_user(db: Session, user):
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
+    commit_user(db)
     db.refresh(db_user)
     return db_user
 
+def commit_user(db: Session):
+    """COMMIT ; une inscription concurrente sur la même adresse devient DuplicateEmailError"""
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if "ux_profiles_utilisateurs_email" in str(e.orig):
+            raise DuplicateEmailError() from e
+        raise
+
 def get_user(db: Session, user_id: str):
-    return db.query(models.UserProfile).filter(models.UserProfile.user_id == user_id).first()
+    return db.query(models.UserProfile).filter(models.UserProfile.id == user_id).first()
 
 def update_user(db: Session, user_id: str, updates):
     user = get_user(db, user_id)
@@ -57,9 +172,11 @@ def update_user(db: Session, user_id: str, updates):
     for key, value in updates.dict(exclude_unset=True).items():
         if key == "password":
             setattr(user, "hashed_password", hash_password(value))
+        elif key == "email":
+            setattr(user, key, normalize_email(value))
         else:
             setattr(user, key, value)
-    db.commit()
+    commit_user(db)
     db.refresh(user)
     return user
 
@@ -162,22 +279,434 @@ def add_product_image(db: Session, product_id: str, image_url: str, is_main: boo
 def get_product_images(db: Session, product_id: str):
     return db.query(models.ProductImage).filter(models.ProductImage.product_id == product_id).all()
 
+# ======================================================
+# TEXTE (clés de comparaison)
+# ======================================================
+_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae"})
+
+def normalize_text(text: str) -> str:
+    """Minuscules, sans accents, espaces simples : "Crème  Fraîche" -> "creme fraiche" """
+    decomposed = unicodedata.normalize("NFKD", text.casefold().translate(_LIGATURES))
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+# Mots vides ignorés dans les messages du chatbot
+STOPWORDS = {
+    "a", "au", "aux", "avec", "ce", "ces", "cette", "d", "de", "des", "du", "en", "et", "j", "je", "l",
+    "la", "le", "les", "ma", "mes", "mon", "ou", "pas", "pour", "qu", "quoi", "sans", "un", "une",
+    "veux", "voudrais",
+}
+
+def content_words(text: str) -> list[str]:
+    """Mots significatifs d'un texte normalisé : "Huile d'olive" -> ["huile", "olive"]"""
+    return [word for word in re.findall(r"\w+", normalize_text(text)) if word not in STOPWORDS]
+
+# ======================================================
+# PRODUCT CARDS (projection partagée des vitrines)
+# ======================================================
+PLACEHOLDER_IMAGE_URL = "https://via.placeholder.com/150"
+
+def main_image_url(product_id_column):
+    """
+    Sous-requête corrélée : image principale du produit, sinon la première ajoutée.
+    Évaluée par Postgres pour chaque ligne, donc aucune requête supplémentaire par produit.
+    """
+    return (
+        select(models.ProductImage.image_url)
+        .where(models.ProductImage.product_id == product_id_column)
+        .order_by(
+            models.ProductImage.is_main.desc().nulls_last(),
+            models.ProductImage.created_at,
+        )
+        .limit(1)
+        .correlate_except(models.ProductImage)
+        .scalar_subquery()
+    )
+
+def product_cards_select():
+    """SELECT des seules colonnes nécessaires aux cartes produit + l'URL de l'image"""
+    return select(
+        models.Product.id,
+        models.Product.name,
+        models.Product.description,
+        models.Product.price,
+        models.Product.promo_price,
+        models.Product.stock,
+        models.Product.category_id,
+        models.Product.weight,
+        main_image_url(models.Product.id).label("image"),
+    )
+
+def to_product_card(row) -> dict:
+    return {
+        "id": str(row.id),
+        "name": row.name,
+        "description": row.description,
+        "price": row.price,
+        "promo_price": row.promo_price,
+        "stock": row.stock,
+        "category_id": str(row.category_id) if row.category_id else None,
+        "weight": row.weight,
+        "image": row.image or PLACEHOLDER_IMAGE_URL,
+    }
+
+def get_product_cards(db: Session, stmt) -> list[dict]:
+    """Exécute un SELECT construit sur product_cards_select() en une seule requête"""
+    return [to_product_card(row) for row in db.execute(stmt).all()]
+
+# ======================================================
+# LISTE PRODUITS (pagination par curseur / keyset)
+# ======================================================
+def effective_price():
+    """Prix payé par le client (même expression que l'index ix_produits_effective_price_id)"""
+    return func.coalesce(models.Product.promo_price, models.Product.price)
+
+# tri -> (colonne de tri, ordre décroissant ?)
+PRODUCT_SORTS = {
+    "newest": (lambda: models.Product.created_at, True),
+    "price_asc": (effective_price, False),
+    "price_desc": (effective_price, True),
+    "name": (lambda: models.Product.name, False),
+}
+
+def encode_cursor(sort: str, value, product_id) -> str:
+    """Curseur opaque : le tri pour lequel il a été émis, la valeur de tri et l'id de la dernière ligne"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, str(product_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _cursor_value(sort: str, value):
+    # Le type doit correspondre à la colonne de tri : sinon Postgres échouerait (500)
+    if sort == "newest":
+        if not isinstance(value, str):
+            raise ValueError("newest cursor expects a timestamp")
+        return datetime.fromisoformat(value)
+    if sort == "name":
+        if not isinstance(value, str):
+            raise ValueError("name cursor expects a string")
+        return value
+    # price_asc, price_desc, relevance
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{sort} cursor expects a number")
+    return float(value)
+
+def decode_cursor(cursor: str, sort: str):
+    """Retourne (valeur de tri, id) ; ValueError si le curseur est invalide ou émis pour un autre tri"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, product_id = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError(f"cursor issued for sort={cursor_sort!r}")
+        return _cursor_value(sort, value), uuid.UUID(product_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+def product_page_select(params):
+    """
+    Page de cartes produit : filtres + tri (colonne, id), en reprenant
+    strictement après le curseur. Le coût reste le même quelle que soit la
+    profondeur de la page (pas d'OFFSET).
+    """
+    sort_column, descending = PRODUCT_SORTS[params.sort]
+    sort_key = sort_column()
+    stmt = product_cards_select().add_columns(sort_key.label("sort_value"))
+
+    if params.category_id:
+        stmt = stmt.where(models.Product.category_id == params.category_id)
+    if params.min_price is not None:
+        stmt = stmt.where(effective_price() >= params.min_price)
+    if params.max_price is not None:
+        stmt = stmt.where(effective_price() <= params.max_price)
+    if params.in_stock:
+        stmt = stmt.where(models.Product.stock > 0)
+    if params.promo_only:
+        stmt = stmt.where(models.Product.promo_price.isnot(None))
+
+    if params.cursor:
+        value, last_id = decode_cursor(params.cursor, params.sort)
+        after = tuple_(sort_key, models.Product.id)
+        stmt = stmt.where(after < tuple_(value, last_id) if descending else after > tuple_(value, last_id))
+
+    if descending:
+        stmt = stmt.order_by(sort_key.desc(), models.Product.id.desc())
+    else:
+        stmt = stmt.order_by(sort_key, models.Product.id)
+    # Une ligne de plus pour savoir s'il existe une page suivante
+    return stmt.limit(params.limit + 1)
+
+def to_product_page(rows, limit: int, sort: str) -> dict:
+    """sort : tri de la page ("relevance" pour la recherche), inscrit dans le curseur suivant"""
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(sort, last.sort_value, last.id)
+    return {
+        "items": [to_product_card(row) for row in items],
+        "next_cursor": next_cursor,
+    }
+
+# ======================================================
+# NAVIGATION CATÉGORIES (facettes en une seule requête)
+# ======================================================
+# Bornes des tranches de prix (prix effectif) : [0, 10[, [10, 25[ ... [100, +inf[
+PRICE_BUCKETS = (0, 10, 25, 50, 100)
+
+def category_facets_select():
+    """
+    Chaque catégorie avec, pour ses produits en stock : nombre, nombre en
+    promo et histogramme des prix. Un seul GROUP BY (agrégats FILTER) ;
+    les catégories vides sont gardées (LEFT JOIN).
+    """
+    in_stock = models.Product.stock > 0
+    price = effective_price()
+    bounds = list(PRICE_BUCKETS) + [None]
+    buckets = []
+    for i, (low, high) in enumerate(zip(bounds, bounds[1:])):
+        condition = and_(in_stock, price >= low) if high is None else and_(in_stock, price >= low, price < high)
+        buckets.append(func.count(models.Product.id).filter(condition).label(f"bucket_{i}"))
+    return select(
+        models.Category.id,
+        models.Category.name,
+        models.Category.slug,
+        models.Category.is_active,
+        func.count(models.Product.id).filter(in_stock).label("in_stock_count"),
+        func.count(models.Product.id).filter(and_(in_stock, models.Product.promo_price.isnot(None))).label("promo_count"),
+        *buckets,
+    ).outerjoin(
+        models.Product, models.Product.category_id == models.Category.id
+    ).group_by(
+        models.Category.id
+    ).order_by(models.Category.name, models.Category.id)
+
+def to_category_facets(rows) -> list[dict]:
+    bounds = list(PRICE_BUCKETS) + [None]
+    return [
+        {
+            "id": str(row.id),
+            "name": row.name,
+            "slug": row.slug,
+            "is_active": row.is_active,
+            "in_stock_count": row.in_stock_count,
+            "promo_count": row.promo_count,
+            "price_buckets": [
+                {"min": low, "max": high, "count": row._mapping[f"bucket_{i}"]}
+                for i, (low, high) in enumerate(zip(bounds, bounds[1:]))
+            ],
+        }
+        for row in rows
+    ]
+
+# ======================================================
+# RECHERCHE PRODUITS (plein texte français + trigrammes)
+# ======================================================
+SEARCH_CONFIG = literal_column("'french'::regconfig")
+
+def product_search_select(params):
+    """
+    Recherche sans accents : plein texte sur nom + description (racinisation
+    française, index GIN ix_produits_search_vector), et trigrammes sur le nom
+    pour les fautes de frappe (ix_produits_name_trgm). Tri par pertinence,
+    pagination par curseur (pertinence, id).
+    """
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, func.grosly_unaccent(params.q))
+    query_key = models.search_key(params.q)
+    name_key = models.search_key(models.Product.name)
+    # Le nom compte deux fois : poids A dans le tsvector + similarité trigramme
+    score = cast(
+        func.ts_rank_cd(models.Product.search_vector, ts_query) + func.word_similarity(query_key, name_key),
+        Float,
+    )
+    stmt = product_cards_select().add_columns(score.label("sort_value")).where(
+        or_(
+            models.Product.search_vector.op("@@")(ts_query),
+            query_key.op("<%")(name_key),
+        )
+    )
+
+    if params.category_id:
+        stmt = stmt.where(models.Product.category_id == params.category_id)
+    if params.in_stock:
+        stmt = stmt.where(models.Product.stock > 0)
+
+    if params.cursor:
+        value, last_id = decode_cursor(params.cursor, "relevance")
+        stmt = stmt.where(tuple_(score, models.Product.id) < tuple_(value, last_id))
+
+    return stmt.order_by(score.desc(), models.Product.id.desc()).limit(params.limit + 1)
+
+# ======================================================
+# EXPORT CATALOGUE (NDJSON en flux)
+# ======================================================
+EXPORT_BATCH_SIZE = 1000
+
+def catalog_export_select(batch_size: int = EXPORT_BATCH_SIZE):
+    # yield_per : curseur côté serveur, on ne garde qu'un lot en mémoire
+    return select(
+        models.Product.id,
+        models.Product.name,
+        models.Product.slug,
+        models.Product.description,
+        models.Product.price,
+        models.Product.promo_price,
+        models.Product.stock,
+        models.Product.is_active,
+        models.Product.category_id,
+        models.Product.weight,
+        models.Product.created_at,
+    ).order_by(models.Product.id).execution_options(yield_per=batch_size)
+
+def catalog_images_select(product_ids):
+    return select(
+        models.ProductImage.product_id,
+        models.ProductImage.image_url,
+        models.ProductImage.is_main,
+    ).where(
+        models.ProductImage.product_id.in_(product_ids)
+    ).order_by(
+        models.ProductImage.product_id,
+        models.ProductImage.is_main.desc().nulls_last(),
+        models.ProductImage.created_at,
+    )
+
+def to_ndjson_lines(products, images) -> bytes:
+    """Un lot de produits + leurs images -> lignes NDJSON (même encodage que l'API JSON : dates ISO 8601)"""
+    by_product = defaultdict(list)
+    for image in images:
+        by_product[image.product_id].append({"image_url": image.image_url, "is_main": bool(image.is_main)})
+    lines = []
+    for product in products:
+        record = dict(product._mapping)
+        record["images"] = by_product.get(product.id, [])
+        lines.append(json_bytes(record))
+    return b"\n".join(lines) + b"\n" if lines else b""
+
+def iter_catalog_ndjson(batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Générateur NDJSON du catalogue complet, lot par lot.
+    Ouvre sa propre session : le flux continue après la fin du handler.
+    """
+    db = SessionLocal()
+    try:
+        for partition in db.execute(catalog_export_select(batch_size)).partitions():
+            images = db.execute(catalog_images_select([row.id for row in partition])).all()
+            yield to_ndjson_lines(partition, images)
+    finally:
+        db.close()
+
+# ======================================================
+# TODAY'S CHOICE (window function)
+# ======================================================
+TODAYS_CHOICE_RANKINGS = ("newest", "best_selling", "daily")
+
+def _todays_choice_order(ranking: str):
+    if ranking == "newest":
+        return [models.Product.created_at.desc().nulls_last(), models.Product.id]
+    if ranking == "best_selling":
+        sold = (
+            select(func.coalesce(func.sum(models.OrderItem.quantity), 0))
+            .where(models.OrderItem.product_id == models.Product.id)
+            .correlate_except(models.OrderItem)
+            .scalar_subquery()
+        )
+        return [sold.desc(), models.Product.id]
+    if ranking == "daily":
+        # Aléatoire mais stable pour la journée : hash de l'id + date du jour
+        seed = func.md5(cast(models.Product.id, String) + cast(func.current_date(), String))
+        return [seed, models.Product.id]
+    raise ValueError(f"Unknown ranking: {ranking}")
+
+def todays_choice_select(ranking: str = "newest", size: int = 10):
+    """
+    Un seul SELECT : numérote les produits en stock dans chaque catégorie
+    (row_number() OVER (PARTITION BY category_id)) et garde les N premiers
+    de chacune, N = max(1, size // nombre de catégories).
+    """
+    ranked = (
+        select(
+            models.Product.id,
+            models.Product.category_id,
+            func.row_number().over(
+                partition_by=models.Product.category_id,
+                order_by=_todays_choice_order(ranking),
+            ).label("rank"),
+        )
+        # Comme l'ancienne boucle par catégorie : pas de produit sans catégorie
+        # (donc aucun produit quand il n'existe aucune catégorie)
+        .where(models.Product.stock > 0, models.Product.category_id.isnot(None))
+        .subquery("ranked")
+    )
+    category_count = select(func.count(models.Category.id)).scalar_subquery()
+    per_category = func.greatest(1, size // func.nullif(category_count, 0))
+    return (
+        product_cards_select()
+        .join(ranked, ranked.c.id == models.Product.id)
+        .where(ranked.c.rank <= per_category)
+        .order_by(ranked.c.rank, ranked.c.category_id)
+        .limit(size)
+    )
+
 # ======================================================
 # CRUD PANIER
 # ======================================================
-def add_to_cart(db: Session, user_id: str, product_id: str, quantity: int, price: float):
-    """Ajoute un produit au panier, crée le panier s'il n'existe pas"""
-    cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).first()
-    if not cart:
-        cart = models.Cart(user_id=user_id)
-        db.add(cart)
-        db.commit()
-        db.refresh(cart)
-    item = models.CartItem(cart_id=cart.id, product_id=product_id, quantity=quantity, price=price)
-    db.add(item)
+def cart_upsert_cte(user_id):
+    """Id du panier de l'utilisateur, créé au besoin, dans l'instruction qui l'utilise"""
+    stmt = insert(models.Cart).values(id=uuid.uuid4(), user_id=user_id)
+    # DO UPDATE sans effet plutôt que DO NOTHING : RETURNING renvoie aussi un panier existant
+    stmt = stmt.on_conflict_do_update(index_elements=[models.Cart.user_id], set_={"user_id": stmt.excluded.user_id})
+    return stmt.returning(models.Cart.id).cte("cart")
+
+def cart_items_upsert(user_id, quantities: dict, replace: bool = False):
+    """
+    Un seul INSERT ... ON CONFLICT (cart_id, product_id) pour {product_id: quantité},
+    au prix actuel du produit (un produit inconnu est ignoré). replace=False :
+    la quantité s'ajoute à celle de la ligne ; replace=True : elle la remplace.
+    """
+    cart = cart_upsert_cte(user_id)
+    lines = values(
+        column("id", UUID(as_uuid=True)), column("product_id", UUID(as_uuid=True)), column("quantity", Integer),
+        name="lines",
+    ).data([(uuid.uuid4(), product_id, quantity) for product_id, quantity in quantities.items()])
+    rows = (
+        select(lines.c.id, cart.c.id, models.Product.id, lines.c.quantity, effective_price())
+        .select_from(lines)
+        .join(models.Product, models.Product.id == lines.c.product_id)
+        .join(cart, true())
+    )
+    stmt = insert(models.CartItem).from_select(["id", "cart_id", "product_id", "quantity", "price"], rows)
+    quantity = stmt.excluded.quantity if replace else models.CartItem.quantity + stmt.excluded.quantity
+    return stmt.on_conflict_do_update(
+        index_elements=[models.CartItem.cart_id, models.CartItem.product_id],
+        set_={"quantity": quantity, "price": stmt.excluded.price},
+    ).returning(*models.CartItem.__table__.c)
+
+def cart_changes(items, replace: bool = False) -> dict:
+    """{product_id: quantité} ; un produit répété s'additionne (ou le dernier l'emporte si replace) :
+    ON CONFLICT ne peut pas modifier deux fois la même ligne"""
+    changes = {}
+    for item in items:
+        changes[item.product_id] = item.quantity + (0 if replace else changes.get(item.product_id, 0))
+    return changes
+
+def emptied_cart_items_delete(rows):
+    """Lignes tombées à 0 ou moins après l'upsert (None s'il n'y en a pas)"""
+    emptied = [row.id for row in rows if row.quantity <= 0]
+    return delete(models.CartItem).where(models.CartItem.id.in_(emptied)) if emptied else None
+
+def add_to_cart(db: Session, user_id: str, product_id: str, quantity: int):
+    """Ajoute un produit au panier (créé au besoin) en une instruction ; None si le produit n'existe pas"""
+    row = db.execute(cart_items_upsert(user_id, {product_id: quantity})).first()
     db.commit()
-    db.refresh(item)
-    return item
+    return row
+
+def update_cart_items(db: Session, user_id: str, changes: dict, replace: bool = False):
+    """Ajoute / ajuste plusieurs lignes (voir cart_items_upsert) ; les lignes à 0 ou moins sont retirées"""
+    rows = db.execute(cart_items_upsert(user_id, changes, replace)).all()
+    emptied = emptied_cart_items_delete(rows)
+    if emptied is not None:
+        db.execute(emptied)
+    db.commit()
+    return [row for row in rows if row.quantity > 0]
 
 def get_cart(db: Session, user_id: str):
     """Récupère le panier d'un utilisateur, le crée s'il n'existe pas"""
@@ -186,10 +715,13 @@ def get_cart(db: Session, user_id: str):
     # ✅ Si le panier n'existe pas, le créer
     if not cart:
         print(f"ℹ️ Création d'un nouveau panier pour l'utilisateur {user_id}")
-        cart = models.Cart(user_id=user_id)
-        db.add(cart)
+        # Deux premières lectures simultanées : une seule création (ux_paniers_user_id)
+        db.execute(
+            insert(models.Cart).values(id=uuid.uuid4(), user_id=user_id)
+            .on_conflict_do_nothing(index_elements=[models.Cart.user_id])
+        )
         db.commit()
-        db.refresh(cart)
+        cart = db.query(models.Cart).filter(models.Cart.user_id == user_id).first()
     
     return cart
 
@@ -258,14 +790,20 @@ def create_review(db: Session, user_id: str, product_id: str, rating: int, comme
 # ======================================================
 # CHATBOT - GROQ API
 # ======================================================
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# GROQ_BASE_URL (lu par le SDK) permet de viser un serveur compatible local
+# Échéance (s) et nouvelles tentatives : voir aussi llm.py. Le client sync ne
+# retente pas lui-même (chaque tentative repartirait avec LLM_TIMEOUT) : la
+# passerelle retente dans le temps restant avant une échéance unique. Le
+# flux async est borné par asyncio.timeout_at, tentatives du SDK comprises.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+client = Groq(api_key=os.getenv("GROQ_API_KEY"), timeout=LLM_TIMEOUT, max_retries=0)
+async_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
 MODEL_NAME = "llama-3.1-8b-instant"
+RECIPE_ERROR_MESSAGE = "Désolé, je ne peux pas générer de recette pour le moment. Veuillez réessayer."
 
-def generate_recipe(ingredients: list[str], user_message: str) -> str:
-    """
-    Génère une suggestion de recette marocaine basée sur les ingrédients disponibles
-    et le message de l'utilisateur
-    """
+def build_recipe_messages(ingredients: list[str], user_message: str) -> list[dict]:
+    """Messages envoyés au modèle (même prompt pour /chatbot et /chatbot/stream)"""
     ingredients_text = ", ".join(ingredients)
 
     prompt = f"""
@@ -291,18 +829,33 @@ Suggested dish: <dish name>
 Used ingredients: <only used ingredients>
 Missing ingredients: <only complementary ingredients>
 """
-
+    return [
+        {"role": "system", "content": "You are a strict Moroccan chef."},
+        {"role": "user", "content": prompt},
+    ]
+
+def request_recipe(ingredients: list[str], user_message: str, timeout: float = LLM_TIMEOUT) -> str:
+    """Appel brut à Groq, une seule tentative (lève en cas d'échec ; la passerelle llm.py retente et compte)"""
+    response = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=build_recipe_messages(ingredients, user_message),
+        temperature=0.2,
+        timeout=timeout,
+    )
+    return response.choices[0].message.content
+
+async def stream_recipe(ingredients: list[str], user_message: str):
+    """Même génération que request_recipe, morceau par morceau (stream=True, client async)"""
+    stream = await async_client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=build_recipe_messages(ingredients, user_message),
+        temperature=0.2,
+        stream=True,
+    )
     try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You are a strict Moroccan chef."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.2,
-        )
-
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f" Erreur lors de la génération de recette: {e}")
-        return "Désolé, je ne peux pas générer de recette pour le moment. Veuillez réessayer."
\ No newline at end of file
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Client parti en cours de route : on libère la connexion vers Groq
+        await stream.close()
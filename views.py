@@ -1,49 +1,77 @@
+import anyio
 from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from settings import create_access_token, create_refresh_token, decode_access_token
+from settings import (
+    get_refresh_token_payload,
+    TODAYS_CHOICE_RANKING, TODAYS_CHOICE_SIZE, engine, async_engine, DB_MAX_OVERFLOW,
+)
+from db_pool import pool_status
 import utils
+import schemas
+from cache import catalog_cache, principal_cache
+from autocomplete import autocomplete_index
+from llm import llm_gateway
+from passwords import password_hasher
+from tokens import token_denylist
+from recipes import recipe_matcher
+from chatbot import ingredient_index, ingredient_ranker, recipe_cache, suggest_recipe, recipe_sse_events, NO_INGREDIENTS_MESSAGE, SSE_HEADERS
+from fast_json import json_bytes, raw_json
+import events
 import models
 
 # ======================================================
 # AUTH
 # ======================================================
-def login_view(form_data: OAuth2PasswordRequestForm, db: Session):
-    user = utils.authenticate_user(db, form_data.username, form_data.password)
-    if not user:
+async def login_view(form_data: OAuth2PasswordRequestForm, db: Session):
+    # Route async : argon2 est attendu dans la boucle (pool de processus de
+    # passwords.py), le threadpool ne sert qu'aux requêtes SQL
+    user = await run_in_threadpool(utils.get_user_by_email, db, form_data.username)
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update_async(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": str(user.id)})
-    refresh_token = create_refresh_token(data={"sub": str(user.id)})
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    if new_hash:
+        # Paramètres argon2 changés : écrit au COMMIT de la nouvelle famille de jetons
+        user.hashed_password = new_hash
+    # Nouvelle famille de jetons : une par connexion
+    return await run_in_threadpool(utils.start_token_family, db, user)
 
 def refresh_token_view(refresh_token: str, db: Session):
+    payload = get_refresh_token_payload(refresh_token)
+    # Rotation : le jeton présenté ne sert qu'une fois
     try:
-        payload = decode_access_token(refresh_token)
-        user_id: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        if user_id is None or token_type != "refresh":
-            raise HTTPException(status_code=401, detail="Invalid refresh token")
-    except Exception:
+        return utils.rotate_refresh_token(db, payload)
+    except utils.InvalidRefreshToken:
         raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
 
-    user = db.query(models.UserProfile).filter(models.UserProfile.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    new_access_token = create_access_token(data={"sub": str(user.id)})
-    new_refresh_token = create_refresh_token(data={"sub": str(user.id)})
-
-    return {"access_token": new_access_token, "refresh_token": new_refresh_token, "token_type": "bearer"}
+def logout_view(refresh_token: str, db: Session):
+    payload = get_refresh_token_payload(refresh_token)
+    try:
+        utils.revoke_token_family(db, payload)
+    except utils.InvalidRefreshToken:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
 
 # ======================================================
 # USERS
 # ======================================================
-def create_user_view(user, db: Session):
-    return utils.create_user(db, user)
+async def create_user_view(user, db: Session):
+    try:
+        # Conditions et doublon vérifiés avant de payer argon2 ; hachage attendu hors du threadpool
+        utils.require_terms(user)
+        if await run_in_threadpool(utils.get_user_by_email, db, user.email):
+            raise utils.DuplicateEmailError(user.email)
+        hashed_password = await password_hasher.hash_async(user.password)
+        return await run_in_threadpool(utils.create_user, db, user, hashed_password)
+    except utils.DuplicateEmailError:
+        raise HTTPException(status_code=409, detail="Email already registered")
 
 def get_user_view(user_id: str, db: Session):
     user = utils.get_user(db, user_id)
@@ -52,7 +80,10 @@ def get_user_view(user_id: str, db: Session):
     return user
 
 def update_user_view(user_id: str, updates, db: Session):
-    user = utils.update_user(db, user_id, updates)
+    try:
+        user = utils.update_user(db, user_id, updates)
+    except utils.DuplicateEmailError:
+        raise HTTPException(status_code=409, detail="Email already registered")
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -70,10 +101,13 @@ def create_category_view(category, db: Session):
     return utils.create_category(db, category)
 
 def get_category_view(category_id: str, db: Session):
-    category = utils.get_category(db, category_id)
+    def load():
+        category = utils.get_category(db, category_id)
+        return json_bytes(schemas.CategoryRead.model_validate(category)) if category else None
+    category = catalog_cache.get_or_load(("category", str(category_id)), load, tags=(f"category:{category_id}",))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    return category
+    return raw_json(category)
 
 def update_category_view(category_id: str, updates, db: Session):
     category = utils.update_category(db, category_id, updates)
@@ -89,8 +123,18 @@ def delete_category_view(category_id: str, db: Session):
 
 def list_categories_view(db: Session):
     """Liste toutes les catégories"""
-    categories = db.query(models.Category).all()
-    return categories
+    def load():
+        categories = db.query(models.Category).all()
+        return json_bytes([schemas.CategoryRead.model_validate(c) for c in categories])
+    return raw_json(catalog_cache.get_or_load(("categories",), load, tags=("categories",)))
+
+def browse_categories_view(db: Session):
+    """Catégories + compteurs en stock / promo + histogramme des prix (UNE SEULE requête)"""
+    return raw_json(catalog_cache.get_or_load(
+        ("categories_browse",),
+        lambda: json_bytes(utils.to_category_facets(db.execute(utils.category_facets_select()).all())),
+        tags=("products", "categories"),
+    ))
 
 # ======================================================
 # PRODUCTS
@@ -99,10 +143,13 @@ def create_product_view(product, db: Session):
     return utils.create_product(db, product)
 
 def get_product_view(product_id: str, db: Session):
-    product = utils.get_product(db, product_id)
+    def load():
+        product = utils.get_product(db, product_id)
+        return json_bytes(schemas.ProductRead.model_validate(product)) if product else None
+    product = catalog_cache.get_or_load(("product", str(product_id)), load, tags=(f"product:{product_id}",))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return raw_json(product)
 
 def update_product_view(product_id: str, updates, db: Session):
     product = utils.update_product(db, product_id, updates)
@@ -116,41 +163,33 @@ def delete_product_view(product_id: str, db: Session):
         raise HTTPException(status_code=404, detail="Product not found")
     return {"detail": "Product deleted"}
 
-def list_products_view(db: Session):
-    """Liste tous les produits avec leurs images (OPTIMISÉ)"""
-    from sqlalchemy.orm import joinedload
-    
-    # Récupérer tous les produits avec leurs images en UNE SEULE requête
-    products = db.query(models.Product).options(
-        joinedload(models.Product.images)
-    ).all()
-    
-    result = []
-    for product in products:
-        # Trouver l'image principale ou la première disponible
-        main_image = None
-        if product.images:
-            # Chercher l'image principale
-            main_image = next((img for img in product.images if img.is_main), None)
-            # Si pas d'image principale, prendre la première
-            if not main_image and len(product.images) > 0:
-                main_image = product.images[0]
-        
-        # Construire le dictionnaire du produit
-        product_dict = {
-            "id": str(product.id),
-            "name": product.name,
-            "description": product.description,
-            "price": product.price,
-            "promo_price": product.promo_price,
-            "stock": product.stock,
-            "category_id": str(product.category_id) if product.category_id else None,
-            "weight": product.weight if hasattr(product, 'weight') else "1kg",
-            "image": main_image.image_url if main_image else "https://via.placeholder.com/150"
-        }
-        result.append(product_dict)
-    
-    return result
+def list_products_view(params: schemas.ProductListQuery, db: Session):
+    """Page de produits (curseur + filtres), avec l'image principale en UNE SEULE requête"""
+    try:
+        stmt = utils.product_page_select(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return raw_json(catalog_cache.get_or_load(
+        ("products", params.model_dump_json()),
+        lambda: json_bytes(utils.to_product_page(db.execute(stmt).all(), params.limit, params.sort)),
+        tags=("products",),
+    ))
+
+def search_products_view(params: schemas.ProductSearchQuery, db: Session):
+    """Recherche plein texte (sans accents, tolérante aux fautes), triée par pertinence"""
+    try:
+        stmt = utils.product_search_select(params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return raw_json(catalog_cache.get_or_load(
+        ("search", params.model_dump_json()),
+        lambda: json_bytes(utils.to_product_page(db.execute(stmt).all(), params.limit, "relevance")),
+        tags=("products",),
+    ))
+
+def export_products_view():
+    """Export complet du catalogue en NDJSON, envoyé au fil de la lecture"""
+    return StreamingResponse(utils.iter_catalog_ndjson(), media_type="application/x-ndjson")
 
 # ======================================================
 # PRODUCT IMAGES
@@ -164,14 +203,21 @@ def get_product_images_view(product_id: str, db: Session):
 # ======================================================
 # CART
 # ======================================================
-def add_to_cart_view(user_id: str, product_id: str, quantity: int, price: float, db: Session):
-    return utils.add_to_cart(db, user_id, product_id, quantity, price)
+def add_to_cart_view(user_id: str, product_id: str, quantity: int, db: Session):
+    item = utils.add_to_cart(db, user_id, product_id, quantity)
+    if not item:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return item
+
+def update_cart_items_view(user_id: str, update, db: Session):
+    changes = utils.cart_changes(update.items, update.replace)
+    return utils.update_cart_items(db, user_id, changes, update.replace)
 
 def get_cart_view(user_id: str, db: Session):
     cart = utils.get_cart(db, user_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    return cart
+    return raw_json(json_bytes(schemas.CartRead.model_validate(cart)))
 
 def clear_cart_view(cart_id: str, db: Session):
     cart = utils.clear_cart(db, cart_id)
@@ -200,131 +246,112 @@ def create_review_view(user_id: str, product_id: str, rating: int, comment: str,
 # ======================================================
 # FILTERED PRODUCTS (Today's choice, Limited discount, Cheapest)
 # ======================================================
-def get_todays_choice_view(db: Session):
-    """Récupère 10 produits de différentes catégories pour Today's choice"""
-    # Récupérer toutes les catégories
-    categories = db.query(models.Category).all()
-    
-    if not categories:
-        return []
-    
-    result = []
-    products_per_category = max(1, 10 // len(categories))
-    
-    for category in categories:
-        # Prendre quelques produits de chaque catégorie
-        products = db.query(models.Product).filter(
-            models.Product.category_id == category.id,
-            models.Product.stock > 0
-        ).limit(products_per_category).all()
-        
-        for product in products:
-            # Récupérer l'image du produit
-            main_image = db.query(models.ProductImage).filter(
-                models.ProductImage.product_id == product.id,
-                models.ProductImage.is_main == True
-            ).first()
-            
-            if not main_image:
-                main_image = db.query(models.ProductImage).filter(
-                    models.ProductImage.product_id == product.id
-                ).first()
-            
-            result.append({
-                "id": str(product.id),
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "promo_price": product.promo_price,
-                "stock": product.stock,
-                "category_id": str(product.category_id),
-                "weight": product.weight if hasattr(product, 'weight') else "1kg",
-                "image": main_image.image_url if main_image else "https://via.placeholder.com/150"
-            })
-            
-            if len(result) >= 10:
-                break
-        
-        if len(result) >= 10:
-            break
-    
-    return result
+def get_todays_choice_view(db: Session, ranking: str = TODAYS_CHOICE_RANKING):
+    """Récupère 10 produits de différentes catégories pour Today's choice (UNE SEULE requête)"""
+    if ranking not in utils.TODAYS_CHOICE_RANKINGS:
+        raise HTTPException(status_code=400, detail=f"Unknown ranking: {ranking}")
+    return raw_json(catalog_cache.get_or_load(
+        ("todays_choice", ranking),
+        lambda: json_bytes(utils.get_product_cards(db, utils.todays_choice_select(ranking, TODAYS_CHOICE_SIZE))),
+        tags=("products", "categories"),
+    ))
 
 
 def get_limited_discount_view(db: Session):
     """Récupère les 10 produits avec promo"""
-    products = db.query(models.Product).filter(
+    stmt = utils.product_cards_select().where(
         models.Product.promo_price.isnot(None),
         models.Product.stock > 0
-    ).limit(10).all()
-    
-    result = []
-    for product in products:
-        # Récupérer l'image du produit
-        main_image = db.query(models.ProductImage).filter(
-            models.ProductImage.product_id == product.id,
-            models.ProductImage.is_main == True
-        ).first()
-        
-        if not main_image:
-            main_image = db.query(models.ProductImage).filter(
-                models.ProductImage.product_id == product.id
-            ).first()
-        
-        result.append({
-            "id": str(product.id),
-            "name": product.name,
-            "description": product.description,
-            "price": product.price,
-            "promo_price": product.promo_price,
-            "stock": product.stock,
-            "category_id": str(product.category_id) if product.category_id else None,
-            "weight": product.weight if hasattr(product, 'weight') else "1kg",
-            "image": main_image.image_url if main_image else "https://via.placeholder.com/150"
-        })
-    
-    return result
+    ).limit(10)
+    return raw_json(catalog_cache.get_or_load(
+        ("limited_discount",), lambda: json_bytes(utils.get_product_cards(db, stmt)), tags=("products",)
+    ))
 
 
 def get_cheapest_products_view(db: Session):
     """Récupère les 10 produits les moins chers"""
-    from sqlalchemy import case
-
-    
-    
-    # Utiliser le prix promo s'il existe, sinon le prix normal
-    products = db.query(models.Product).filter(
+    # Prix promo s'il existe, sinon prix normal (servi par ix_produits_effective_price_id)
+    stmt = utils.product_cards_select().where(
         models.Product.stock > 0
     ).order_by(
-        case(
-            (models.Product.promo_price.isnot(None), models.Product.promo_price),
-            else_=models.Product.price
-        )
-    ).limit(10).all()
-    
-    result = []
-    for product in products:
-        # Récupérer l'image du produit
-        main_image = db.query(models.ProductImage).filter(
-            models.ProductImage.product_id == product.id,
-            models.ProductImage.is_main == True
-        ).first()
-        
-        if not main_image:
-            main_image = db.query(models.ProductImage).filter(
-                models.ProductImage.product_id == product.id
-            ).first()
-        
-        result.append({
-            "id": str(product.id),
-            "name": product.name,
-            "description": product.description,
-            "price": product.price,
-            "promo_price": product.promo_price,
-            "stock": product.stock,
-            "category_id": str(product.category_id) if product.category_id else None,
-            "weight": product.weight if hasattr(product, 'weight') else "1kg",
-            "image": main_image.image_url if main_image else "https://via.placeholder.com/150"
-        })
-    
-    return result
\ No newline at end of file
+        utils.effective_price(), models.Product.id
+    ).limit(10)
+    return raw_json(catalog_cache.get_or_load(
+        ("cheapest",), lambda: json_bytes(utils.get_product_cards(db, stmt)), tags=("products",)
+    ))
+
+
+# ======================================================
+# CHATBOT
+# ======================================================
+def recipe_chatbot_view(user_message: str):
+    print(f"📥 Requête chatbot reçue: {user_message}")
+
+    # Index en mémoire : ne relit la base qu'après un changement du catalogue
+    ingredients, digest = ingredient_index.snapshot()
+
+    if not ingredients:
+        return {
+            "ingredients": [],
+            "chatbot_response": NO_INGREDIENTS_MESSAGE
+        }
+
+    print(f"📦 {len(ingredients)} ingrédients disponibles")
+
+    # Recette locale si le plat est reconnu, sinon Groq (ou le cache)
+    response = suggest_recipe(user_message, ingredients, digest)
+
+    print(f"✅ Réponse générée: {response[:100]}...")
+
+    return {
+        "ingredients": ingredients,
+        "chatbot_response": response
+    }
+
+def recipe_chatbot_stream_view(user_message: str):
+    """Même réponse que /chatbot, envoyée en Server-Sent Events au fil de la génération"""
+    ingredients, digest = ingredient_index.snapshot()
+    return StreamingResponse(
+        recipe_sse_events(user_message, ingredients, digest), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+# ======================================================
+# AUTOCOMPLETE
+# ======================================================
+def autocomplete_view(q: str, limit: int):
+    """Suggestions (produits et catégories) depuis l'index de préfixes en mémoire"""
+    return autocomplete_index.lookup(q, limit)
+
+# ======================================================
+# METRICS
+# ======================================================
+def threadpool_status() -> dict:
+    """Threadpool anyio des routes sync : threads occupés (hors /metrics) et tâches en attente"""
+    limiter = anyio.from_thread.run_sync(anyio.to_thread.current_default_thread_limiter)
+    # Appelée depuis la route sync /metrics, donc depuis un thread du threadpool
+    # (from_thread.run_sync échoue ailleurs) : ce thread tient lui-même un jeton
+    own_token = 1
+    return {
+        "size": limiter.total_tokens,
+        "busy": limiter.borrowed_tokens - own_token,
+        "waiting": limiter.statistics().tasks_waiting,
+    }
+
+def metrics_view():
+    """Métriques internes du worker (pools de connexions, threadpool...)"""
+    return {
+        "threadpool": threadpool_status(),
+        "db_pool": pool_status(engine, DB_MAX_OVERFLOW),
+        "db_pool_async": pool_status(async_engine, DB_MAX_OVERFLOW),
+        "catalog_cache": catalog_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "token_denylist": token_denylist.stats(),
+        "passwords": password_hasher.stats(),
+        "catalog_events": events.listener_status(),
+        "autocomplete": autocomplete_index.stats(),
+        "chatbot_ingredients": ingredient_index.stats(),
+        "chatbot_prompt": ingredient_ranker.stats(),
+        "recipe_cache": recipe_cache.stats(),
+        "recipe_matcher": recipe_matcher.stats(),
+        "llm": llm_gateway.stats(),
+    }